@@ -1,4 +1,5 @@
-from models import Album
+from models import Album, PhotoSnapshot
+from datetime import datetime
 from uuid import uuid4
 from mongoengine import DoesNotExist
 
@@ -15,13 +16,33 @@ def create_album_in_db(display_name: str, title: str, description: str, cover_ph
     return album
 
 
-def mongo_get_albums_by_name(display_name, offset, limit):
-    try:
-        qs = Album.objects(display_name=display_name).order_by('-created_at').skip(offset).limit(limit)
-        has_more = qs.count(with_limit_and_skip=False) > (offset + limit)
-    except Exception as e:
-        raise
-    return has_more, qs
+# Album listings leave out the photos and snapshots, which make most of
+# an album document: only their number is sent
+ALBUM_SUMMARY = {'_id': 0, 'album_id': 1, 'display_name': 1, 'title': 1, 'description': 1,
+                 'cover_photo_id': 1, 'created_at': 1, 'version': 1,
+                 'photo_count': {'$size': {'$ifNull': ['$photos', []]}}}
+
+
+def mongo_get_albums_by_name(display_name, offset, limit, after=None):
+    """A page of the albums of `display_name`, newest first, as summaries:
+    (has_more, albums). With `after`, the (created_at, album_id) of the last
+    album of the previous page, the page starts right after it and `offset`
+    is ignored."""
+    query = {'display_name': display_name}
+    if after is not None:
+        (created_at, album_id) = after
+        query['$or'] = [{'created_at': {'$lt': created_at}},
+                        {'created_at': created_at, 'album_id': {'$lt': album_id}}]
+        offset = 0
+    pipeline = [{'$match': query},
+                {'$sort': {'created_at': -1, 'album_id': -1}}]
+    if offset:
+        pipeline.append({'$skip': offset})
+    # One more than asked for tells whether there is a next page
+    pipeline += [{'$limit': limit + 1},
+                 {'$project': ALBUM_SUMMARY}]
+    albums = list(Album._get_collection().aggregate(pipeline))
+    return len(albums) > limit, albums[:limit]
 
 
 def mongo_get_album_by_id(display_name: str, album_id: str):
@@ -52,7 +73,7 @@ def mongo_update_album(display_name: str, album_id: str, title: str = None, desc
         if not update_fields:
             return None    # Prevent accidental empty updates
         
-        album.update(**update_fields)
+        album.update(inc__version=1, **update_fields)
         album.reload()
         
         album_data = album
@@ -74,32 +95,41 @@ def mongo_delete_album(display_name: str, album_id: str):
         raise
 
 def mongo_add_photo_to_album(display_name: str, album_id: str, photo_id: str):
-    try:
-        album = Album.objects(display_name=display_name, album_id=album_id).first()
-        if not album:
-            return None
-        if photo_id in album.photos:
-            return album
-        album.update(push__photos=photo_id)
-        album.reload()
-        return album
-    except Exception as e:
-        raise
+    return mongo_add_photos_to_album(display_name, album_id, [photo_id])
 
 
 def mongo_remove_photo_from_album(display_name: str, album_id: str, photo_id: str):
-    try:
+    return mongo_remove_photos_from_album(display_name, album_id, [photo_id])
+
+
+def mongo_add_photos_to_album(display_name: str, album_id: str, photo_ids: list):
+    """Add `photo_ids` to an album with one atomic update ($addToSet); return
+    the album as updated, or None if there is no such album. The version is
+    bumped only if a photo was not in the album yet."""
+    album = Album.objects(display_name=display_name, album_id=album_id,
+                          __raw__={'photos': {'$not': {'$all': photo_ids}}}).modify(
+        new=True, add_to_set__photos=photo_ids, inc__version=1)
+    if album is None:
+        # No such album, or all the photos in it already
         album = Album.objects(display_name=display_name, album_id=album_id).first()
-        if not album :
-            return None
-        if photo_id in album.photos :
-            album.update(pull__photos=photo_id)
-            album.reload()
-            
-        return album
-    except Exception as e:
-        raise
-    
+    return album
+
+
+def mongo_remove_photos_from_album(display_name: str, album_id: str, photo_ids: list):
+    """Remove `photo_ids` and their snapshots from an album with one atomic
+    update ($pull); return the album as updated, or None if there is no such
+    album. The version is bumped only if a photo was in the album."""
+    album = Album.objects(display_name=display_name, album_id=album_id,
+                          photos__in=photo_ids).modify(
+        new=True, inc__version=1,
+        __raw__={'$pull': {'photos': {'$in': photo_ids},
+                           'snapshots': {'photo_id': {'$in': photo_ids}}}})
+    if album is None:
+        # No such album, or none of the photos in it
+        album = Album.objects(display_name=display_name, album_id=album_id).first()
+    return album
+
+
 def mongo_get_photos_in_album(display_name: str, album_id: str):
     try:
         album = Album.objects(display_name=display_name, album_id=album_id).first()
@@ -109,6 +139,53 @@ def mongo_get_photos_in_album(display_name: str, album_id: str):
     except Exception as e:
         raise        
 
+def mongo_get_album_archive(display_name: str, album_id: str):
+    """The album with its photos and version only, or None."""
+    return Album.objects(display_name=display_name, album_id=album_id).only(
+        'album_id', 'photos', 'version').first()
+
+
+def mongo_get_album_snapshots(display_name: str, album_id: str):
+    """The album with its photos and their snapshots only, or None."""
+    return Album.objects(display_name=display_name, album_id=album_id).only(
+        'album_id', 'photos', 'snapshots', 'snapshots_refreshed_at').first()
+
+
+def mongo_set_photo_snapshot(display_name: str, album_id: str, metadata: dict):
+    """Replace the snapshot of one photo of an album by `metadata`, the
+    attributes the photo-service has for it."""
+    snapshot = PhotoSnapshot(photo_id=str(metadata["photo_id"]), title=metadata.get("title"),
+                             location=metadata.get("location"), tags=metadata.get("tags", []))
+    albums = Album.objects(display_name=display_name, album_id=album_id,
+                           photos=snapshot.photo_id)
+    albums.update(pull__snapshots__photo_id=snapshot.photo_id)
+    albums.update(push__snapshots=snapshot)
+
+
+def mongo_set_album_snapshots(display_name: str, album_id: str, metadata: list):
+    """Replace all the snapshots of an album, with a single update."""
+    snapshots = [PhotoSnapshot(photo_id=str(photo["photo_id"]), title=photo.get("title"),
+                               location=photo.get("location"), tags=photo.get("tags", []))
+                 for photo in metadata]
+    Album.objects(display_name=display_name, album_id=album_id).update(
+        set__snapshots=snapshots, set__snapshots_refreshed_at=datetime.utcnow())
+
+
+def mongo_remove_photos_from_albums(display_name: str, photo_ids: list):
+    """Remove `photo_ids` and their snapshots from every album of
+    `display_name` with any of them, bumping their versions, with a single
+    update; return how many albums changed."""
+    return Album.objects(display_name=display_name, photos__in=photo_ids).update(
+        inc__version=1,
+        __raw__={'$pull': {'photos': {'$in': photo_ids},
+                           'snapshots': {'photo_id': {'$in': photo_ids}}}})
+
+
+def mongo_get_albums_with_photos(display_name: str, photo_ids: list):
+    """The ids of the albums of `display_name` with any of `photo_ids`."""
+    return list(Album.objects(display_name=display_name, photos__in=photo_ids).scalar('album_id'))
+
+
 def serialize_album(album):
     album_dict = album.to_mongo().to_dict()
     album_dict["_id"] = str(album_dict["_id"])
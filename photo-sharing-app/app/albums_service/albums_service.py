@@ -3,20 +3,26 @@
 import uvicorn
 import requests
 from requests.exceptions import RequestException
-import io
-import zipfile
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
 
 import logging
-from fastapi import FastAPI, HTTPException
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query
 from mongoengine import connect
 from pydantic_settings import BaseSettings
 from albums_mongo_wrapper import *
+from photographer_client import PhotographerClient
+from zip_stream import zip_stream, prefetch
+from archive_cache import ArchiveCache
+from pagination import encode_album_cursor, decode_album_cursor
 from models import (
     AlbumCreate,
     AlbumUpdate,
-    PhotoAdd
+    PhotoAdd,
+    PhotosBatch,
+    PhotosChanged
 )
 
 # Configuration Settings
@@ -33,6 +39,35 @@ class Settings(BaseSettings):
     photo_host: str = "photo-service"
     photo_port: str = "8001"
 
+    # Photographer lookups: seconds a photographer is known to exist, or not
+    # to exist, how many of them are remembered, and the connection pool size
+    photographer_cache_ttl: float = 30
+    photographer_cache_negative_ttl: float = 5
+    photographer_cache_size: int = 10000
+    photographer_max_connections: int = 100
+    photographer_timeout: float = 5
+    # Seconds to answer a request for the attributes of all the photos of
+    # an album
+    photo_timeout: float = 30
+    # Photos fetched ahead, concurrently, while an album archive is sent, and
+    # connections to the photo-service kept open for that
+    archive_prefetch: int = 4
+    photo_max_connections: int = 100
+    # Local directory of the album archives already sent ("" = no cache), and
+    # the bytes they may take before the least recently served are deleted
+    archive_cache_dir: str = "/tmp/album-archives"
+    archive_cache_max_bytes: int = 2 * 1024 ** 3
+    # Photos added to or removed from an album with one request at most
+    album_batch_max_photos: int = 1000
+    # Photos whose attributes, or existence, are asked of the photo-service
+    # with one request: at most its bulk_read_max_items
+    photo_batch_size: int = 1000
+    # Seconds the photo attributes snapshotted in an album are served before
+    # being fetched again, in the background, from the photo-service
+    photo_snapshot_max_age: float = 300
+    # Most albums returned by one page of a photographer's albums
+    page_max_limit: int = 100
+
 settings = Settings()
 
 # Initialize FastAPI app
@@ -47,6 +82,20 @@ logger.handlers = gunicorn_logger.handlers
 photographer_service = f"http://{settings.photographer_host}:{settings.photographer_port}/"
 photo_service = f"http://{settings.photo_host}:{settings.photo_port}/"
 
+photographers = PhotographerClient(photographer_service, settings.photographer_timeout,
+                                   ttl=settings.photographer_cache_ttl,
+                                   negative_ttl=settings.photographer_cache_negative_ttl,
+                                   max_entries=settings.photographer_cache_size,
+                                   max_connections=settings.photographer_max_connections)
+
+# Connections to the photo-service kept open, for the existence checks and
+# the archive prefetch threads
+photo_session = requests.Session()
+photo_session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=settings.photo_max_connections))
+
+archive_cache = (ArchiveCache(settings.archive_cache_dir, settings.archive_cache_max_bytes)
+                 if settings.archive_cache_dir else None)
+
 @app.on_event("startup")
 def startup_event():
     conn = f"mongodb://"
@@ -55,18 +104,73 @@ def startup_event():
     conn += f"{settings.mongo_host}:{settings.mongo_port}/{settings.database_name}?authSource={settings.auth_database_name}"
     connect(settings.database_name, host=conn)
 
-@app.post("/photographers/{display_name}/albums", status_code=201)
-def create_album(display_name: str, album: AlbumCreate):
+def check_photographer(display_name: str):
+    """Raise the HTTPException to answer if the photographer does not exist."""
     try:
-        response = requests.get(f"{photographer_service}photographer/{display_name}")
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Photographer Not Found")
-        elif response.status_code == 503:
-            raise HTTPException(status_code=503, detail="Photographer Service Unavailable")
-        # elif response.status_code != 200:
-        #     raise HTTPException(status_code=response.status_code, detail="Error contacting Photographer Service")
+        status = photographers.lookup(display_name)
+    except requests.exceptions.Timeout:
+        raise HTTPException(status_code=504, detail="Photographer Service Timeout")
     except RequestException:
         raise HTTPException(status_code=503, detail="Photographer Service Unreachable")
+    if status == 404:
+        raise HTTPException(status_code=404, detail="Photographer Not Found")
+    elif status == 503:
+        raise HTTPException(status_code=503, detail="Photographer Service Unavailable")
+
+def photo_batches(photo_ids):
+    """`photo_ids` in lists small enough for one request to the photo-service."""
+    size = settings.photo_batch_size
+    return [photo_ids[start:start + size] for start in range(0, len(photo_ids), size)]
+
+def get_photos_metadata(display_name: str, photo_ids):
+    """The attributes of the photos `photo_ids` that the photo-service has,
+    fetched with a request per batch of ids; None if it could not be asked."""
+    # Photo ids are integers in the photo-service: others are not there
+    ids = [int(photo_id) for photo_id in photo_ids if str(photo_id).isdigit()]
+    metadata = []
+    for batch in photo_batches(ids):
+        try:
+            response = requests.post(f"{photo_service}photo/{display_name}/attributes",
+                                     json={"ids": batch}, timeout=settings.photo_timeout)
+        except RequestException:
+            logger.warning(f"Could not retrieve metadata for the photos of {display_name}")
+            return None
+        if response.status_code != 200:
+            logger.warning(f"Could not retrieve metadata for the photos of {display_name}: "
+                           f"{response.status_code}")
+            return None
+        metadata += [dict(item["attributes"], photo_id=item["photo_id"])
+                     for item in response.json()["items"] if item["attributes"] is not None]
+    return metadata
+
+def refresh_album_snapshots(display_name: str, album_id: str):
+    """Snapshot the attributes of all the photos of an album again."""
+    photo_ids = mongo_get_photos_in_album(display_name, album_id)
+    if photo_ids is None:
+        return
+    metadata = get_photos_metadata(display_name, photo_ids)
+    # Until the photo-service answers, the snapshots we have are kept
+    if metadata is not None:
+        mongo_set_album_snapshots(display_name, album_id, metadata)
+
+def snapshot_photo(display_name: str, album_id: str, photo_id: str):
+    for metadata in get_photos_metadata(display_name, [photo_id]) or []:
+        mongo_set_photo_snapshot(display_name, album_id, metadata)
+
+@app.get("/cache/photographers", status_code=200)
+def get_photographer_cache_stats():
+    """Hit ratio and latency of the photographer lookups."""
+    return photographers.cache_stats()
+
+@app.delete("/cache/photographers/{display_name}", status_code=204)
+def invalidate_photographer(display_name: str):
+    # Called by the photographer service when a photographer is updated or
+    # deleted
+    photographers.invalidate(display_name)
+
+@app.post("/photographers/{display_name}/albums", status_code=201)
+def create_album(display_name: str, album: AlbumCreate):
+    check_photographer(display_name)
     
     try:
         album = create_album_in_db(display_name, album.title, album.description, album.cover_photo_id)
@@ -80,43 +184,33 @@ def create_album(display_name: str, album: AlbumCreate):
     
 
 @app.get("/photographers/{display_name}/albums", status_code=200)
-def get_albums(display_name: str, offset: int = 0, limit: int = 10):
+def get_albums(display_name: str, offset: int = Query(0, ge=0),
+               limit: int = Query(10, ge=1, le=settings.page_max_limit),
+               after: Optional[str] = None):
+    """The albums of a photographer, newest first, with the number of their
+    photos but not the photos. Pages follow one another with `after`, the
+    next_cursor of the previous page."""
     logger.info("Getting albums...")            
-    list_of_albums = list()
-    
-    # Check if photographer exists
     try:
-        response = requests.get(f"{photographer_service}photographer/{display_name}", timeout=500000000)
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Photographer Not Found")
-        # elif response.status_code == 503:
-        #     raise HTTPException(status_code=503, detail="Photographer Service Unavailable")
-        # elif response.status_code != 200:
-        #     raise HTTPException(status_code=response.status_code, detail="Error contacting Photographer Service")
-    except requests.exceptions.Timeout:
-        raise HTTPException(status_code=504, detail="Photographer Service Timeout")
-    except requests.exceptions.RequestException:
-        raise HTTPException(status_code=503, detail="Photographer Service Unreachable")
+        after_key = decode_album_cursor(after) if after is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # Check if photographer exists
+    check_photographer(display_name)
 
     # Fetch albums from database
     try:
-        has_more, albums = mongo_get_albums_by_name(display_name, offset, limit)
-        if not albums:
-            raise HTTPException(status_code=204, detail="No Albums Found")
-        
-        for album in albums:
-            album_data = album.to_mongo().to_dict()
-            album_data.pop('_id')  # Remove internal MongoDB ID
-            list_of_albums.append(album_data)
-    
+        has_more, albums = mongo_get_albums_by_name(display_name, offset, limit, after_key)
     except Exception as e:
         logger.error(f"Error retrieving albums: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
+    if not albums:
+        raise HTTPException(status_code=204, detail="No Albums Found")
 
-    return {"items": list_of_albums, "has_more": has_more}
-
-
-
+    next_cursor = (encode_album_cursor(albums[-1]['created_at'], albums[-1]['album_id'])
+                   if has_more else None)
+    return {"items": albums, "has_more": has_more, "next_cursor": next_cursor}
 
 
 @app.get("/photographers/{display_name}/albums/{album_id}", status_code=200)
@@ -124,18 +218,7 @@ def get_album(display_name: str, album_id: str):
     logger.info(f"Retrieving album {album_id} for photographer {display_name}...")
     
     # Check if photographer exists
-    try:
-        response = requests.get(f"{photographer_service}photographer/{display_name}", timeout=500)
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Photographer Not Found")
-        # elif response.status_code == 503:
-        #     raise HTTPException(status_code=503, detail="Photographer Service Unavailable")
-        # elif response.status_code != 200:
-        #     raise HTTPException(status_code=response.status_code, detail="Error contacting Photographer Service")
-    except requests.exceptions.Timeout:
-        raise HTTPException(status_code=504, detail="Photographer Service Timeout")
-    except requests.exceptions.RequestException:
-        raise HTTPException(status_code=503, detail="Photographer Service Unreachable")
+    check_photographer(display_name)
 
     # Fetch album from database
     try:
@@ -157,18 +240,7 @@ def update_album(display_name: str, album_id: str, album: AlbumUpdate):
     logger.info(f"Updating album {album_id} for photographer {display_name}...")
     
     # Check if photographer exists
-    try:
-        response = requests.get(f"{photographer_service}photographer/{display_name}", timeout=500)
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Photographer Not Found")
-        # elif response.status_code == 503:
-        #     raise HTTPException(status_code=503, detail="Photographer Service Unavailable")
-        # elif response.status_code != 200:
-        #     raise HTTPException(status_code=response.status_code, detail="Error contacting Photographer Service")
-    except requests.exceptions.Timeout:
-        raise HTTPException(status_code=504, detail="Photographer Service Timeout")
-    except requests.exceptions.RequestException:
-        raise HTTPException(status_code=503, detail="Photographer Service Unreachable")
+    check_photographer(display_name)
 
     # Update album in database
     try:
@@ -193,18 +265,7 @@ def delete_album(display_name: str, album_id: str):
     logger.info(f"Deleting album {album_id} for photographer {display_name}...")
     
     # Check if photographer exists
-    try:
-        response = requests.get(f"{photographer_service}photographer/{display_name}", timeout=500)
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Photographer Not Found")
-        # elif response.status_code == 503:
-        #     raise HTTPException(status_code=503, detail="Photographer Service Unavailable")
-        # elif response.status_code != 200:
-        #     raise HTTPException(status_code=response.status_code, detail="Error contacting Photographer Service")
-    except requests.exceptions.Timeout:
-        raise HTTPException(status_code=504, detail="Photographer Service Timeout")
-    except requests.exceptions.RequestException:
-        raise HTTPException(status_code=503, detail="Photographer Service Unreachable")
+    check_photographer(display_name)
 
     # Delete album from database
     try:
@@ -222,26 +283,17 @@ def delete_album(display_name: str, album_id: str):
 
 
 @app.post("/photographers/{display_name}/albums/{album_id}/photos", status_code=201)
-def add_photo_to_album(display_name: str, album_id: str, photo:PhotoAdd):
+def add_photo_to_album(display_name: str, album_id: str, photo:PhotoAdd,
+                       background_tasks: BackgroundTasks):
     logger.info(f"Adding photo {photo.photo_id} to album {album_id} for photographer {display_name}...")
     
     # Check if photographer exists
-    try:
-        response = requests.get(f"{photographer_service}photographer/{display_name}", timeout=5000000)
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Photographer Not Found")
-        elif response.status_code == 503:
-            raise HTTPException(status_code=503, detail="Photographer Service Unavailable")
-        # elif response.status_code != 200:
-        #     raise HTTPException(status_code=response.status_code, detail="Error contacting Photographer Service")
-    except requests.exceptions.Timeout:
-        raise HTTPException(status_code=504, detail="Photographer Service Timeout")
-    except requests.exceptions.RequestException:
-        raise HTTPException(status_code=503, detail="Photographer Service Unreachable")
+    check_photographer(display_name)
 
     # Check if photo exists
     try:
-        response = requests.get(f"{photo_service}photo/{display_name}/{photo.photo_id}")
+        response = photo_session.head(f"{photo_service}photo/{display_name}/{photo.photo_id}",
+                                      timeout=settings.photo_timeout)
         if response.status_code == 404:
             raise HTTPException(status_code=404, detail="Photo Not Found")
         # elif response.status_code == 503:
@@ -258,6 +310,7 @@ def add_photo_to_album(display_name: str, album_id: str, photo:PhotoAdd):
         updated_album = mongo_add_photo_to_album(display_name, album_id, photo.photo_id)
         if not updated_album:
             raise HTTPException(status_code=404, detail="Album Not Found")
+        background_tasks.add_task(snapshot_photo, display_name, album_id, photo.photo_id)
         return serialize_album(updated_album)
     
     except Exception as e:
@@ -268,27 +321,81 @@ def add_photo_to_album(display_name: str, album_id: str, photo:PhotoAdd):
 
 
 
+def missing_photos(display_name: str, photo_ids):
+    """The ones of `photo_ids` the photo-service does not have, asked with a
+    request per batch of ids."""
+    # Photo ids are integers in the photo-service: others are not there
+    ids = [int(photo_id) for photo_id in photo_ids if str(photo_id).isdigit()]
+    existing = set()
+    for batch in photo_batches(ids):
+        try:
+            response = photo_session.post(f"{photo_service}photo/{display_name}/exists",
+                                          json={"ids": batch}, timeout=settings.photo_timeout)
+        except requests.exceptions.Timeout:
+            raise HTTPException(status_code=504, detail="Photo Service Timeout")
+        except requests.exceptions.RequestException:
+            raise HTTPException(status_code=503, detail="Photo Service Unreachable")
+        if response.status_code != 200:
+            raise HTTPException(status_code=503, detail="Photo Service Unavailable")
+        existing.update(str(photo_id) for photo_id in response.json()["ids"])
+    return [photo_id for photo_id in photo_ids if photo_id not in existing]
+
+
+def check_batch(photos: PhotosBatch):
+    if len(photos.photo_ids) > settings.album_batch_max_photos:
+        raise HTTPException(status_code=413,
+                            detail=f"At most {settings.album_batch_max_photos} photos")
+
+
+@app.post("/photographers/{display_name}/albums/{album_id}/photos/batch", status_code=201)
+def add_photos_to_album(display_name: str, album_id: str, photos: PhotosBatch,
+                        background_tasks: BackgroundTasks):
+    """Add many photos to an album, checked with one request to the
+    photo-service and added with one update. If any of them does not exist,
+    none is added."""
+    check_batch(photos)
+    check_photographer(display_name)
+    missing = missing_photos(display_name, photos.photo_ids)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Photos Not Found: {', '.join(missing)}")
+    try:
+        updated_album = mongo_add_photos_to_album(display_name, album_id, photos.photo_ids)
+    except Exception as e:
+        logger.error(f"Error adding photos to album {album_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+    if not updated_album:
+        raise HTTPException(status_code=404, detail="Album Not Found")
+    background_tasks.add_task(refresh_album_snapshots, display_name, album_id)
+    return serialize_album(updated_album)
+
+
+@app.post("/photographers/{display_name}/albums/{album_id}/photos/batch-remove", status_code=200)
+def remove_photos_from_album(display_name: str, album_id: str, photos: PhotosBatch):
+    """Remove many photos from an album with one update. Photos need not
+    exist in the photo-service any more to be removed."""
+    check_batch(photos)
+    check_photographer(display_name)
+    try:
+        updated_album = mongo_remove_photos_from_album(display_name, album_id, photos.photo_ids)
+    except Exception as e:
+        logger.error(f"Error removing photos from album {album_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+    if not updated_album:
+        raise HTTPException(status_code=404, detail="Album Not Found")
+    return serialize_album(updated_album)
+
+
 @app.delete("/photographers/{display_name}/albums/{album_id}/photos/{photo_id}", status_code=200)
 def remove_photo_from_album(display_name: str, album_id: str, photo_id: str):
     logger.info(f"Removing photo {photo_id} from album {album_id} for photographer {display_name}...")
     
     # Check if photographer exists
-    try:
-        response = requests.get(f"{photographer_service}photographer/{display_name}", timeout=50000000)
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Photographer Not Found")
-        elif response.status_code == 503:
-            raise HTTPException(status_code=503, detail="Photographer Service Unavailable")
-        # elif response.status_code != 200:
-        #     raise HTTPException(status_code=response.status_code, detail="Error contacting Photographer Service")
-    except requests.exceptions.Timeout:
-        raise HTTPException(status_code=504, detail="Photographer Service Timeout")
-    except requests.exceptions.RequestException:
-        raise HTTPException(status_code=503, detail="Photographer Service Unreachable")
+    check_photographer(display_name)
 
     # Check if photo exists
     try:
-        response = requests.get(f"{photo_service}photo/{display_name}/{photo_id}", timeout=500)
+        response = photo_session.head(f"{photo_service}photo/{display_name}/{photo_id}",
+                                      timeout=settings.photo_timeout)
         if response.status_code == 404:
             raise HTTPException(status_code=404, detail="Photo Not Found")
         elif response.status_code == 503:
@@ -315,42 +422,35 @@ def remove_photo_from_album(display_name: str, album_id: str, photo_id: str):
 
 
 
+def album_snapshots(display_name: str, album, background_tasks: BackgroundTasks):
+    """The snapshots of the photos of `album`, in album order. Snapshots
+    older than PHOTO_SNAPSHOT_MAX_AGE are refreshed after the response; an
+    album never snapshotted is before."""
+    if album.snapshots_refreshed_at is None:
+        refresh_album_snapshots(display_name, album.album_id)
+        album = mongo_get_album_snapshots(display_name, album.album_id)
+    elif datetime.utcnow() - album.snapshots_refreshed_at > \
+            timedelta(seconds=settings.photo_snapshot_max_age):
+        background_tasks.add_task(refresh_album_snapshots, display_name, album.album_id)
+    snapshots = {snapshot.photo_id: snapshot for snapshot in album.snapshots}
+    return [{"photo_id": photo_id, "title": snapshots[photo_id].title,
+             "location": snapshots[photo_id].location, "tags": snapshots[photo_id].tags}
+            for photo_id in album.photos if photo_id in snapshots]
+
 @app.get("/photographers/{display_name}/albums/{album_id}/photos", status_code=200)
-def get_photos_in_album(display_name: str, album_id: str):
+def get_photos_in_album(display_name: str, album_id: str, background_tasks: BackgroundTasks):
     logger.info(f"Retrieving photos from album {album_id} for photographer {display_name}...")
     
     # Check if photographer exists
-    try:
-        response = requests.get(f"{photographer_service}photographer/{display_name}",timeout=500)
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Photographer Not Found")
-        elif response.status_code == 503:
-            raise HTTPException(status_code=503, detail="Photographer Service Unavailable")
-        # elif response.status_code != 200:
-        #     raise HTTPException(status_code=response.status_code, detail="Error contacting Photographer Service")
-    # except requests.exceptions.Timeout:
-    #     raise HTTPException(status_code=504, detail="Photographer Service Timeout")
-    except requests.exceptions.RequestException:
-        raise HTTPException(status_code=503, detail="Photographer Service Unreachable")
+    check_photographer(display_name)
     
-    # Retrieve photos from album in database
+    # Retrieve the photos from the album in database, with their snapshots
     try:
-        album_photos = mongo_get_photos_in_album(display_name, album_id)
-        if not album_photos:
+        album = mongo_get_album_snapshots(display_name, album_id)
+        if not album or not album.photos:
             raise HTTPException(status_code=404, detail="Album Not Found or No Photos in Album")
         
-        # Retrieve metadata from photo-service
-        photos_metadata = []
-        for photo_id in album_photos:
-            try:
-                response = requests.get(f"{photo_service}photo/{display_name}/{photo_id}/attributes", timeout=500)
-                if response.status_code == 200:
-                    photos_metadata.append(response.json())
-            except requests.exceptions.RequestException:
-                logger.warning(f"Could not retrieve metadata for photo {photo_id}")
-                continue
-        
-        return {"photos": photos_metadata}
+        return {"photos": album_snapshots(display_name, album, background_tasks)}
     
     except Exception as e:
         logger.error(f"Error retrieving photos for album {album_id}: {str(e)}")
@@ -358,52 +458,88 @@ def get_photos_in_album(display_name: str, album_id: str):
     
 
 
+def fetch_photo(display_name: str, photo_id: str):
+    """The content of a photo from the photo-service, or None."""
+    try:
+        response = photo_session.get(f"{photo_service}photo/{display_name}/{photo_id}",
+                                     timeout=settings.photo_timeout)
+    except requests.exceptions.RequestException:
+        logger.warning(f"Could not retrieve photo {photo_id}")
+        return None
+    if response.status_code != 200:
+        logger.warning(f"Could not retrieve photo {photo_id}: {response.status_code}")
+        return None
+    return response.content
+
+def archive_entries(display_name: str, photo_ids, missing):
+    """(name, content) of the photos of an album in the photo-service,
+    ARCHIVE_PREFETCH of them fetched ahead; the others are added to
+    `missing`."""
+    for (photo_id, content) in prefetch(lambda photo_id: fetch_photo(display_name, photo_id),
+                                        photo_ids, settings.archive_prefetch):
+        if content is None:
+            missing.append(photo_id)
+        else:
+            yield (f"{photo_id}.jpg", content)
+
 @app.get("/photographers/{display_name}/albums/{album_id}/photos-archive", status_code=200)
 def get_photos_in_album(display_name: str, album_id: str):
     logger.info(f"Retrieving photos from album {album_id} for photographer {display_name}...")
     
     # Check if photographer exists
-    try:
-        response = requests.get(f"{photographer_service}photographer/{display_name}")
-        if response.status_code == 404:
-            raise HTTPException(status_code=404, detail="Photographer Not Found")
-        elif response.status_code == 503:
-            raise HTTPException(status_code=503, detail="Photographer Service Unavailable")
-        # elif response.status_code != 200:
-        #     raise HTTPException(status_code=response.status_code, detail="Error contacting Photographer Service")
-    except requests.exceptions.Timeout:
-        raise HTTPException(status_code=504, detail="Photographer Service Timeout")
-    except requests.exceptions.RequestException:
-        raise HTTPException(status_code=503, detail="Photographer Service Unreachable")
+    check_photographer(display_name)
 
     # Retrieve photo IDs from album
     try:
-        album_photos = mongo_get_photos_in_album(display_name, album_id)
-        if not album_photos:
+        album = mongo_get_album_archive(display_name, album_id)
+        if not album or not album.photos:
             raise HTTPException(status_code=404, detail="Album Not Found or No Photos in Album")
-        
-        # Create a ZIP file in memory
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for photo_id in album_photos:
-                try:
-                    # Fetch actual photo content from Photo Service
-                    response = requests.get(f"{photo_service}photo/{display_name}/{photo_id}", timeout=500)
-                    if response.status_code == 200:
-                        # Write the photo to the ZIP file
-                        zip_file.writestr(f"{photo_id}.jpg", response.content)
-                except requests.exceptions.RequestException:
-                    logger.warning(f"Could not retrieve photo {photo_id}")
-                    continue
-        
-        # Prepare ZIP for download
-        zip_buffer.seek(0)
-        return StreamingResponse(zip_buffer, media_type="application/zip", headers={"Content-Disposition": f"attachment; filename=album_{album_id}.zip"})
+        headers = {"Content-Disposition": f"attachment; filename=album_{album_id}.zip"}
+
+        # Sent before, and the album has not changed since: with byte ranges
+        cached = archive_cache.get(album.album_id, album.version) if archive_cache else None
+        if cached:
+            return FileResponse(cached, media_type="application/zip", headers=headers)
+
+        # The ZIP is written as it is sent, photo by photo, never whole in memory
+        missing = []
+        archive = zip_stream(archive_entries(display_name, album.photos, missing))
+        if archive_cache:
+            # Cached unless a photo could not be fetched
+            archive = archive_cache.store(album.album_id, album.version, archive,
+                                          complete=lambda: not missing)
+        return StreamingResponse(archive, media_type="application/zip", headers=headers)
     
     except Exception as e:
         logger.error(f"Error retrieving photos for album {album_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+@app.post("/photographers/{display_name}/photos/changed", status_code=202)
+def photos_changed(display_name: str, changed: PhotosChanged, background_tasks: BackgroundTasks):
+    """Called by the photo-service when the attributes of photos change: the
+    albums with them are snapshotted again."""
+    try:
+        album_ids = mongo_get_albums_with_photos(display_name, changed.photo_ids)
+    except Exception as e:
+        logger.error(f"Error finding the albums of photos of {display_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+    for album_id in album_ids:
+        background_tasks.add_task(refresh_album_snapshots, display_name, album_id)
+
+
+@app.post("/photographers/{display_name}/photos/deleted", status_code=204)
+def photos_deleted(display_name: str, deleted: PhotosChanged):
+    """Called by the photo-service when photos are deleted: they are taken
+    out of the albums with them, whose versions change, so that no archive
+    cached before is served again."""
+    try:
+        mongo_remove_photos_from_albums(display_name, deleted.photo_ids)
+    except Exception as e:
+        logger.error(f"Error removing deleted photos of {display_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=80, log_level="info")
+
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# Time to first byte, total time and peak RSS of an album archive, built in
+# memory as photos-archive used to, or streamed with zip_stream:
+#   python archive_benchmark.py --photos 1000 --photo-size 200000 --latency 0.005
+# Photos are served by a local stand-in of the photo-service answering each
+# GET after `latency` seconds. Each mode runs in its own process, for its
+# peak RSS to be its own.
+
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from zip_stream import prefetch, zip_stream
+
+MODES = ('buffered', 'streaming')
+
+
+def photo_server(photo_size, latency):
+    """Start a stand-in photo-service; return it and its base URL."""
+    photo = os.urandom(photo_size)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(photo)))
+            self.end_headers()
+            self.wfile.write(photo)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("localhost", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return (server, f"http://localhost:{server.server_address[1]}/")
+
+
+def buffered(fetch, photo_ids):
+    """The former photos-archive: every photo fetched in turn, deflated into
+    one in-memory archive, sent once complete."""
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for photo_id in photo_ids:
+            zip_file.writestr(f"{photo_id}.jpg", fetch(photo_id))
+    zip_buffer.seek(0)
+    yield zip_buffer.getvalue()
+
+
+def streaming(fetch, photo_ids, window):
+    return zip_stream((f"{photo_id}.jpg", content)
+                      for (photo_id, content) in prefetch(fetch, photo_ids, window))
+
+
+def run(mode, base_url, photos, window, results):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=window))
+    fetch = lambda photo_id: session.get(f"{base_url}photo/joe/{photo_id}").content
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    first_byte = None
+    sent = 0
+    chunks = buffered(fetch, range(photos)) if mode == 'buffered' else \
+        streaming(fetch, range(photos), window)
+    for chunk in chunks:
+        if chunk and first_byte is None:
+            first_byte = time.perf_counter() - start
+        sent += len(chunk)
+    results.put({'mode': mode,
+                 'first_byte_s': first_byte,
+                 'total_s': time.perf_counter() - start,
+                 'bytes': sent,
+                 # kB on Linux
+                 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                 'rss_before_mb': rss_before / 1024})
+
+
+def measure(mode, base_url, photos, window):
+    """Run `mode` in a child process; return its measures."""
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(target=run, args=(mode, base_url, photos, window, results))
+    child.start()
+    result = results.get()
+    child.join()
+    return result
+
+
+def report(result):
+    return (f"{result['mode']:>9}: first byte {result['first_byte_s']:7.3f} s  "
+            f"total {result['total_s']:7.2f} s  {result['bytes'] / 1e6:8.1f} MB  "
+            f"peak RSS {result['peak_rss_mb']:7.1f} MB (from {result['rss_before_mb']:.1f} MB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark album archives")
+    parser.add_argument('--photos', type=int, default=1000)
+    parser.add_argument('--photo-size', type=int, default=200 * 1000)
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help="seconds the photo-service takes per photo")
+    parser.add_argument('--prefetch', type=int, default=4)
+    parser.add_argument('--modes', default=",".join(MODES))
+    args = parser.parse_args()
+    (server, base_url) = photo_server(args.photo_size, args.latency)
+    try:
+        for mode in args.modes.split(","):
+            print(report(measure(mode, base_url, args.photos, args.prefetch)))
+    finally:
+        server.shutdown()
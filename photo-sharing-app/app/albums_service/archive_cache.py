@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Album archives kept on local disk once sent, to serve them again without
+# fetching the photos, with byte ranges to resume downloads. An archive is
+# cached per album version: any change to the album bumps it, so a cached
+# archive is never out of date.
+
+import os
+import tempfile
+import threading
+import time
+
+# Seconds after which an archive still being written is taken as left over
+# by a process that died writing it
+PART_MAX_IDLE = 600
+
+
+class ArchiveCache:
+    """Archives by (album_id, version) in `directory`; once they take more
+    than `max_bytes`, the least recently served are deleted."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.sweep_parts()
+
+    def sweep_parts(self, max_idle=PART_MAX_IDLE):
+        """Delete the archives a process stopped writing before they were
+        complete. The directory may be shared with other processes: an
+        archive they are writing still is left alone."""
+        for name in os.listdir(self.directory):
+            if not name.endswith(".part"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                idle = time.time() - os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            if idle > max_idle:
+                self._unlink(path)
+
+    def path(self, album_id, version):
+        return os.path.join(self.directory, f"{album_id}-{version}.zip")
+
+    def get(self, album_id, version):
+        """The path of the archive if cached, or None."""
+        path = self.path(album_id, version)
+        try:
+            # Most recently served: the last to be evicted
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def store(self, album_id, version, chunks, complete=lambda: True):
+        """Yield `chunks`, writing them to the cache as they go. The archive
+        is kept if all of them were sent and `complete()` says it lacks no
+        photo."""
+        (fd, part) = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as archive:
+                for chunk in chunks:
+                    archive.write(chunk)
+                    yield chunk
+            if not complete():
+                self._unlink(part)
+                return
+            os.replace(part, self.path(album_id, version))
+        except BaseException:
+            # Including the client going away mid-download
+            self._unlink(part)
+            raise
+        self.evict(album_id, version)
+
+    def evict(self, album_id=None, version=None):
+        """Delete the older versions of album `album_id`, then the least
+        recently served archives beyond `max_bytes`."""
+        with self._lock:
+            archives = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(".zip"):
+                    continue
+                path = os.path.join(self.directory, name)
+                (album, _, other_version) = name[:-len(".zip")].rpartition("-")
+                if album == album_id and other_version != str(version):
+                    self._unlink(path)
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                archives.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for (mtime, size, path) in archives)
+            for (mtime, size, path) in sorted(archives):
+                if total <= self.max_bytes:
+                    break
+                self._unlink(path)
+                total -= size
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -1,6 +1,8 @@
 import pytest
 from mongoengine import connect, disconnect
 from models import Album
+from archive_cache import ArchiveCache
+import albums_service
 
 @pytest.fixture(scope="class")
 def initDB():
@@ -29,3 +31,15 @@ def sample_album():
     album.save()
     yield album
     album.delete()  # Cleanup after test execution
+
+@pytest.fixture(autouse=True)
+def clearPhotographerCache():
+    """Forgets the photographer lookups of the previous tests."""
+    albums_service.photographers.invalidate()
+
+@pytest.fixture(autouse=True)
+def archiveCache(tmp_path, monkeypatch):
+    """Gives each test an empty archive cache of its own."""
+    cache = ArchiveCache(str(tmp_path / "archives"), 10 * 1024 * 1024)
+    monkeypatch.setattr(albums_service, "archive_cache", cache)
+    return cache
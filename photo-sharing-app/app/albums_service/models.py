@@ -1,9 +1,18 @@
-from mongoengine import Document, StringField, ListField, DateTimeField
+from mongoengine import (Document, EmbeddedDocument, StringField, ListField, DateTimeField,
+                         EmbeddedDocumentListField, IntField)
 from datetime import datetime
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 
+class PhotoSnapshot(EmbeddedDocument):
+    """Copy of the attributes of a photo of the album shown in album listings,
+    so that they need no request to the photo-service."""
+    photo_id = StringField(required=True)
+    title = StringField()
+    location = StringField()
+    tags = ListField(StringField())
+
 
 class Album(Document):
     display_name = StringField(required=True, max_length=120)
@@ -13,8 +22,15 @@ class Album(Document):
     cover_photo_id = StringField()
     created_at = DateTimeField(default=datetime.utcnow)
     photos = ListField(StringField())  # List of photo IDs
+    # Bumped by every change to the album, for its cached archive to expire
+    version = IntField(default=0)
+    snapshots = EmbeddedDocumentListField(PhotoSnapshot)
+    # When all the snapshots were last fetched from the photo-service
+    snapshots_refreshed_at = DateTimeField()
 
-    meta = {'collection': 'albums'}  # Ensuring consistency in MongoDB collection name
+    meta = {'collection': 'albums',  # Ensuring consistency in MongoDB collection name
+            # Album listings, newest first
+            'indexes': [('display_name', '-created_at', '-album_id')]}
 
 
 class AlbumCreate(BaseModel):
@@ -30,3 +46,9 @@ class AlbumUpdate(BaseModel):
 
 class PhotoAdd(BaseModel):
     photo_id:str
+
+class PhotosBatch(BaseModel):
+    photo_ids: List[str]
+
+class PhotosChanged(BaseModel):
+    photo_ids: List[str]
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+# Opaque cursors for keyset pagination: a page ends with the cursor of its
+# last item, and the next page starts right after it with an indexed range
+# query instead of skipping over all the items before it.
+#
+# encode_cursor and decode_cursor are the ones of the photo-service: keep
+# them identical.
+
+import base64
+import json
+from datetime import datetime
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Return the key encoded in `cursor`; ValueError if it is not one of
+    ours."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+def encode_album_cursor(created_at, album_id):
+    return encode_cursor([created_at.isoformat(), album_id])
+
+def decode_album_cursor(cursor):
+    """Return the (created_at, album_id) key encoded in an album listing
+    cursor; ValueError if it is not one."""
+    try:
+        (created_at, album_id) = decode_cursor(cursor)
+        return (datetime.fromisoformat(created_at), str(album_id))
+    except TypeError as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+# Client of the photographer service for the services that only need to know
+# whether a photographer exists. Answers, "exists" as well as "does not
+# exist", are cached for a while, concurrent lookups of the same name share
+# one request, and requests reuse pooled keep-alive connections.
+#
+# This is photo-service/photographer_client.py without its asyncio client,
+# which albums_service does not use: keep the two in step.
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# The answers that are about the photographer rather than about the state of
+# the photographer service: only those are cached
+FOUND = 200
+NOT_FOUND = 404
+
+class LookupCache:
+    """Bounded LRU cache of lookup answers, which expire after `ttl` seconds
+    (`negative_ttl` for NOT_FOUND)."""
+
+    def __init__(self, ttl=30, negative_ttl=5, max_entries=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            (status, expires) = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return status
+
+    def put(self, key, status, generation):
+        """Cache `status`, unless the cache was invalidated since
+        `generation` was read: the answer may predate the invalidation."""
+        ttl = {FOUND: self.ttl, NOT_FOUND: self.negative_ttl}.get(status, 0)
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (status, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Forget `key`, or everything if None."""
+        with self._lock:
+            self.generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+class LookupStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.miss_latency = 0.0
+
+    def record(self, outcome, latency):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.latency += latency
+            if outcome in ('misses', 'errors'):
+                self.miss_latency += latency
+
+    def as_dict(self):
+        with self._lock:
+            lookups = self.hits + self.coalesced + self.misses + self.errors
+            requests_sent = self.misses + self.errors
+            return {'lookups': lookups,
+                    'hits': self.hits,
+                    'coalesced': self.coalesced,
+                    'misses': self.misses,
+                    'errors': self.errors,
+                    'hit_ratio': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+                    'mean_latency_ms': 1000 * self.latency / lookups if lookups else 0.0,
+                    'mean_request_latency_ms':
+                        1000 * self.miss_latency / requests_sent if requests_sent else 0.0}
+
+class PhotographerClient:
+    """Photographer lookups for threaded (sync) services."""
+
+    def __init__(self, base_url, timeout, ttl=30, negative_ttl=5, max_entries=10000,
+                 max_connections=100):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.cache = LookupCache(ttl, negative_ttl, max_entries)
+        self.stats = LookupStats()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def lookup(self, display_name):
+        """Return the status code of GET photographer/{display_name}: 200 if
+        the photographer exists, 404 if not, anything else if the service is
+        in trouble. Raises requests.RequestException if it cannot be
+        reached."""
+        start = time.perf_counter()
+        status = self.cache.get(display_name)
+        if status is not None:
+            self.stats.record('hits', time.perf_counter() - start)
+            return status
+        with self._inflight_lock:
+            call = self._inflight.get(display_name)
+            leader = call is None
+            if leader:
+                call = self._inflight[display_name] = Future()
+                generation = self.cache.generation
+        if not leader:
+            try:
+                return call.result()
+            finally:
+                self.stats.record('coalesced', time.perf_counter() - start)
+        try:
+            status = self.session.get(self.base_url + 'photographer/' + display_name,
+                                      timeout=self.timeout).status_code
+            self.cache.put(display_name, status, generation)
+            call.set_result(status)
+        except BaseException as e:
+            call.set_exception(e)
+            self.stats.record('errors', time.perf_counter() - start)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[display_name]
+        self.stats.record('misses', time.perf_counter() - start)
+        return status
+
+    def invalidate(self, display_name=None):
+        self.cache.invalidate(display_name)
+
+    def cache_stats(self):
+        return dict(self.stats.as_dict(), entries=len(self.cache))
@@ -1,13 +1,15 @@
 import pytest
-from unittest.mock import patch
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
 from fastapi.testclient import TestClient
-from albums_service import app
+from albums_service import app, get_photos_metadata, missing_photos
+from models import Album
 # from conftest import initDB, clearAlbums, sample_album
 
 
 client = TestClient(app)
 
-@patch("requests.get")
+@patch("albums_service.photographers.session.get")
 def test_create_album(mock_get, initDB, clearAlbums):
     """Test creating an album with a mocked photographer-service response."""
     mock_get.return_value.status_code = 200  # Mock photographer exists
@@ -23,7 +25,7 @@ def test_create_album(mock_get, initDB, clearAlbums):
     assert response.json()["description"] == "Test Description"
     assert response.json()["cover_photo_id"] == "photo123"
 
-@patch("requests.get")
+@patch("albums_service.photographers.session.get")
 def test_create_album_photographer_not_found(mock_get, initDB, clearAlbums):
     """Test creating an album when photographer does not exist."""
     mock_get.return_value.status_code = 404  # Mock photographer not found
@@ -37,7 +39,7 @@ def test_create_album_photographer_not_found(mock_get, initDB, clearAlbums):
     assert response.status_code == 404
     assert response.json()["detail"] == "Photographer Not Found"
 
-@patch("requests.get")
+@patch("albums_service.photographers.session.get")
 def test_create_album_photographer_service_unavailable(mock_get, initDB, clearAlbums):
     """Test creating an album when photographer-service is unavailable."""
     mock_get.return_value.status_code = 503  # Mock service unavailable
@@ -52,7 +54,7 @@ def test_create_album_photographer_service_unavailable(mock_get, initDB, clearAl
     assert response.json()["detail"] == "Photographer Service Unavailable"
 
 
-@patch("requests.get")
+@patch("albums_service.photographers.session.get")
 def test_retrieve_all_albums(mock_get, initDB, clearAlbums, sample_album):
     """Test retrieving all albums for a photographer."""
     mock_get.return_value.status_code = 200  # Mock photographer exists
@@ -62,9 +64,43 @@ def test_retrieve_all_albums(mock_get, initDB, clearAlbums, sample_album):
     assert response.status_code == 200
     assert len(response.json()["items"]) > 0
     assert response.json()["items"][0]["title"] == "Test Album"
+    assert response.json()["items"][0]["photo_count"] == 3
+    assert "photos" not in response.json()["items"][0]
+
+
+@patch("albums_service.photographers.session.get")
+def test_albums_pages(mock_get, initDB, clearAlbums):
+    """Test paging through albums, newest first, with cursors."""
+    mock_get.return_value.status_code = 200
+    created_at = datetime(2025, 3, 1)
+    for number in range(5):
+        # Two albums of the same time: the album id breaks the tie
+        Album(display_name="test_photographer", album_id=f"album{number}", title=f"Album {number}",
+              created_at=created_at + timedelta(days=number // 2), photos=["1"] * number).save()
+
+    titles = []
+    response = client.get("/photographers/test_photographer/albums?limit=2")
+    while True:
+        assert response.status_code == 200
+        titles += [album["title"] for album in response.json()["items"]]
+        if not response.json()["has_more"]:
+            assert response.json()["next_cursor"] is None
+            break
+        response = client.get("/photographers/test_photographer/albums?limit=2&after="
+                              + response.json()["next_cursor"])
+    assert titles == [f"Album {number}" for number in (4, 3, 2, 1, 0)]
+
+    response = client.get("/photographers/test_photographer/albums?offset=1&limit=1")
+    assert [album["photo_count"] for album in response.json()["items"]] == [3]
+    assert response.json()["has_more"]
+    response = client.get("/photographers/test_photographer/albums?after=nope")
+    assert response.status_code == 400
+    for bad_page in ("offset=-1", "limit=0", "limit=-1", "limit=101"):
+        response = client.get("/photographers/test_photographer/albums?" + bad_page)
+        assert response.status_code == 422
 
     
-@patch("requests.get")
+@patch("albums_service.photographers.session.get")
 def test_retrieve_specific_album(mock_get, initDB, clearAlbums, sample_album):
     """Test retrieving a specific album by ID."""
     mock_get.return_value.status_code = 200  # Mock photographer exists
@@ -76,7 +112,7 @@ def test_retrieve_specific_album(mock_get, initDB, clearAlbums, sample_album):
     assert response.json()["description"] == "A sample test album"    
 
 
-@patch("requests.get")
+@patch("albums_service.photographers.session.get")
 def test_update_album(mock_get, initDB, clearAlbums, sample_album):
     """Test updating an album."""
     mock_get.return_value.status_code = 200  # Mock photographer exists
@@ -93,7 +129,7 @@ def test_update_album(mock_get, initDB, clearAlbums, sample_album):
     assert response.json()["cover_photo_id"] == "updated_photo123"
 
 
-@patch("requests.get")
+@patch("albums_service.photographers.session.get")
 def test_delete_album(mock_get, initDB, clearAlbums, sample_album):
     """Test deleting an album."""
     mock_get.return_value.status_code = 200  # Mock photographer exists
@@ -104,8 +140,8 @@ def test_delete_album(mock_get, initDB, clearAlbums, sample_album):
     assert response.json()["message"] == "Album successfully deleted"
 
 
-@patch("requests.get")
-@patch("requests.get")  # Mock photo-service separately
+@patch("albums_service.photo_session.head")  # Mock photo-service separately
+@patch("albums_service.photographers.session.get")
 
 def test_add_photo_to_album(mock_get_photographer, mock_get_photo, initDB, clearAlbums, sample_album):
     """Test adding a photo to an album with mocked photographer-service and photo-service responses."""
@@ -121,8 +157,8 @@ def test_add_photo_to_album(mock_get_photographer, mock_get_photo, initDB, clear
 
 
 
-@patch("requests.get")
-@patch("requests.get")  # Mock photo-service separately
+@patch("albums_service.photo_session.head")  # Mock photo-service separately
+@patch("albums_service.photographers.session.get")
 def test_remove_photo_from_album(mock_get_photographer, mock_get_photo, initDB, clearAlbums, sample_album):
     """Test removing a photo from an album with mocked photographer-service and photo-service responses."""
     mock_get_photographer.return_value.status_code = 200  # Mock photographer exists
@@ -134,29 +170,177 @@ def test_remove_photo_from_album(mock_get_photographer, mock_get_photo, initDB,
     assert "photo123" not in response.json()["photos"]
 
 
-@patch("requests.get")
-@patch("requests.get")  # Mock photo-service separately
-def test_retrieve_photos_in_album(mock_get_photographer, mock_get_photo, initDB, clearAlbums, sample_album):
+@patch("requests.post")  # Mock photo-service separately
+@patch("albums_service.photographers.session.get")
+def test_retrieve_photos_in_album(mock_get_photographer, mock_post_photos, initDB, clearAlbums, sample_album):
     """Test retrieving photos in an album with mocked photographer-service and photo-service responses."""
     mock_get_photographer.return_value.status_code = 200  # Mock photographer exists
-    mock_get_photo.return_value.status_code = 200  # Mock photo metadata retrieval from photo-service
-    mock_get_photo.return_value.json.return_value = {
-        "photo_id": "photo123",
-        "title": "Sample Photo",
-        "location": "Test Location",
-        "tags": ["landscape", "nature"]
-    }
+    sample_album.update(push__photos="7")
+    mock_post_photos.return_value.status_code = 200  # Mock photo metadata retrieval from photo-service
+    mock_post_photos.return_value.json.return_value = {"items": [{
+        "photo_id": 7,
+        "attributes": {
+            "title": "Sample Photo",
+            "location": "Test Location",
+            "tags": ["landscape", "nature"]
+        }
+    }]}
     
     response = client.get(f"/photographers/test_photographer/albums/{sample_album.album_id}/photos")
     
     assert response.status_code == 200
     assert len(response.json()["photos"]) > 0
-    assert response.json()["photos"][0]["photo_id"] == "photo123"
+    assert response.json()["photos"][0]["photo_id"] == "7"
     assert response.json()["photos"][0]["title"] == "Sample Photo"
+    # All the photos in one request; "photo1" and the like cannot be in the photo-service
+    assert mock_post_photos.call_count == 1
+    assert mock_post_photos.call_args.kwargs["json"] == {"ids": [7]}
+
+
+
+
+
+
+
+@patch("albums_service.photographers.session.get")
+def test_photographer_lookups_are_cached(mock_get, initDB, clearAlbums, sample_album):
+    """Test that the photographer-service is asked once for repeated requests."""
+    mock_get.return_value.status_code = 200  # Mock photographer exists
+    before = client.get("/cache/photographers").json()
+
+    for _ in range(3):
+        response = client.get(f"/photographers/test_photographer/albums/{sample_album.album_id}")
+        assert response.status_code == 200
+    assert mock_get.call_count == 1
+
+    after = client.get("/cache/photographers").json()
+    assert after["hits"] - before["hits"] == 2
+    assert after["misses"] - before["misses"] == 1
+
+    # Once invalidated, the photographer is looked up again
+    assert client.delete("/cache/photographers/test_photographer").status_code == 204
+    client.get(f"/photographers/test_photographer/albums/{sample_album.album_id}")
+    assert mock_get.call_count == 2
+
+
+def photo_attributes(title):
+    """Mocked answer of the photo-service to POST /photo/{display_name}/attributes."""
+    return {"items": [{"photo_id": 7,
+                       "attributes": {"title": title, "location": "Douz", "tags": ["desert"]}}]}
+
+
+@patch("requests.post")
+@patch("albums_service.photo_session.head")  # Mock photo-service separately
+@patch("albums_service.photographers.session.get")
+def test_photo_snapshots(mock_get_photographer, mock_get_photo, mock_post_photos, initDB, clearAlbums, sample_album):
+    """Test that album listings are served from the snapshots taken when photos are added."""
+    mock_get_photographer.return_value.status_code = 200
+    mock_get_photo.return_value.status_code = 200
+    mock_post_photos.return_value.status_code = 200
+    mock_post_photos.return_value.json.return_value = photo_attributes("Dunes")
+    sample_album.update(set__photos=[])
+
+    response = client.post(f"/photographers/test_photographer/albums/{sample_album.album_id}/photos", json={
+        "photo_id": "7"
+    })
+    assert response.status_code == 201
+    sample_album.update(set__snapshots_refreshed_at=datetime.utcnow())
+    assert mock_post_photos.call_count == 1
+
+    response = client.get(f"/photographers/test_photographer/albums/{sample_album.album_id}/photos")
+    assert response.json()["photos"] == [{"photo_id": "7", "title": "Dunes", "location": "Douz",
+                                          "tags": ["desert"]}]
+    # Served from the album alone
+    assert mock_post_photos.call_count == 1
+
+    # Told of the change by the photo-service
+    mock_post_photos.return_value.json.return_value = photo_attributes("Dune")
+    response = client.post("/photographers/test_photographer/photos/changed", json={"photo_ids": ["7"]})
+    assert response.status_code == 202
+    response = client.get(f"/photographers/test_photographer/albums/{sample_album.album_id}/photos")
+    assert response.json()["photos"][0]["title"] == "Dune"
+
+    # Too old: served, then refreshed
+    mock_post_photos.return_value.json.return_value = photo_attributes("Erg")
+    sample_album.update(set__snapshots_refreshed_at=datetime.utcnow() - timedelta(days=1))
+    response = client.get(f"/photographers/test_photographer/albums/{sample_album.album_id}/photos")
+    assert response.json()["photos"][0]["title"] == "Dune"
+    response = client.get(f"/photographers/test_photographer/albums/{sample_album.album_id}/photos")
+    assert response.json()["photos"][0]["title"] == "Erg"
 
+    client.delete(f"/photographers/test_photographer/albums/{sample_album.album_id}/photos/7")
+    sample_album.reload()
+    assert sample_album.snapshots == []
 
 
+@patch("requests.post")
+@patch("albums_service.photo_session.post")  # Mock photo-service separately
+@patch("albums_service.photographers.session.get")
+def test_batch_add_and_remove_photos(mock_get_photographer, mock_photos_exist, mock_post_photos,
+                                     initDB, clearAlbums, sample_album):
+    """Test adding and removing many photos to an album with one request each."""
+    mock_get_photographer.return_value.status_code = 200
+    mock_photos_exist.return_value.status_code = 200
+    mock_photos_exist.return_value.json.return_value = {"ids": [7, 8, 9]}
+    mock_post_photos.return_value.status_code = 200
+    mock_post_photos.return_value.json.return_value = photo_attributes("Dunes")
+    url = f"/photographers/test_photographer/albums/{sample_album.album_id}/photos"
+
+    response = client.post(url + "/batch", json={"photo_ids": ["7", "8", "9", "photo1"]})
+    assert response.status_code == 404
+    assert "photo1" in response.json()["detail"]
+    sample_album.reload()
+    assert sample_album.photos == ["photo1", "photo2", "photo123"]
+
+    response = client.post(url + "/batch", json={"photo_ids": ["7", "8", "9"]})
+    assert response.status_code == 201
+    assert response.json()["photos"] == ["photo1", "photo2", "photo123", "7", "8", "9"]
+    assert response.json()["version"] == 1
+    assert mock_photos_exist.call_args.kwargs["json"] == {"ids": [7, 8, 9]}
+    sample_album.reload()
+    assert [snapshot.photo_id for snapshot in sample_album.snapshots] == ["7"]
+
+    # Already in the album: nothing changes
+    response = client.post(url + "/batch", json={"photo_ids": ["8", "7"]})
+    assert response.json()["version"] == 1
+
+    response = client.post(url + "/batch-remove", json={"photo_ids": ["7", "photo2", "42"]})
+    assert response.status_code == 200
+    assert response.json()["photos"] == ["photo1", "photo123", "8", "9"]
+    assert response.json()["version"] == 2
+    assert response.json()["snapshots"] == []
+    response = client.post(url + "/batch-remove", json={"photo_ids": ["7"]})
+    assert response.json()["version"] == 2
+
+    response = client.post("/photographers/test_photographer/albums/nope/photos/batch-remove",
+                           json={"photo_ids": ["7"]})
+    assert response.status_code == 404
+
 
+@patch("albums_service.photographers.session.get")
+def test_batch_limit(mock_get_photographer, monkeypatch, initDB, clearAlbums, sample_album):
+    monkeypatch.setattr("albums_service.settings.album_batch_max_photos", 2)
+    url = f"/photographers/test_photographer/albums/{sample_album.album_id}/photos"
+    assert client.post(url + "/batch", json={"photo_ids": ["7", "8", "9"]}).status_code == 413
+    assert client.post(url + "/batch-remove", json={"photo_ids": ["7", "8", "9"]}).status_code == 413
 
 
+@patch("requests.post")
+@patch("albums_service.photo_session.post")
+def test_photo_service_batches(mock_photos_exist, mock_post_photos, monkeypatch):
+    """Test that ids are sent to the photo-service in batches it accepts."""
+    monkeypatch.setattr("albums_service.settings.photo_batch_size", 2)
+    def attributes(url, json, timeout):
+        items = [{"photo_id": photo_id, "attributes": {"title": str(photo_id)}}
+                 for photo_id in json["ids"]]
+        return Mock(status_code=200, json=Mock(return_value={"items": items}))
+    mock_post_photos.side_effect = attributes
+    metadata = get_photos_metadata("test_photographer", ["1", "2", "3", "4", "5"])
+    assert [call.kwargs["json"]["ids"] for call in mock_post_photos.call_args_list] == \
+        [[1, 2], [3, 4], [5]]
+    assert [item["photo_id"] for item in metadata] == [1, 2, 3, 4, 5]
 
+    mock_photos_exist.return_value.status_code = 200
+    mock_photos_exist.return_value.json.return_value = {"ids": [1]}
+    assert missing_photos("test_photographer", ["1", "2", "3"]) == ["2", "3"]
+    assert mock_photos_exist.call_count == 2
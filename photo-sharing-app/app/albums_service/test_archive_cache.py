@@ -0,0 +1,110 @@
+import io
+import os
+import time
+import zipfile
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from albums_service import app
+from archive_cache import ArchiveCache
+
+client = TestClient(app)
+
+
+def test_store_and_get(tmp_path):
+    cache = ArchiveCache(str(tmp_path / "cache"), 1000)
+    assert cache.get("album", 0) is None
+    assert b"".join(cache.store("album", 0, iter([b"PK", b"data"]))) == b"PKdata"
+    with open(cache.get("album", 0), "rb") as archive:
+        assert archive.read() == b"PKdata"
+
+    # Missing photos: not kept
+    assert list(cache.store("album", 1, iter([b"PK"]), complete=lambda: False)) == [b"PK"]
+    assert cache.get("album", 1) is None
+    # Interrupted: not kept either
+    chunks = cache.store("album", 1, iter([b"PK", b"data"]))
+    next(chunks)
+    chunks.close()
+    assert cache.get("album", 1) is None
+    assert os.listdir(cache.directory) == ["album-0.zip"]
+
+    # A new version replaces the old one
+    list(cache.store("album", 2, iter([b"PK"])))
+    assert cache.get("album", 0) is None
+    assert cache.get("album", 2) is not None
+
+
+def test_left_over_parts_are_deleted(tmp_path):
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    (directory / "album-0.zip").write_bytes(b"PK")
+    (directory / "left.part").write_bytes(b"PK")
+    (directory / "writing.part").write_bytes(b"PK")
+    past = time.time() - 3600
+    os.utime(directory / "left.part", (past, past))
+    # Written by another process still: kept
+    ArchiveCache(str(directory), 1000)
+    assert sorted(os.listdir(directory)) == ["album-0.zip", "writing.part"]
+
+
+def test_least_recently_served_are_evicted(tmp_path):
+    cache = ArchiveCache(str(tmp_path / "cache"), 250)
+    for album in ("a", "b"):
+        list(cache.store(album, 0, iter([bytes(100)])))
+    past = time.time() - 60
+    os.utime(cache.path("a", 0), (past, past))
+    os.utime(cache.path("b", 0), (past - 60, past - 60))
+    # "b" served last
+    cache.get("b", 0)
+    list(cache.store("c", 0, iter([bytes(100)])))
+    assert cache.get("a", 0) is None
+    assert cache.get("b", 0) is not None
+    assert cache.get("c", 0) is not None
+
+
+@patch("albums_service.photo_session.head")  # Mock photo-service separately
+@patch("albums_service.photo_session.get")
+@patch("albums_service.photographers.session.get")
+def test_archives_are_cached_per_album_version(mock_get_photographer, mock_get_photo, mock_check_photo,
+                                               initDB, clearAlbums, sample_album):
+    mock_get_photographer.return_value.status_code = 200
+    mock_get_photo.return_value.status_code = 200
+    mock_get_photo.return_value.content = b"\xff\xd8" + bytes(5000)
+    mock_check_photo.return_value.status_code = 200
+    url = f"/photographers/test_photographer/albums/{sample_album.album_id}/photos-archive"
+
+    first = client.get(url)
+    assert first.status_code == 200
+    assert mock_get_photo.call_count == 3
+
+    second = client.get(url)
+    assert second.content == first.content
+    assert second.headers["accept-ranges"] == "bytes"
+    assert mock_get_photo.call_count == 3
+
+    # An interrupted download resumes from the cached archive
+    resumed = client.get(url, headers={"Range": "bytes=1000-"})
+    assert resumed.status_code == 206
+    assert resumed.content == first.content[1000:]
+
+    # Adding a photo makes a new version of the album
+    response = client.post(f"/photographers/test_photographer/albums/{sample_album.album_id}/photos",
+                           json={"photo_id": "photo4"})
+    assert response.status_code == 201
+    third = client.get(url)
+    assert mock_get_photo.call_count == 7
+    with zipfile.ZipFile(io.BytesIO(third.content)) as archive:
+        assert "photo4.jpg" in archive.namelist()
+
+    # Deleting a photo in the photo-service makes a new version of the album too
+    response = client.post("/photographers/test_photographer/photos/deleted",
+                           json={"photo_ids": ["photo2"]})
+    assert response.status_code == 204
+    sample_album.reload()
+    assert sample_album.photos == ["photo1", "photo123", "photo4"]
+    assert sample_album.version == 2
+    fourth = client.get(url)
+    assert mock_get_photo.call_count == 10
+    with zipfile.ZipFile(io.BytesIO(fourth.content)) as archive:
+        assert "photo2.jpg" not in archive.namelist()
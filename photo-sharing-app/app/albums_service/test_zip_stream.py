@@ -0,0 +1,56 @@
+import io
+import threading
+import time
+import zipfile
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from albums_service import app
+from zip_stream import prefetch, zip_stream
+
+client = TestClient(app)
+
+
+def test_zip_stream_is_a_valid_archive():
+    entries = [("1.jpg", b"\xff\xd8" + bytes(1000)), ("2.jpg", b""), ("3.jpg", b"x" * 70000)]
+    chunks = list(zip_stream(iter(entries)))
+    # One chunk per entry, then the central directory
+    assert len(chunks) == len(entries) + 1
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert [(info.filename, info.compress_type) for info in archive.infolist()] == \
+            [(name, zipfile.ZIP_STORED) for (name, data) in entries]
+        assert [archive.read(name) for (name, data) in entries] == [data for (name, data) in entries]
+
+
+def test_prefetch_keeps_order_and_window():
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def fetch(item):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.01 * (item % 3))
+        with lock:
+            in_flight[0] -= 1
+        return item * 2
+
+    assert list(prefetch(fetch, range(20), window=3)) == [(item, item * 2) for item in range(20)]
+    assert in_flight[1] == 3
+
+
+@patch("albums_service.photo_session.get")
+@patch("albums_service.photographers.session.get")
+def test_photos_archive(mock_get_photographer, mock_get_photo, initDB, clearAlbums, sample_album):
+    mock_get_photographer.return_value.status_code = 200
+    mock_get_photo.return_value.status_code = 200
+    mock_get_photo.return_value.content = b"\xff\xd8photo"
+
+    response = client.get(f"/photographers/test_photographer/albums/{sample_album.album_id}/photos-archive")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.namelist() == [f"{photo_id}.jpg" for photo_id in sample_album.photos]
+        assert archive.read("photo1.jpg") == b"\xff\xd8photo"
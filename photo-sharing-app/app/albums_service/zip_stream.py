@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+# ZIP archives written as they are sent: each entry goes out as soon as its
+# photo has been fetched, and only the photos being fetched are in memory,
+# whatever the size of the album.
+
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Sink:
+    """Write-only file ZipFile writes to: without seek() and tell(), it
+    writes each entry once, sizes after the data."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def zip_stream(entries, compression=zipfile.ZIP_STORED):
+    """Yield the bytes of a ZIP archive of `entries`, (name, bytes) pairs,
+    entry by entry. Photos are stored as is: JPEGs do not deflate."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression) as archive:
+        for (name, data) in entries:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = compression
+            archive.writestr(info, data)
+            yield sink.drain()
+    # The central directory
+    yield sink.drain()
+
+
+def prefetch(fetch, items, window=4):
+    """Yield (item, fetch(item)) for each of `items` in order, fetching up
+    to `window` items ahead concurrently."""
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(fetch, item)))
+            if len(pending) >= window:
+                (done, future) = pending.popleft()
+                yield (done, future.result())
+        while pending:
+            (done, future) = pending.popleft()
+            yield (done, future.result())
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+# The albums service keeps a snapshot of the attributes of the photos of each
+# album; it is told here when attributes change, to take them again, and when
+# photos are deleted, to take them out of its albums.
+
+import logging
+
+import requests
+
+from photo_const import settings
+
+logger = logging.getLogger(__name__)
+
+def post_to_albums(display_name, event, photo_ids):
+    for url in settings.album_notification_urls:
+        try:
+            requests.post(f"{url.rstrip('/')}/photographers/{display_name}/photos/{event}",
+                          json={'photo_ids': [str(photo_id) for photo_id in photo_ids]},
+                          timeout=2)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Could not notify {url} of {event} photos of {display_name}: {e}")
+
+def notify_albums(display_name, photo_ids):
+    # The snapshots expire on their own anyway
+    post_to_albums(display_name, "changed", photo_ids)
+
+def notify_albums_of_deletion(display_name, photo_ids):
+    # Until they are told, the albums still list the photos
+    post_to_albums(display_name, "deleted", photo_ids)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Time the sync and the async photo services take to answer many concurrent
+# gallery reads while each photographer check takes `latency` seconds:
+#   python async_load_benchmark.py --host mongo-service --requests 200 --latency 0.05
+# Both apps are called in process, through ASGI, against the same MongoDB;
+# the photographer lookups are not cached, so every read waits for one.
+
+import argparse
+import asyncio
+import time
+import unittest.mock
+
+import httpx
+from httpx import ASGITransport, AsyncClient
+from mongoengine import connect
+
+from photo_const import REQUEST_TIMEOUT, photographer_service
+import photo_service
+import photo_service_async
+import photo_mongo_wrapper_async
+from photo_mongo_wrapper import mongo_save_photo
+from photographer_client import AsyncPhotographerClient
+from sample_images import make_jpeg
+
+
+async def fire(app, requests):
+    async with AsyncClient(transport=ASGITransport(app), base_url="http://testserver") as ac:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[ac.get("/gallery/joe?limit=5")
+                                           for _ in range(requests)])
+        elapsed = time.perf_counter() - start
+    assert all(response.status_code == 200 for response in responses)
+    return elapsed
+
+
+async def main(args):
+    connect(args.database, alias="default", host=args.host)
+    for photo_id in range(5):
+        mongo_save_photo(make_jpeg(4096), "joe", photo_id)
+
+    def slow_photographer(*_, **__):
+        time.sleep(args.latency)
+        return unittest.mock.Mock(status_code=200)
+
+    async def slow_photographer_async(request):
+        await asyncio.sleep(args.latency)
+        return httpx.Response(200, json={})
+
+    with unittest.mock.patch('photo_service.photographers.session.get',
+                             side_effect=slow_photographer), \
+         unittest.mock.patch.object(photo_service.photographers.cache, 'ttl', 0):
+        sync_elapsed = await fire(photo_service.app, args.requests)
+
+    await photo_mongo_wrapper_async.mongo_connect(f"mongodb://{args.host}", args.database)
+    photo_service_async.photographers = AsyncPhotographerClient(
+        photographer_service, REQUEST_TIMEOUT, ttl=0,
+        transport=httpx.MockTransport(slow_photographer_async))
+    async_elapsed = await fire(photo_service_async.app, args.requests)
+
+    print(f"{args.requests} gallery reads: sync {sync_elapsed:.2f} s, "
+          f"async {async_elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the sync and async photo services")
+    parser.add_argument('--host', default="mongo-service")
+    parser.add_argument('--database', default="async_load_benchmark")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="seconds each photographer check takes")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# Images stored per second against a MongoDB server, one at a time as
+# upload_photo does, and as one batch as upload_photos does:
+#   python batch_upload_benchmark.py --host mongo-service --count 50 --size 65536
+# Each way works on a photographer of its own, whose photos are deleted
+# first.
+
+import argparse
+import time
+
+from mongoengine import connect
+
+from photo import Photo
+from tagging_job import TaggingJob
+from photo_mongo_wrapper import mongo_save_photo, mongo_save_photos, mongo_enqueue_tagging
+from sample_images import make_jpeg
+
+
+def save_one_by_one(images, display_name):
+    for (photo_id, image) in enumerate(images):
+        mongo_save_photo(image, display_name, photo_id, tags_status='pending')
+        mongo_enqueue_tagging(display_name, photo_id)
+
+
+def save_batch(images, display_name):
+    mongo_save_photos(images, display_name, 0)
+
+
+def rate(save, display_name, images):
+    Photo.objects(display_name=display_name).delete()
+    TaggingJob.objects(display_name=display_name).delete()
+    start = time.perf_counter()
+    save(images, display_name)
+    return len(images) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark batch uploads")
+    parser.add_argument('--host', default="mongo-service")
+    parser.add_argument('--database', default="batch_upload_benchmark")
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+    connect(args.database, alias="default", host=args.host)
+    for (number, (name, save)) in enumerate([('single', save_one_by_one),
+                                             ('batch', save_batch)]):
+        # Contents of their own, told apart by their lengths: none of them
+        # is stored already
+        images = [make_jpeg(args.size + number * args.count + index)
+                  for index in range(args.count)]
+        print(f"{name:>8}: {rate(save, name, images):8.0f} images/s")
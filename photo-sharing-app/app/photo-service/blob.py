@@ -0,0 +1,17 @@
+from mongoengine import *
+from datetime import datetime
+
+from photo import Rendition
+
+class Blob(Document):
+    """The content of photos, stored once however many photos have it:
+    photos point at their blob by the SHA-256 of their bytes. A blob and its
+    files are deleted with the last of its photos."""
+    sha256 = StringField(primary_key=True)
+    image_file = FileField(required=True, collection_name='images')
+    refcount = IntField(default=0)
+    # The tags of the content, once the tags service has been asked
+    tags = ListField(StringField(max_length=30))
+    tags_status = StringField(choices=('pending', 'done', 'failed'), default='pending')
+    renditions = EmbeddedDocumentListField(Rendition)
+    created_at = DateTimeField(default=datetime.utcnow)
@@ -2,15 +2,25 @@ import pytest
 
 from mongoengine import connect
 
+from blob import Blob
 from photo import Photo
 from photoId import PhotoId
+from tagging_job import TaggingJob
+import photo_service
 
 @pytest.fixture
 def clearPhotos():
     Photo.objects.all().delete()
     PhotoId.objects.all().delete()
+    TaggingJob.objects.all().delete()
+    Blob.objects.all().delete()
 
 @pytest.fixture(scope="class")
 def initDB():
     connect("photos", alias="default", host="mongo-service-test")
     yield
+
+@pytest.fixture(autouse=True)
+def clearPhotographerCache():
+    # Each test mocks the photographer service its own way
+    photo_service.photographers.invalidate()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+# Opaque cursors for keyset pagination: a page ends with the cursor of its
+# last item, and the next page starts right after it with an indexed range
+# query instead of skipping over all the items before it.
+
+import base64
+import json
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Return the key encoded in `cursor`; ValueError if it is not one of
+    ours."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+def decode_gallery_cursor(cursor):
+    """Return the photo_id encoded in a gallery cursor; ValueError if it is
+    not one."""
+    photo_id = decode_cursor(cursor)
+    if not isinstance(photo_id, int) or isinstance(photo_id, bool):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return photo_id
+
+def decode_search_cursor(cursor):
+    """Return the (display_name, photo_id) key encoded in a tag search
+    cursor; ValueError if it is not one."""
+    try:
+        (name, photo_id) = decode_cursor(cursor)
+        return (str(name), int(photo_id))
+    except TypeError as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
@@ -1,11 +1,37 @@
 from mongoengine import *
 
+class Rendition(EmbeddedDocument):
+    """A resized copy of the photo, see renditions.py"""
+    name = StringField(required=True)
+    format = StringField(required=True)
+    width = IntField(required=True)
+    height = IntField(required=True)
+    image_file = FileField(required=True, collection_name='images')
+
 class Photo(Document):
     display_name = StringField(max_length=120, required=True)
-    image_file = ImageField(required=True, size=(800, 600, True))
+    # The original upload, in the GridFS bucket ImageField used to write to.
+    # It belongs to the Blob `sha256` if set, shared with the other photos
+    # of the same content; photos stored before blobs own their files.
+    image_file = FileField(required=True, collection_name='images')
+    sha256 = StringField()
     photo_id = IntField(required=True)
     author = StringField(max_length=120, required=False)
     title = StringField(max_length=100, required=False)
     comment = StringField(max_length=100, required=False)
     location = StringField(max_length=100, required=False)
     tags = ListField(StringField(max_length=30), required=False)
+    # 'pending' until a tagging worker has set the tags
+    tags_status = StringField(choices=('pending', 'done', 'failed'), default='done')
+    # Of the blob if any, copied here to be served in one read
+    renditions = EmbeddedDocumentListField(Rendition)
+
+    meta = {
+        # Photo lookups and gallery pages; tag searches, one index entry per
+        # tag of a photo, in the order of their pages; the photos waiting for
+        # tags, swept by the tagging workers
+        'indexes': [('display_name', 'photo_id'), 'sha256',
+                    ('tags', 'display_name', 'photo_id'),
+                    {'fields': ['tags_status'],
+                     'partialFilterExpression': {'tags_status': 'pending'}}]
+    }
@@ -1,5 +1,5 @@
 from mongoengine import *
 
 class PhotoId(Document):
-    display_name = StringField(max_length=120, required=True)
+    display_name = StringField(max_length=120, required=True, unique=True)
     next_photo_id = IntField(required=True)
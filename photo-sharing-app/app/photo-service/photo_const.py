@@ -1,23 +1,206 @@
 #!/usr/bin/env python3
 
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, field_validator
+from pydantic_settings import BaseSettings
+from typing import Dict, List, Optional, Tuple
 
 REQUEST_TIMEOUT = 5
 
+photo_all_attributes = ['title', 'comment', 'location', 'author']
+
+class Settings(BaseSettings):
+    mongo_host: str = "localhost"
+    mongo_port: str = "27017"
+    mongo_user: str = ""
+    mongo_password: str = ""
+    database_name: str = "photos"
+    auth_database_name: str = "photographers"
+
+    tags_host: str = "tags-service"
+    tags_port: str = "50051"
+
+    photographer_host: str = "photographer-service"
+    photographer_port: str = "80"
+
+    # Photo ids leased per photographer and worker process (1 = no leasing)
+    photo_id_block_size: int = 1
+
+    # Tagging queue: worker threads started with the service, tags requests
+    # in flight per worker, jobs claimed at once, attempts before giving up,
+    # seconds a claimed job stays leased, and deadline of a tags request
+    tagging_workers: int = 1
+    tagging_concurrency: int = 4
+    tagging_batch_size: int = 16
+    tagging_max_attempts: int = 5
+    tagging_lease: int = 60
+    tags_deadline: float = 10
+    # Send each claimed batch with one getTagsBatch call instead of one
+    # getTags per photo
+    tagging_batch_rpc: bool = False
+    # Largest edge in pixels of the copy of the photo sent to be tagged
+    # (0 = the original)
+    tagging_max_edge: int = 512
+    # Seconds between two sweeps for photos waiting for tags with no job,
+    # left so by an upload that failed to queue them
+    tagging_sweep_interval: float = 300
+
+    # Channels to the tags service, gzip compression of the messages (JPEGs
+    # hardly compress), seconds between keepalive pings during calls, and
+    # attempts of calls failing with UNAVAILABLE
+    tags_channels: int = 1
+    tags_compression: bool = False
+    tags_keepalive: int = 300
+    tags_max_attempts: int = 3
+
+    # Resized copies of each photo: name -> (width, height, crop), as with
+    # the size of an ImageField. Each is stored in every rendition format.
+    renditions: Dict[str, Tuple[int, int, bool]] = {"thumb": (160, 120, True),
+                                                    "small": (480, 360, False),
+                                                    "medium": (800, 600, True)}
+    rendition_formats: List[str] = ["JPEG", "WEBP"]
+    rendition_quality: int = 85
+
+    # Seconds browsers and CDNs may cache a photo without revalidating it
+    photo_max_age: int = 86400
+
+    # Threads writing the photos of a batch upload concurrently (sync mode)
+    upload_fanout_workers: int = 32
+
+    # Most items returned by one page of a gallery, of a tag search, or of
+    # tag counts
+    page_max_limit: int = 100
+
+    # Most files accepted by one POST /gallery/{display_name}/batch
+    batch_upload_max_files: int = 100
+    # Most photos changed by one PATCH /photo/{display_name}/attributes
+    bulk_attributes_max_items: int = 1000
+    # Most photos read by one GET or POST /photo/{display_name}/attributes,
+    # or looked up by one POST /photo/{display_name}/exists
+    bulk_read_max_items: int = 1000
+
+    # Albums services to notify when photo attributes change
+    album_notification_urls: List[str] = []
+
+    # Size of the connection pool to the photographer service
+    photographer_max_connections: int = 100
+    # Seconds a photographer is known to exist, or not to exist, and how many
+    # of them are remembered
+    photographer_cache_ttl: float = 30
+    photographer_cache_negative_ttl: float = 5
+    photographer_cache_size: int = 10000
+
+    def mongo_url(self):
+        conn = f"mongodb://"
+        if self.mongo_user:
+            conn += f"{self.mongo_user}:{self.mongo_password}@"
+        conn += f"{self.mongo_host}:{self.mongo_port}"
+        conn += f"/{self.database_name}?authSource={self.auth_database_name}"
+        return conn
+
+settings = Settings()
+
+photographer_service = 'http://' + settings.photographer_host + ':' + settings.photographer_port + '/'
+
 class PhotoAttributesNoTags(BaseModel):
     title: str
     comment: str
     location: str
     author: str
 
+class PhotoAttributesPatch(BaseModel):
+    # Only the attributes given are changed
+    title: Optional[str] = None
+    comment: Optional[str] = None
+    location: Optional[str] = None
+    author: Optional[str] = None
+
+    @field_validator('title', 'comment', 'location', 'author')
+    @classmethod
+    def not_null(cls, value):
+        # Left out, an attribute is kept; null would be stored, and the
+        # photo could no longer be read as PhotoAttributes
+        if value is None:
+            raise ValueError("must be a string; leave it out to keep it")
+        return value
+
+class PhotoAttributesUpdate(PhotoAttributesPatch):
+    photo_id: int
+
+class BulkAttributes(BaseModel):
+    items: List[PhotoAttributesUpdate]
+
+class BulkAttributesResult(BaseModel):
+    # Photos found, and photos actually changed
+    matched: int
+    modified: int
+
 class PhotoAttributes(PhotoAttributesNoTags):
     tags: List[str]
+    # 'pending' while the photo waits in the tagging queue
+    tags_status: str = "done"
+
+class PhotoIds(BaseModel):
+    ids: List[int]
+
+class PhotoAttributesItem(BaseModel):
+    photo_id: int
+    # None if the photographer has no such photo
+    attributes: Optional[PhotoAttributes] = None
+
+class PhotoAttributesBatch(BaseModel):
+    # In the order of the ids asked for
+    items: List[PhotoAttributesItem]
 
 class PhotoDigest(BaseModel):
     photo_id: int
     link: str
 
+class PhotoMatch(PhotoDigest):
+    display_name: str
+
+class SearchResults(BaseModel):
+    items: List[PhotoMatch]
+    has_more: bool
+    # Pass as `after` to get the next page
+    next_cursor: Optional[str] = None
+
+class TagCount(BaseModel):
+    tag: str
+    count: int
+
+class TagFacets(BaseModel):
+    # Photos matching, and their most frequent tags
+    total: int
+    tags: List[TagCount]
+
+class TaggingQueue(BaseModel):
+    pending: int
+    running: int
+    failed: int
+    oldest_pending_seconds: float
+
+class LookupCacheStats(BaseModel):
+    lookups: int
+    hits: int
+    coalesced: int
+    misses: int
+    errors: int
+    hit_ratio: float
+    mean_latency_ms: float
+    mean_request_latency_ms: float
+    entries: int
+
+class UploadResult(BaseModel):
+    filename: Optional[str] = None
+    status: int
+    location: Optional[str] = None
+    detail: Optional[str] = None
+
+class BatchUpload(BaseModel):
+    items: List[UploadResult]
+
 class Photos(BaseModel):
     items: List[PhotoDigest]
     has_more: bool
+    # Pass as `after` to get the next page
+    next_cursor: Optional[str] = None
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# HTTP caching and byte ranges for the photos served from GridFS: ETag,
+# Last-Modified, conditional requests (304) and single byte ranges (206),
+# with the body streamed one GridFS chunk at a time.
+
+import re
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import HTTPException
+from starlette.responses import Response, StreamingResponse
+
+def etag(grid_out):
+    # GridFS files carry the MD5 of their content: the service writes it,
+    # as pymongo used to before 4.0
+    if grid_out.md5:
+        return '"' + grid_out.md5 + '"'
+    return 'W/"' + str(grid_out._id) + '"'
+
+def last_modified(grid_out):
+    return grid_out.upload_date.replace(tzinfo=timezone.utc, microsecond=0)
+
+def strong(tag):
+    # If-None-Match uses the weak comparison: W/ prefixes are ignored
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def is_not_modified(request, tag, modified):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [strong(candidate) for candidate in if_none_match.split(",")]
+        return "*" in candidates or strong(tag) in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def requested_range(request, tag, length):
+    """Return the (start, end) bytes, end excluded, of the single range
+    the request asks for, or None to send the whole photo."""
+    header = request.headers.get("range")
+    if header is None or not header.startswith("bytes=") or "," in header:
+        # No range, or several ranges: those are served whole
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != tag:
+        return None
+    spec = re.fullmatch(r"(\d*)-(\d*)", header[len("bytes="):].strip())
+    if spec is None or spec.group(1) == spec.group(2) == "":
+        return None
+    (first, last) = spec.groups()
+    if first == "":
+        start = max(length - int(last), 0)
+        end = length
+    else:
+        start = int(first)
+        if last and int(last) < start:
+            # Not a valid range (RFC 7233, 2.1): the header is ignored
+            return None
+        end = min(int(last) + 1, length) if last else length
+    # A valid range, but with no byte of the photo in it
+    if start >= end:
+        raise HTTPException(status_code = 416, detail = "Range Not Satisfiable",
+                            headers = {"Content-Range": f"bytes */{length}"})
+    return (start, end)
+
+def cache_headers(grid_out, max_age):
+    return {"ETag": etag(grid_out),
+            "Last-Modified": format_datetime(last_modified(grid_out), usegmt=True),
+            "Accept-Ranges": "bytes",
+            "Cache-Control": f"public, max-age={max_age}" if max_age else "no-cache"}
+
+def prepare(request, grid_out, headers, max_age):
+    """Headers and byte range of the response to `request` for `grid_out`;
+    the range is None if the client has the photo already (304)."""
+    headers = dict(headers, **cache_headers(grid_out, max_age))
+    if is_not_modified(request, headers["ETag"], last_modified(grid_out)):
+        return (304, headers, None)
+    byte_range = requested_range(request, headers["ETag"], grid_out.length)
+    if byte_range is None:
+        byte_range = (0, grid_out.length)
+        status = 200
+    else:
+        status = 206
+        headers["Content-Range"] = f"bytes {byte_range[0]}-{byte_range[1] - 1}/{grid_out.length}"
+    headers["Content-Length"] = str(byte_range[1] - byte_range[0])
+    return (status, headers, byte_range)
+
+def iter_range(grid_out, start, end):
+    grid_out.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = grid_out.readchunk()
+        if not chunk:
+            break
+        yield chunk[:remaining]
+        remaining -= len(chunk)
+
+async def aiter_range(grid_out, start, end):
+    grid_out.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = await grid_out.readchunk()
+        if not chunk:
+            break
+        yield chunk[:remaining]
+        remaining -= len(chunk)
+
+def photo_response(request, grid_out, headers={}, max_age=0):
+    """Stream a GridOut (pymongo) to the client, honouring conditional and
+    range requests."""
+    (status, headers, byte_range) = prepare(request, grid_out, headers, max_age)
+    if byte_range is None:
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(iter_range(grid_out, *byte_range), status_code=status,
+                             headers=headers, media_type=grid_out.content_type or "image/jpeg")
+
+def photo_head_response(request, grid_out, headers={}, max_age=0):
+    """The headers photo_response would send for `grid_out`, without the
+    body: only the GridFS file document is needed, not the chunks."""
+    (status, headers, byte_range) = prepare(request, grid_out, headers, max_age)
+    headers["Content-Type"] = grid_out.content_type or "image/jpeg"
+    return Response(status_code=status, headers=headers)
+
+def photo_response_async(request, grid_out, headers={}, max_age=0):
+    """photo_response for a motor GridOut."""
+    (status, headers, byte_range) = prepare(request, grid_out, headers, max_age)
+    if byte_range is None:
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(aiter_range(grid_out, *byte_range), status_code=status,
+                             headers=headers, media_type=grid_out.content_type or "image/jpeg")
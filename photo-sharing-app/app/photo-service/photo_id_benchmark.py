@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# Photo ids allocated per second against a MongoDB server, by the
+# read-modify-write allocator the service used to have, by one atomic
+# upsert per id, and from leased blocks of ids:
+#   python photo_id_benchmark.py --host mongo-service --count 500 --block-size 100
+# Each allocator works on a photographer of its own, whose counter is reset
+# first.
+
+import argparse
+import time
+
+from mongoengine import connect
+
+from photoId import PhotoId
+from photo_mongo_wrapper import mongo_reserve_photo_ids, PhotoIdLeases
+
+
+def legacy_allocate_photo_id(display_name):
+    # The read-modify-write allocator mongo_allocate_photo_id used to be
+    try:
+        ph_id = PhotoId.objects(display_name=display_name).get()
+        photo_id = ph_id.next_photo_id
+        ph_id.next_photo_id += 1
+        ph_id.save()
+        return photo_id
+    except PhotoId.DoesNotExist as e:
+        ph_id = PhotoId(display_name=display_name, next_photo_id=1).save()
+        return 0
+
+
+def rate(allocate, display_name, count):
+    PhotoId.objects(display_name=display_name).delete()
+    start = time.perf_counter()
+    for _ in range(count):
+        allocate(display_name)
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark photo id allocation")
+    parser.add_argument('--host', default="mongo-service")
+    parser.add_argument('--database', default="photo_id_benchmark")
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--block-size', type=int, default=100)
+    args = parser.parse_args()
+    connect(args.database, alias="default", host=args.host)
+    allocators = [('legacy', legacy_allocate_photo_id),
+                  ('atomic', lambda name: mongo_reserve_photo_ids(name)),
+                  (f'leased({args.block_size})', PhotoIdLeases(args.block_size).allocate)]
+    for (name, allocate) in allocators:
+        print(f"{name:>12}: {rate(allocate, name, args.count):8.0f} photo ids/s")
@@ -1,53 +1,256 @@
 #!/usr/bin/env python3
 
 import logging
+import hashlib
+import io
 import json
 
 from photo import Photo
 from photoId import PhotoId
+from blob import Blob
+from tagging_job import TaggingJob
 
 from mongoengine import *
+import os
 import socket
+import threading
 import pymongo
+from datetime import datetime, timedelta
 
 from bson.objectid import ObjectId
 from bson import json_util
 from bson.errors import InvalidId
+from PIL import Image
 
 #from flask import jsonify
 import json
 #import flask
 import robustify
 
+def image_content_type(image):
+    """Check that `image` is a picture PIL can identify; return its MIME type.
+
+    Only the header is parsed, the pixels are never decoded.
+    """
+    # BytesIO shares the buffer of a bytes object instead of copying it
+    with Image.open(io.BytesIO(image)) as img:
+        return Image.MIME.get(img.format, 'application/octet-stream')
+
+def acquire_blob(image):
+    """Take a reference on the Blob of `image` (bytes), storing it first if
+    its content is new; raises IOError if `image` is not a picture.
+
+    GridFS pulls the image through a reader one chunk at a time, so apart
+    from the caller's buffer the memory used is bounded by the chunk size.
+    """
+    sha256 = hashlib.sha256(image).hexdigest()
+    blob = Blob.objects(sha256=sha256).modify(inc__refcount=1, new=True)
+    if blob is not None:
+        return blob
+    content_type = image_content_type(image)
+    blob = Blob(sha256=sha256, refcount=1)
+    blob.image_file.put(io.BytesIO(image), content_type=content_type,
+                        md5=hashlib.md5(image).hexdigest())
+    try:
+        blob.save(force_insert=True)
+    except NotUniqueError:
+        # Stored meanwhile by a concurrent upload: theirs is kept
+        blob.image_file.delete()
+        return acquire_blob(image)
+    return blob
+
+def release_blob(sha256):
+    """Drop a reference on a Blob, deleting it with its files if it was the
+    last one."""
+    blob = Blob.objects(sha256=sha256).modify(dec__refcount=1, new=True)
+    # Unless a new upload of the same content has taken a reference since
+    if blob is not None and blob.refcount <= 0 and \
+       Blob.objects(sha256=sha256, refcount__lte=0).delete():
+        delete_files(blob)
+
+def delete_files(holder):
+    """Delete the image and rendition files of a Blob, or of a Photo
+    stored before blobs."""
+    holder.image_file.delete()
+    for rendition in holder.renditions:
+        rendition.image_file.delete()
+
+def new_photo(image, display_name, photo_id, tags=(), tags_status='done'):
+    """A Photo, not saved yet, of the image `image`, whose content is stored
+    already. Photos waiting for their tags take them from an earlier photo
+    of the same content if it has been tagged.
+    Raises IOError if `image` is not a picture.
+    """
+    blob = acquire_blob(image)
+    if tags_status == 'pending' and blob.tags_status == 'done':
+        (tags, tags_status) = (blob.tags, 'done')
+    photo = Photo(photo_id=photo_id, display_name=display_name,
+                  comment="--unset--",
+                  author="--unset--",
+                  title="--unset--",
+                  location="--unset--",
+                  tags=list(tags),
+                  tags_status=tags_status,
+                  sha256=blob.sha256,
+                  renditions=blob.renditions)
+    photo.image_file = blob.image_file
+    return photo
+
+def upsert_photos(photos):
+    # Upserted on (display_name, photo_id), which are unique as photo ids are
+    # allocated atomically: writing them again leaves them as they are
+    for photo in photos:
+        photo.validate()
+    Photo._get_collection().bulk_write(
+        [pymongo.UpdateOne({'display_name': photo.display_name, 'photo_id': photo.photo_id},
+                           {'$setOnInsert': photo.to_mongo()}, upsert=True)
+         for photo in photos],
+        ordered=False)
+
+@robustify.retry_mongo
+def insert_photos(photos):
+    """Insert `photos` with one write. A retry after a reply was lost, the
+    write done, does not insert them twice."""
+    upsert_photos(photos)
+
+def upsert_tagging_jobs(photos):
+    TaggingJob._get_collection().bulk_write(
+        [pymongo.UpdateOne({'display_name': display_name, 'photo_id': photo_id},
+                           {'$setOnInsert': TaggingJob(display_name=display_name,
+                                                       photo_id=photo_id).to_mongo()},
+                           upsert=True)
+         for (display_name, photo_id) in photos],
+        ordered=False)
+
 @robustify.retry_mongo
-def mongo_save_photo(upfile, display_name, photo_id):
+def enqueue_tagging_jobs(display_name, photo_ids):
+    """Queue the photos `photo_ids` for tagging with one write; as with
+    insert_photos, a photo queued already is not queued twice: the jobs are
+    unique on (display_name, photo_id)."""
+    upsert_tagging_jobs([(display_name, photo_id) for photo_id in photo_ids])
+
+def mongo_save_photo(image, display_name, photo_id, tags=(), tags_status='done'):
+    """Store the uploaded bytes `image` as photo `photo_id` of `display_name`.
+
+    The photo document, tags included, is written with a single insert.
+    Returns the Photo, or False if `image` is not a picture.
+    The reference on the content is taken once, outside the retries of the
+    insert, and dropped again if the photo cannot be inserted.
+    """
     try:
-        photo = Photo(image_file=upfile, photo_id=photo_id, display_name=display_name,
-                      comment="unset",
-                      author="unset",
-                      title="unset",
-                      location="unset",
-                      tags=[])
-        photo.save()
+        photo = new_photo(image, display_name, photo_id, tags, tags_status)
     except (IOError):
         return False
-    except (pymongo.errors.AutoReconnect,
-            pymongo.errors.ServerSelectionTimeoutError,
-            pymongo.errors.NetworkTimeout) as e:
-        raise 
-    return True
+    try:
+        insert_photos([photo])
+    except BaseException:
+        release_blob(photo.sha256)
+        raise
+    return photo
+
+def mongo_save_photos(images, display_name, first_photo_id, map=map):
+    """Store `images` (bytes, all pictures) as the photos first_photo_id,
+    first_photo_id + 1, ... of `display_name`, and queue the ones whose
+    content has no tags yet for tagging; return the Photos.
+
+    The new contents are written through `map`, an executor's to write them
+    in parallel; then the photo documents and the tagging jobs are written
+    with one bulk write each. Each of the steps is retried on its own, and
+    is idempotent. If the photos cannot all be stored, the references they
+    took on their contents are dropped.
+    """
+    def store(image, photo_id):
+        try:
+            return new_photo(image, display_name, photo_id, tags_status='pending')
+        except Exception as e:
+            return e
+    stored = list(map(store, images, range(first_photo_id, first_photo_id + len(images))))
+    photos = [photo for photo in stored if isinstance(photo, Photo)]
+    try:
+        for failure in stored:
+            if not isinstance(failure, Photo):
+                raise failure
+        insert_photos(photos)
+    except BaseException:
+        for photo in photos:
+            release_blob(photo.sha256)
+        raise
+    pending = [photo.photo_id for photo in photos if photo.tags_status == 'pending']
+    if pending:
+        enqueue_tagging_jobs(display_name, pending)
+    return photos
 
 @robustify.retry_mongo
-def mongo_allocate_photo_id(display_name):
+def mongo_reserve_photo_ids(display_name, count=1):
+    """Atomically reserve `count` consecutive photo ids for `display_name`.
+
+    A single upserting $inc on the PhotoId counter: one round trip, and two
+    callers can never be handed overlapping ranges. Returns the first id of
+    the reserved range.
+    """
     try:
-        ph_id = PhotoId.objects(display_name=display_name).get()
-        photo_id = ph_id.next_photo_id
-        ph_id.next_photo_id += 1
-        ph_id.save()
-        return photo_id
-    except PhotoId.DoesNotExist as e:
-        ph_id = PhotoId(display_name=display_name, next_photo_id=1).save()
-        return 0
+        ph_id = PhotoId.objects(display_name=display_name).modify(
+            upsert=True, new=True, inc__next_photo_id=count)
+    except NotUniqueError:
+        # Two first-time upserts raced on the unique display_name index:
+        # the counter exists now, so the increment can simply be replayed.
+        ph_id = PhotoId.objects(display_name=display_name).modify(
+            new=True, inc__next_photo_id=count)
+    return ph_id.next_photo_id - count
+
+
+class PhotoIdLeases:
+    """Hands out photo ids from blocks leased with mongo_reserve_photo_ids.
+
+    Each worker process leases `block_size` ids per photographer at a time and
+    serves them from memory, so bulk ingest only touches the PhotoId
+    collection once per block. Ids are unique across processes but are not
+    necessarily dense: the unused tail of a lease is lost when the process
+    exits. With a block size of 1 every id is allocated from Mongo.
+
+    Each photographer has a lock of its own, held while its lease is
+    refilled: allocations for other photographers go on meanwhile.
+    """
+
+    def __init__(self, block_size=1):
+        self.block_size = block_size
+        # Guards the dicts, never held during a round trip
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._leases = {}
+        self._pid = os.getpid()
+
+    def _lock_of(self, display_name):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Leases inherited through fork() are shared with the parent
+                self._locks = {}
+                self._leases = {}
+                self._pid = os.getpid()
+            return self._locks.setdefault(display_name, threading.Lock())
+
+    def allocate(self, display_name, count=1):
+        """Return the first of `count` consecutive ids for `display_name`."""
+        if count >= self.block_size:
+            # No lease would be left over: straight from the counter
+            return mongo_reserve_photo_ids(display_name, count)
+        with self._lock_of(display_name):
+            (next_id, end) = self._leases.get(display_name, (0, 0))
+            if end - next_id < count:
+                next_id = mongo_reserve_photo_ids(display_name, self.block_size)
+                end = next_id + self.block_size
+            self._leases[display_name] = (next_id + count, end)
+            return next_id
+
+    def reset(self):
+        with self._lock:
+            self._leases = {}
+
+
+photo_id_leases = PhotoIdLeases()
+
+def mongo_allocate_photo_id(display_name):
+    return photo_id_leases.allocate(display_name)
 
 @robustify.retry_mongo
 def mongo_get_photo_by_name_and_id(display_name, photo_id):
@@ -59,6 +262,16 @@ def mongo_get_photo_by_name_and_id(display_name, photo_id):
             pymongo.errors.NetworkTimeout) as e:
         raise 
 
+@robustify.retry_mongo
+def mongo_open_photo_file(display_name, photo_id):
+    """The GridOut of the original of a photo, or None if there is no such
+    photo or file. Only the file id of the photo and the GridFS file document are
+    read: the chunks are left alone until the GridOut is read."""
+    ph = Photo.objects(display_name=display_name, photo_id=photo_id).only('image_file').first()
+    if ph is None:
+        return None
+    return ph.image_file.get()
+
 @robustify.retry_mongo
 def mongo_delete_photo_by_name_and_id(display_name, photo_id):
     try:
@@ -69,37 +282,242 @@ def mongo_delete_photo_by_name_and_id(display_name, photo_id):
         raise 
     except (Photo.DoesNotExist) as e:
         return False
-    ph.delete()
+    if not Photo.objects(id=ph.id).delete():
+        # Deleted meanwhile by someone else
+        return False
+    if ph.sha256:
+        release_blob(ph.sha256)
+    else:
+        delete_files(ph)
     return True
 
 @robustify.retry_mongo
-def mongo_get_photos_by_name(display_name, offset, limit):
-    try:
-        qs = Photo.objects(display_name=display_name).order_by('photo_id').skip(offset).limit(limit)
-        if qs.count(with_limit_and_skip = False) > (offset + limit):
-            has_more = True
-        else:
-            has_more = False
-    except (pymongo.errors.AutoReconnect,
-            pymongo.errors.ServerSelectionTimeoutError,
-            pymongo.errors.NetworkTimeout) as e:
-        raise 
-    return (has_more, qs)
+def mongo_get_photos_by_name(display_name, offset, limit, after=None):
+    """Return (has_more, photo_ids) of a gallery page: the `limit` photos
+    after photo `after` if given, else after the first `offset` ones."""
+    qs = Photo.objects(display_name=display_name)
+    if after is not None:
+        qs = qs.filter(photo_id__gt=after)
+    else:
+        qs = qs.skip(offset)
+    photo_ids = list(qs.order_by('photo_id').limit(limit + 1).scalar('photo_id'))
+    return (len(photo_ids) > limit, photo_ids[:limit])
+
+def tag_query(tags, match_all=True, display_name=None, after=None):
+    """The filter of the photos with all of `tags` (any of them unless
+    `match_all`), of `display_name` if given, and after the
+    (display_name, photo_id) key `after` in the order of SEARCH_ORDER."""
+    query = {}
+    if tags:
+        query['tags'] = {'$all' if match_all else '$in': list(tags)}
+    if display_name:
+        query['display_name'] = display_name
+    if after is not None:
+        (name, photo_id) = after
+        query['$or'] = [{'display_name': {'$gt': name}},
+                        {'display_name': name, 'photo_id': {'$gt': photo_id}}]
+    return query
+
+SEARCH_ORDER = [('display_name', pymongo.ASCENDING), ('photo_id', pymongo.ASCENDING)]
+
+def tag_facets_pipeline(query, limit):
+    """Aggregation counting the photos matching `query` and, among them,
+    the photos of each of their `limit` most frequent tags."""
+    return [{'$match': query},
+            {'$facet': {'total': [{'$count': 'photos'}],
+                        'tags': [{'$unwind': '$tags'},
+                                 {'$group': {'_id': '$tags', 'count': {'$sum': 1}}},
+                                 {'$sort': {'count': -1, '_id': 1}},
+                                 {'$limit': limit}]}}]
+
+def tag_facets(result):
+    """The TagFacets of the output of tag_facets_pipeline."""
+    facets = result[0] if result else {'total': [], 'tags': []}
+    return {'total': facets['total'][0]['photos'] if facets['total'] else 0,
+            'tags': [{'tag': tag['_id'], 'count': tag['count']} for tag in facets['tags']]}
+
+@robustify.retry_mongo
+def mongo_search_photos(tags, match_all, display_name, limit, after=None):
+    """Return (has_more, [(display_name, photo_id)]) of a page of the photos
+    with `tags`, read off the tags index: only matching photos are read."""
+    cursor = Photo._get_collection().find(
+        tag_query(tags, match_all, display_name, after),
+        {'_id': 0, 'display_name': 1, 'photo_id': 1})
+    found = list(cursor.sort(SEARCH_ORDER).limit(limit + 1))
+    return (len(found) > limit,
+            [(ph['display_name'], ph['photo_id']) for ph in found[:limit]])
+
+@robustify.retry_mongo
+def mongo_tag_facets(tags, match_all, display_name, limit):
+    """Count the photos with `tags` and their tags, in one aggregation."""
+    return tag_facets(list(Photo._get_collection().aggregate(
+        tag_facets_pipeline(tag_query(tags, match_all, display_name), limit))))
 
 @robustify.retry_mongo
 def mongo_set_photo_attributes(display_name, photo_id, attributes, photo_all_attributes):
-    try:
-        qs = Photo.objects(photo_id=photo_id, display_name=display_name)
-        for key, value in attributes.items():
-            set_attr = "set__" + key 
-            qs.update (**{set_attr: value})
-
-        for element in photo_all_attributes:
-            if not element in attributes:
-                set_attr = "set__" + element 
-                qs.update (**{set_attr: "--unset--"})
-        return qs
-    except (pymongo.errors.AutoReconnect,
-            pymongo.errors.ServerSelectionTimeoutError,
-            pymongo.errors.NetworkTimeout) as e:
-        raise
+    """Set `attributes`, and reset the others of `photo_all_attributes`, with
+    a single update; return how many photos matched."""
+    update = {element: "--unset--" for element in photo_all_attributes}
+    update.update(attributes)
+    return mongo_update_photo_attributes(display_name, photo_id, update)
+
+@robustify.retry_mongo
+def mongo_update_photo_attributes(display_name, photo_id, attributes):
+    """Set `attributes` only, with a single update; return how many photos
+    matched."""
+    qs = Photo.objects(photo_id=photo_id, display_name=display_name)
+    if not attributes:
+        return qs.count()
+    return qs.update(**{"set__" + key: value for (key, value) in attributes.items()})
+
+ATTRIBUTES_PROJECTION = {'_id': 0, 'photo_id': 1, 'title': 1, 'comment': 1, 'location': 1,
+                         'author': 1, 'tags': 1, 'tags_status': 1}
+
+def attributes_in_order(photo_ids, found):
+    """(photo_id, attributes or None) for each of `photo_ids`, from the
+    `found` photo documents in any order."""
+    by_id = {ph['photo_id']: ph for ph in found}
+    return [(photo_id, by_id.get(photo_id)) for photo_id in photo_ids]
+
+@robustify.retry_mongo
+def mongo_get_photos_attributes(display_name, photo_ids):
+    """The attributes of the photos `photo_ids` of `display_name`, read with
+    one query that leaves out the files: see attributes_in_order."""
+    found = Photo._get_collection().find(
+        {'display_name': display_name, 'photo_id': {'$in': list(set(photo_ids))}},
+        ATTRIBUTES_PROJECTION)
+    return attributes_in_order(photo_ids, found)
+
+EXISTS_PROJECTION = {'_id': 0, 'photo_id': 1}
+
+def existing_in_order(photo_ids, found):
+    """The `photo_ids` among the `found` photo documents, in the order
+    asked for, once each."""
+    existing = {ph['photo_id'] for ph in found}
+    return [photo_id for photo_id in dict.fromkeys(photo_ids) if photo_id in existing]
+
+@robustify.retry_mongo
+def mongo_existing_photo_ids(display_name, photo_ids):
+    """The `photo_ids` of `display_name` that exist. The query is covered by
+    the (display_name, photo_id) index: no photo document is read."""
+    found = Photo._get_collection().find(
+        {'display_name': display_name, 'photo_id': {'$in': list(set(photo_ids))}},
+        EXISTS_PROJECTION)
+    return existing_in_order(photo_ids, found)
+
+def attribute_updates(display_name, updates):
+    """The bulk_write requests setting the attributes of each of `updates`,
+    (photo_id, attributes) pairs."""
+    return [pymongo.UpdateOne({'display_name': display_name, 'photo_id': photo_id},
+                              {'$set': attributes})
+            for (photo_id, attributes) in updates if attributes]
+
+@robustify.retry_mongo
+def mongo_bulk_update_photo_attributes(display_name, updates):
+    """Apply `updates`, (photo_id, attributes) pairs, with one bulk write;
+    return how many photos matched and how many were changed."""
+    requests = attribute_updates(display_name, updates)
+    if not requests:
+        return {'matched': 0, 'modified': 0}
+    result = Photo._get_collection().bulk_write(requests, ordered=False)
+    return {'matched': result.matched_count, 'modified': result.modified_count}
+
+def mongo_enqueue_tagging(display_name, photo_id):
+    # An upsert, retried: a retry after a lost reply does not queue it twice
+    enqueue_tagging_jobs(display_name, [photo_id])
+
+def requeue_unqueued(photos):
+    """Queue the ones of `photos`, (display_name, photo_id) pairs, that have
+    no tagging job; return how many."""
+    queued = TaggingJob._get_collection().find(
+        {'$or': [{'display_name': display_name, 'photo_id': photo_id}
+                 for (display_name, photo_id) in photos]},
+        {'_id': 0, 'display_name': 1, 'photo_id': 1})
+    queued = {(job['display_name'], job['photo_id']) for job in queued}
+    unqueued = [photo for photo in photos if photo not in queued]
+    if unqueued:
+        upsert_tagging_jobs(unqueued)
+    return len(unqueued)
+
+@robustify.retry_mongo
+def mongo_requeue_untagged(batch_size=1000):
+    """Queue the photos waiting for tags that have no tagging job: an upload
+    that failed between writing its photo and queueing it leaves it so.
+    Return how many were queued. The jobs are upserted: a photo queued
+    meanwhile is not queued twice."""
+    requeued = 0
+    batch = []
+    for ph in Photo._get_collection().find({'tags_status': 'pending'},
+                                           {'_id': 0, 'display_name': 1, 'photo_id': 1}):
+        batch.append((ph['display_name'], ph['photo_id']))
+        if len(batch) == batch_size:
+            requeued += requeue_unqueued(batch)
+            batch = []
+    if batch:
+        requeued += requeue_unqueued(batch)
+    return requeued
+
+@robustify.retry_mongo
+def mongo_claim_tagging_jobs(owner, batch_size, lease):
+    """Lease up to `batch_size` ready jobs to `owner` for `lease` seconds.
+
+    Jobs left running by a worker that died are ready again once their
+    lease has expired.
+    """
+    now = datetime.utcnow()
+    ready = Q(state='pending', not_before__lte=now) | Q(state='running', not_before__lte=now)
+    candidates = TaggingJob.objects(ready).order_by('not_before').limit(batch_size).scalar('id')
+    # Another worker may claim some of the candidates first: the state is
+    # checked again by the update, and only the jobs we won are returned
+    TaggingJob.objects(ready, id__in=list(candidates)).update(
+        set__state='running', set__owner=owner, set__not_before=now + timedelta(seconds=lease))
+    return list(TaggingJob.objects(owner=owner, state='running'))
+
+@robustify.retry_mongo
+def mongo_complete_tagging(results):
+    """Store the tags of finished jobs; `results` maps jobs to tag lists."""
+    if not results:
+        return
+    Photo._get_collection().bulk_write(
+        [pymongo.UpdateOne({'display_name': job.display_name, 'photo_id': job.photo_id},
+                           {'$set': {'tags': tags, 'tags_status': 'done'}})
+         for (job, tags) in results.items()],
+        ordered=False)
+    # The tags are remembered for the content, for later photos of it
+    photos = Photo._get_collection().find(
+        {'$or': [{'display_name': job.display_name, 'photo_id': job.photo_id}
+                 for job in results]},
+        {'display_name': 1, 'photo_id': 1, 'sha256': 1})
+    contents = {(ph['display_name'], ph['photo_id']): ph.get('sha256') for ph in photos}
+    memos = [pymongo.UpdateOne({'_id': contents[(job.display_name, job.photo_id)]},
+                               {'$set': {'tags': tags, 'tags_status': 'done'}})
+             for (job, tags) in results.items()
+             if contents.get((job.display_name, job.photo_id))]
+    if memos:
+        Blob._get_collection().bulk_write(memos, ordered=False)
+    TaggingJob.objects(id__in=[job.id for job in results]).delete()
+
+@robustify.retry_mongo
+def mongo_retry_tagging(job, error, max_attempts):
+    """Put a failed job back in the queue with exponential backoff, or give
+    up on it after `max_attempts` attempts."""
+    attempts = job.attempts + 1
+    if attempts >= max_attempts:
+        TaggingJob.objects(id=job.id).update(
+            set__state='failed', set__attempts=attempts, set__last_error=error, unset__owner=1)
+        Photo.objects(display_name=job.display_name, photo_id=job.photo_id).update(
+            set__tags_status='failed')
+    else:
+        delay = min(2 ** attempts, 300)
+        TaggingJob.objects(id=job.id).update(
+            set__state='pending', set__attempts=attempts, set__last_error=error,
+            set__not_before=datetime.utcnow() + timedelta(seconds=delay), unset__owner=1)
+
+@robustify.retry_mongo
+def mongo_tagging_queue_depth():
+    depth = {'pending': 0, 'running': 0, 'failed': 0}
+    for group in TaggingJob.objects.aggregate([{'$group': {'_id': '$state', 'count': {'$sum': 1}}}]):
+        depth[group['_id']] = group['count']
+    oldest = TaggingJob.objects(state='pending').order_by('created_at').scalar('created_at').first()
+    depth['oldest_pending_seconds'] = (datetime.utcnow() - oldest).total_seconds() if oldest else 0
+    return depth
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+# motor counterpart of photo_mongo_wrapper, used by photo_service_async.
+# Documents are read and written with the layout mongoengine gives Photo and
+# PhotoId, so both services can run against the same database.
+
+import asyncio
+import hashlib
+import io
+from datetime import datetime
+
+import pymongo
+from pymongo import ReturnDocument
+from motor.motor_asyncio import (AsyncIOMotorClient, AsyncIOMotorGridFSBucket,
+                                 AsyncIOMotorGridIn)
+
+from blob import Blob
+from photo import Photo
+from photoId import PhotoId
+from tagging_job import TaggingJob
+from photo_mongo_wrapper import (image_content_type, tag_query, SEARCH_ORDER,
+                                 tag_facets_pipeline, tag_facets, attribute_updates,
+                                 ATTRIBUTES_PROJECTION, attributes_in_order,
+                                 EXISTS_PROJECTION, existing_in_order)
+import robustify
+
+db = None
+
+async def mongo_connect(host, database_name):
+    global db
+    db = AsyncIOMotorClient(host)[database_name]
+    # The indexes mongoengine declares for PhotoId.display_name, Photo and
+    # TaggingJob that the queries of this module use
+    await photo_ids().create_index('display_name', unique=True)
+    await photos().create_index([('display_name', 1), ('photo_id', 1)])
+    await photos().create_index('sha256')
+    await photos().create_index([('tags', 1), ('display_name', 1), ('photo_id', 1)])
+    await tagging_jobs().create_index([('display_name', 1), ('photo_id', 1)], unique=True)
+
+def photos():
+    return db[Photo._get_collection_name()]
+
+def photo_ids():
+    return db[PhotoId._get_collection_name()]
+
+def blobs():
+    return db[Blob._get_collection_name()]
+
+def tagging_jobs():
+    return db[TaggingJob._get_collection_name()]
+
+def images():
+    # Photo.image_file lives in the 'images' GridFS bucket
+    return db[Photo.image_file.collection_name]
+
+def images_bucket():
+    return AsyncIOMotorGridFSBucket(db, bucket_name=Photo.image_file.collection_name)
+
+@robustify.retry_mongo_async
+async def mongo_reserve_photo_ids(display_name, count=1):
+    try:
+        ph_id = await photo_ids().find_one_and_update(
+            {'display_name': display_name}, {'$inc': {'next_photo_id': count}},
+            upsert=True, return_document=ReturnDocument.AFTER)
+    except pymongo.errors.DuplicateKeyError:
+        ph_id = await photo_ids().find_one_and_update(
+            {'display_name': display_name}, {'$inc': {'next_photo_id': count}},
+            return_document=ReturnDocument.AFTER)
+    return ph_id['next_photo_id'] - count
+
+
+class AsyncPhotoIdLeases:
+    """PhotoIdLeases for coroutines: see photo_mongo_wrapper."""
+
+    def __init__(self, block_size=1):
+        self.block_size = block_size
+        self._locks = {}
+        self._leases = {}
+
+    async def allocate(self, display_name, count=1):
+        if count >= self.block_size:
+            return await mongo_reserve_photo_ids(display_name, count)
+        async with self._locks.setdefault(display_name, asyncio.Lock()):
+            (next_id, end) = self._leases.get(display_name, (0, 0))
+            if end - next_id < count:
+                next_id = await mongo_reserve_photo_ids(display_name, self.block_size)
+                end = next_id + self.block_size
+            self._leases[display_name] = (next_id + count, end)
+            return next_id
+
+
+photo_id_leases = AsyncPhotoIdLeases()
+
+async def mongo_allocate_photo_id(display_name):
+    return await photo_id_leases.allocate(display_name)
+
+async def acquire_blob(image):
+    """photo_mongo_wrapper.acquire_blob for coroutines."""
+    sha256 = hashlib.sha256(image).hexdigest()
+    blob = await blobs().find_one_and_update({'_id': sha256}, {'$inc': {'refcount': 1}},
+                                             return_document=ReturnDocument.AFTER)
+    if blob is not None:
+        return blob
+    content_type = image_content_type(image)
+    grid_in = AsyncIOMotorGridIn(images(), content_type=content_type,
+                                 md5=hashlib.md5(image).hexdigest())
+    await grid_in.write(io.BytesIO(image))
+    await grid_in.close()
+    blob = {'_id': sha256,
+            'image_file': grid_in._id,
+            'refcount': 1,
+            'tags': [],
+            'tags_status': 'pending',
+            'renditions': [],
+            'created_at': datetime.utcnow()}
+    try:
+        await blobs().insert_one(blob)
+    except pymongo.errors.DuplicateKeyError:
+        # Stored meanwhile by a concurrent upload: theirs is kept
+        await images_bucket().delete(grid_in._id)
+        return await acquire_blob(image)
+    return blob
+
+async def release_blob(sha256):
+    """photo_mongo_wrapper.release_blob for coroutines."""
+    blob = await blobs().find_one_and_update({'_id': sha256}, {'$inc': {'refcount': -1}},
+                                             return_document=ReturnDocument.AFTER)
+    # Unless a new upload of the same content has taken a reference since
+    if blob is not None and blob['refcount'] <= 0 and \
+       (await blobs().delete_one({'_id': sha256, 'refcount': {'$lte': 0}})).deleted_count:
+        for file_id in [blob['image_file']] + [rendition['image_file']
+                                               for rendition in blob.get('renditions', [])]:
+            await images_bucket().delete(file_id)
+
+async def new_photo(image, display_name, photo_id, tags=(), tags_status='done'):
+    """photo_mongo_wrapper.new_photo for coroutines: the photo document, not
+    inserted yet. Raises IOError if `image` is not a picture."""
+    blob = await acquire_blob(image)
+    if tags_status == 'pending' and blob['tags_status'] == 'done':
+        (tags, tags_status) = (blob['tags'], 'done')
+    return {'display_name': display_name,
+            'image_file': blob['image_file'],
+            'sha256': blob['_id'],
+            'photo_id': photo_id,
+            'author': "--unset--",
+            'title': "--unset--",
+            'comment': "--unset--",
+            'location': "--unset--",
+            'tags': list(tags),
+            'tags_status': tags_status,
+            'renditions': blob.get('renditions', [])}
+
+@robustify.retry_mongo_async
+async def insert_photos(photo_documents):
+    # Upserted, as in photo_mongo_wrapper.upsert_photos: a retry after a
+    # lost reply does not insert the photos twice
+    await photos().bulk_write(
+        [pymongo.UpdateOne({'display_name': photo['display_name'],
+                            'photo_id': photo['photo_id']},
+                           {'$setOnInsert': photo}, upsert=True)
+         for photo in photo_documents],
+        ordered=False)
+
+async def mongo_save_photo(image, display_name, photo_id, tags=(), tags_status='done'):
+    """Return the photo document, or False if `image` is not a picture. As in
+    photo_mongo_wrapper, only the insert is retried."""
+    try:
+        photo = await new_photo(image, display_name, photo_id, tags, tags_status)
+    except (IOError):
+        return False
+    try:
+        await insert_photos([photo])
+    except BaseException:
+        await release_blob(photo['sha256'])
+        raise
+    return photo
+
+async def mongo_save_photos(images, display_name, first_photo_id):
+    """photo_mongo_wrapper.mongo_save_photos for coroutines: the new contents
+    are written concurrently, then the photos and their tagging jobs with
+    one bulk write each. Return the photo documents."""
+    stored = await asyncio.gather(*[new_photo(image, display_name, photo_id,
+                                              tags_status='pending')
+                                    for (photo_id, image)
+                                    in enumerate(images, first_photo_id)],
+                                  return_exceptions=True)
+    photo_documents = [photo for photo in stored if not isinstance(photo, BaseException)]
+    try:
+        for failure in stored:
+            if isinstance(failure, BaseException):
+                raise failure
+        await insert_photos(photo_documents)
+    except BaseException:
+        for photo in photo_documents:
+            await release_blob(photo['sha256'])
+        raise
+    pending = [photo['photo_id'] for photo in photo_documents
+               if photo['tags_status'] == 'pending']
+    if pending:
+        await enqueue_tagging_jobs(display_name, pending)
+    return photo_documents
+
+@robustify.retry_mongo_async
+async def enqueue_tagging_jobs(display_name, photo_ids):
+    # Upserted, as in photo_mongo_wrapper.enqueue_tagging_jobs: a retry after
+    # a lost reply does not queue the photos twice
+    now = datetime.utcnow()
+    await tagging_jobs().bulk_write(
+        [pymongo.UpdateOne({'display_name': display_name, 'photo_id': photo_id},
+                           {'$setOnInsert': {'display_name': display_name,
+                                             'photo_id': photo_id,
+                                             'state': 'pending',
+                                             'not_before': now,
+                                             'attempts': 0,
+                                             'created_at': now}},
+                           upsert=True)
+         for photo_id in photo_ids],
+        ordered=False)
+
+async def mongo_enqueue_tagging(display_name, photo_id):
+    await enqueue_tagging_jobs(display_name, [photo_id])
+
+@robustify.retry_mongo_async
+async def mongo_tagging_queue_depth():
+    depth = {'pending': 0, 'running': 0, 'failed': 0}
+    async for group in tagging_jobs().aggregate([{'$group': {'_id': '$state',
+                                                             'count': {'$sum': 1}}}]):
+        depth[group['_id']] = group['count']
+    oldest = await tagging_jobs().find_one({'state': 'pending'}, {'created_at': 1},
+                                           sort=[('created_at', 1)])
+    depth['oldest_pending_seconds'] = ((datetime.utcnow() - oldest['created_at']).total_seconds()
+                                       if oldest else 0)
+    return depth
+
+async def mongo_delete_photo_by_name_and_id(display_name, photo_id):
+    """Delete a photo, and its content with the last reference on it; False
+    if there is no such photo. Not retried: a retry after a lost reply would
+    not find the photo."""
+    ph = await photos().find_one_and_delete({'display_name': display_name,
+                                             'photo_id': photo_id})
+    if ph is None:
+        return False
+    if ph.get('sha256'):
+        await release_blob(ph['sha256'])
+    else:
+        # Stored before blobs
+        for file_id in [ph['image_file']] + [rendition['image_file']
+                                             for rendition in ph.get('renditions', [])]:
+            await images_bucket().delete(file_id)
+    return True
+
+@robustify.retry_mongo_async
+async def mongo_get_photo_by_name_and_id(display_name, photo_id):
+    found = await photos().find({'photo_id': photo_id,
+                                 'display_name': display_name}).to_list(2)
+    if not found:
+        raise Photo.DoesNotExist()
+    if len(found) > 1:
+        raise Photo.MultipleObjectsReturned()
+    return found[0]
+
+@robustify.retry_mongo_async
+async def mongo_open_image(file_id):
+    return await images_bucket().open_download_stream(file_id)
+
+@robustify.retry_mongo_async
+async def mongo_open_photo_file(display_name, photo_id):
+    """The GridOut of the original of a photo, or None if there is no such
+    photo: see photo_mongo_wrapper.mongo_open_photo_file."""
+    ph = await photos().find_one({'display_name': display_name, 'photo_id': photo_id},
+                                 {'_id': 0, 'image_file': 1})
+    if ph is None:
+        return None
+    return await images_bucket().open_download_stream(ph['image_file'])
+
+@robustify.retry_mongo_async
+async def mongo_get_photos_by_name(display_name, offset, limit, after=None):
+    query = {'display_name': display_name}
+    if after is not None:
+        query['photo_id'] = {'$gt': after}
+        offset = 0
+    cursor = photos().find(query, {'_id': 0, 'photo_id': 1})
+    found = await cursor.sort('photo_id').skip(offset).limit(limit + 1).to_list(limit + 1)
+    return (len(found) > limit, [ph['photo_id'] for ph in found[:limit]])
+
+@robustify.retry_mongo_async
+async def mongo_search_photos(tags, match_all, display_name, limit, after=None):
+    cursor = photos().find(tag_query(tags, match_all, display_name, after),
+                           {'_id': 0, 'display_name': 1, 'photo_id': 1})
+    found = await cursor.sort(SEARCH_ORDER).limit(limit + 1).to_list(limit + 1)
+    return (len(found) > limit,
+            [(ph['display_name'], ph['photo_id']) for ph in found[:limit]])
+
+@robustify.retry_mongo_async
+async def mongo_tag_facets(tags, match_all, display_name, limit):
+    pipeline = tag_facets_pipeline(tag_query(tags, match_all, display_name), limit)
+    return tag_facets(await photos().aggregate(pipeline).to_list(1))
+
+@robustify.retry_mongo_async
+async def mongo_set_photo_attributes(display_name, photo_id, attributes, photo_all_attributes):
+    update = {element: "--unset--" for element in photo_all_attributes}
+    update.update(attributes)
+    result = await photos().update_one({'photo_id': photo_id, 'display_name': display_name},
+                                       {'$set': update})
+    return result.matched_count
+
+@robustify.retry_mongo_async
+async def mongo_update_photo_attributes(display_name, photo_id, attributes):
+    query = {'photo_id': photo_id, 'display_name': display_name}
+    if not attributes:
+        return await photos().count_documents(query)
+    result = await photos().update_one(query, {'$set': attributes})
+    return result.matched_count
+
+@robustify.retry_mongo_async
+async def mongo_bulk_update_photo_attributes(display_name, updates):
+    requests = attribute_updates(display_name, updates)
+    if not requests:
+        return {'matched': 0, 'modified': 0}
+    result = await photos().bulk_write(requests, ordered=False)
+    return {'matched': result.matched_count, 'modified': result.modified_count}
+
+@robustify.retry_mongo_async
+async def mongo_get_photos_attributes(display_name, photo_ids):
+    ids = list(set(photo_ids))
+    found = await photos().find({'display_name': display_name, 'photo_id': {'$in': ids}},
+                                ATTRIBUTES_PROJECTION).to_list(len(ids))
+    return attributes_in_order(photo_ids, found)
+
+@robustify.retry_mongo_async
+async def mongo_existing_photo_ids(display_name, photo_ids):
+    ids = list(set(photo_ids))
+    found = await photos().find({'display_name': display_name, 'photo_id': {'$in': ids}},
+                                EXISTS_PROJECTION).to_list(len(ids))
+    return existing_in_order(photo_ids, found)
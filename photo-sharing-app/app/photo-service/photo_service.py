@@ -2,23 +2,33 @@
 
 import uvicorn
 
-from fastapi import FastAPI, File, Form, UploadFile, HTTPException
+from fastapi import BackgroundTasks, FastAPI, File, Form, Query, UploadFile, HTTPException
 from starlette.responses import Response, StreamingResponse
 from starlette.requests import Request
 from mongoengine import connect
-from pydantic_settings import BaseSettings
 from fastapi.logger import logger
 import logging
 from PIL import Image, ImageFilter
-from photo_const import REQUEST_TIMEOUT, PhotoAttributesNoTags, PhotoAttributes, Photos
+from photo_const import (REQUEST_TIMEOUT, PhotoAttributesNoTags, PhotoAttributes,
+                         PhotoAttributesPatch, Photos, TaggingQueue, LookupCacheStats, BatchUpload,
+                         BulkAttributes, BulkAttributesResult, PhotoIds, PhotoAttributesBatch,
+                         SearchResults, TagFacets, settings, photographer_service,
+                         photo_all_attributes)
 from photo_mongo_wrapper import *
 import requests
-import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 import grpc
 import tags_pb2
 import tags_pb2_grpc
 from tags import TagsClient
+from tagging_worker import make_tags_client, start_tagging_workers
+from renditions import generate_renditions, select_rendition
+from photo_http import photo_response, photo_head_response
+from albums_notifier import notify_albums, notify_albums_of_deletion
+from pagination import encode_cursor, decode_gallery_cursor, decode_search_cursor
+from photographer_client import PhotographerClient
 
 # photographer_service_host = 'photographer-service:80'
 # tags_service_host = 'tags-service:50051'
@@ -27,77 +37,213 @@ from tags import TagsClient
 # tags_service = tags_service_host
 # mongo_service = mongo_service_host
 
-photo_all_attributes = ['title', 'comment', 'location', 'author']
-
-class Settings(BaseSettings):
-    mongo_host: str = "localhost"
-    mongo_port: str = "27017"
-    mongo_user: str = ""
-    mongo_password: str = ""
-    database_name: str = "photos"
-    auth_database_name: str = "photographers"
-
-    tags_host: str = "tags-service"
-    tags_port: str = "50051"
-
-    photographer_host: str = "photographer-service"
-    photographer_port: str = "80"
-
-settings = Settings()
-
-photographer_service = 'http://' + settings.photographer_host + ':' + settings.photographer_port + '/'
-
 app = FastAPI(title = "Photo Service")
 
 # FastAPI logging
 gunicorn_logger = logging.getLogger('gunicorn.error')
 logger.handlers = gunicorn_logger.handlers
 
-tags_client = TagsClient()
+tags_client = make_tags_client()
+tagging_workers = []
+
+# Runs the independent network calls of an upload side by side
+upload_executor = ThreadPoolExecutor(max_workers=settings.upload_fanout_workers)
+
+photographers = PhotographerClient(photographer_service, REQUEST_TIMEOUT,
+                                   ttl=settings.photographer_cache_ttl,
+                                   negative_ttl=settings.photographer_cache_negative_ttl,
+                                   max_entries=settings.photographer_cache_size,
+                                   max_connections=settings.photographer_max_connections)
 
 @app.on_event("startup")
 def startup_event():
-    conn = f"mongodb://"
-    if settings.mongo_user:
-        conn += f"{settings.mongo_user}:{settings.mongo_password}@"
-    conn += f"{settings.mongo_host}:{settings.mongo_port}"
-    conn += f"/{settings.database_name}?authSource={settings.auth_database_name}"
-    connect(settings.database_name, host=conn)
+    connect(settings.database_name, host=settings.mongo_url())
+    photo_id_leases.block_size = settings.photo_id_block_size
     tags_client.connect(settings.tags_host + ":" + settings.tags_port)
+    tagging_workers.extend(start_tagging_workers(tags_client, settings.tagging_workers))
+
+@app.on_event("shutdown")
+def shutdown_event():
+    for worker in tagging_workers:
+        worker.stop()
+    tags_client.close()
 
 @app.post("/gallery/{display_name}", status_code=201)
-def upload_photo(response: Response, display_name:str, file: UploadFile=File(...)):
+def upload_photo(response: Response, background_tasks: BackgroundTasks, display_name:str,
+                 file: UploadFile=File(...)):
     logger.info("Uploading a new image ...")            
     try:
-        photographer = requests.get(photographer_service + 'photographer/' + display_name,
-                                    timeout=REQUEST_TIMEOUT)
-        if photographer.status_code == requests.codes.ok:
+        # The upload is read once, into the buffer GridFS is fed from
+        image = file.file.read()
+        # The id is allocated once the photographer is known to exist: the
+        # allocation creates the photographer's id counter
+        try:
+            photographer = photographers.lookup(display_name)
+        except requests.exceptions.RequestException as e:
+            raise HTTPException(status_code = 503, detail = "Photographer Service Unavailable")
+        if photographer == requests.codes.ok:
             id = mongo_allocate_photo_id(display_name)
-            photo_tags = tags_client.stub.getTags(tags_pb2.ImageRequest(file=file.file.read()))
-
-            # We save the photo
-            if mongo_save_photo(file.file, display_name, id):
+            # We save the photo; the tagging workers will add its tags
+            photo = mongo_save_photo(image, display_name, id, tags_status='pending')
+            if photo:
+                # Unless a photo of the same content has been through it already.
+                # Should this fail, the tagging workers queue the photo later.
+                if photo.tags_status == 'pending':
+                    mongo_enqueue_tagging(display_name, id)
+                if not photo.renditions:
+                    background_tasks.add_task(generate_renditions, display_name, id)
                 response.headers["Location"] = "/photo/" + display_name + "/" + str(id)
                 logger.info("A new image has been uploaded ...")            
             else:
                 raise HTTPException(status_code = 503, detail = "Mongo unavailable")
-            # We save the tags
-            mongo_set_photo_attributes(display_name, id, {'tags': list(photo_tags.tags)}, photo_all_attributes)
-        elif photographer.status_code == requests.codes.unavailable:
+        elif photographer == requests.codes.unavailable:
             raise HTTPException(status_code = 503, detail = "Mongo unavailable")
-        elif photographer.status_code == requests.codes.not_found:
+        elif photographer == requests.codes.not_found:
             raise HTTPException(status_code = 404, detail = "Photographer Not Found")
     except (pymongo.errors.AutoReconnect,
             pymongo.errors.ServerSelectionTimeoutError,
             pymongo.errors.NetworkTimeout) as e:
         raise HTTPException(status_code = 503, detail = "Mongo unavailable")
 
+@app.post("/gallery/{display_name}/batch", response_model = BatchUpload, status_code = 200)
+def upload_photos(background_tasks: BackgroundTasks, display_name: str,
+                  files: List[UploadFile] = File(...)):
+    """Upload many photos at once: the photographer is checked once, the
+    photo ids are reserved as one range and the photos are written with
+    bulk inserts. The result of each file is returned in order."""
+    logger.info(f"Uploading {len(files)} images ...")
+    if len(files) > settings.batch_upload_max_files:
+        raise HTTPException(status_code = 413,
+                            detail = f"At most {settings.batch_upload_max_files} files")
+    try:
+        photographer = photographers.lookup(display_name)
+    except requests.exceptions.RequestException as e:
+        raise HTTPException(status_code = 503, detail = "Photographer Service Unavailable")
+    if photographer == requests.codes.not_found:
+        raise HTTPException(status_code = 404, detail = "Photographer Not Found")
+    elif photographer != requests.codes.ok:
+        raise HTTPException(status_code = 503, detail = "Photographer Service Unavailable")
+
+    results = [{'filename': file.filename, 'status': 400, 'detail': "Not an image"}
+               for file in files]
+    images = []
+    accepted = []
+    for (index, file) in enumerate(files):
+        image = file.file.read()
+        try:
+            image_content_type(image)
+        except (IOError):
+            continue
+        images.append(image)
+        accepted.append(index)
+    if images:
+        try:
+            first_id = photo_id_leases.allocate(display_name, len(images))
+            photos = mongo_save_photos(images, display_name, first_id, upload_executor.map)
+        except (pymongo.errors.AutoReconnect,
+                pymongo.errors.ServerSelectionTimeoutError,
+                pymongo.errors.NetworkTimeout) as e:
+            raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+        for (index, photo) in zip(accepted, photos):
+            results[index] = {'filename': files[index].filename, 'status': 201,
+                              'location': "/photo/" + display_name + "/" + str(photo.photo_id)}
+            if not photo.renditions:
+                background_tasks.add_task(generate_renditions, display_name, photo.photo_id)
+    logger.info(f"{len(images)} new images have been uploaded ...")
+    return {'items': results}
+
+def parse_ids(ids):
+    try:
+        return [int(photo_id) for photo_id in ids.split(",") if photo_id.strip()]
+    except ValueError as e:
+        raise HTTPException(status_code = 400, detail = "Invalid ids")
+
+def photos_attributes(display_name, photo_ids):
+    if len(photo_ids) > settings.bulk_read_max_items:
+        raise HTTPException(status_code = 413,
+                            detail = f"At most {settings.bulk_read_max_items} photos")
+    try:
+        found = mongo_get_photos_attributes(display_name, photo_ids)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    return {'items': [{'photo_id': photo_id, 'attributes': attributes}
+                      for (photo_id, attributes) in found]}
+
+@app.get("/photo/{display_name}/attributes", response_model = PhotoAttributesBatch,
+         status_code = 200)
+def get_photos_attributes(display_name: str, ids: str):
+    """The attributes of the photos `ids`, comma separated, with one query."""
+    return photos_attributes(display_name, parse_ids(ids))
+
+@app.post("/photo/{display_name}/attributes", response_model = PhotoAttributesBatch,
+          status_code = 200)
+def post_photos_attributes(display_name: str, photo_ids: PhotoIds):
+    """GET /photo/{display_name}/attributes, for lists of ids too long for
+    a URL."""
+    return photos_attributes(display_name, photo_ids.ids)
+
+@app.post("/photo/{display_name}/exists", response_model = PhotoIds, status_code = 200)
+def photos_exist(display_name: str, photo_ids: PhotoIds):
+    """The ones of `photo_ids` that exist, read from the index alone."""
+    if len(photo_ids.ids) > settings.bulk_read_max_items:
+        raise HTTPException(status_code = 413,
+                            detail = f"At most {settings.bulk_read_max_items} photos")
+    try:
+        return {'ids': mongo_existing_photo_ids(display_name, photo_ids.ids)}
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+
+@app.patch("/photo/{display_name}/attributes", response_model = BulkAttributesResult,
+           status_code = 200)
+def update_photos_attributes(display_name: str, attributes: BulkAttributes,
+                             background_tasks: BackgroundTasks):
+    """Change the attributes of many photos at once, with one bulk write;
+    as with PATCH /photo/{display_name}/{photo_id}/attributes, only the
+    attributes given are changed."""
+    if len(attributes.items) > settings.bulk_attributes_max_items:
+        raise HTTPException(status_code = 413,
+                            detail = f"At most {settings.bulk_attributes_max_items} photos")
+    updates = [(item.photo_id, item.model_dump(exclude_unset=True, exclude={'photo_id'}))
+               for item in attributes.items]
+    try:
+        result = mongo_bulk_update_photo_attributes(display_name, updates)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    if result['modified']:
+        background_tasks.add_task(notify_albums, display_name,
+                                  [photo_id for (photo_id, changes) in updates if changes])
+    return result
+
 @app.get("/photo/{display_name}/{photo_id}", status_code = 200)
-def get_photo(display_name: str, photo_id: int):  
+def get_photo(request: Request, display_name: str, photo_id: int,
+              rendition: Optional[str] = None):
     logger.info("Get one photo ...")            
+    if rendition is not None and rendition not in settings.renditions:
+        raise HTTPException(status_code = 400, detail = "Unknown rendition")
     try:
         ph = mongo_get_photo_by_name_and_id(display_name, photo_id)
-        return Response(content=ph.image_file.read(), media_type="image/jpeg")
+        image_file = ph.image_file
+        headers = {}
+        max_age = settings.photo_max_age
+        if rendition is not None:
+            headers["Vary"] = "Accept"
+            selected = select_rendition(ph.renditions, rendition, request.headers.get("accept"))
+            if selected is not None:
+                image_file = selected.image_file
+            else:
+                # Until its renditions are generated, the original is
+                # served, and must not be cached in their place
+                max_age = 0
+        grid_out = image_file.get()
+        if grid_out is None:
+            raise HTTPException(status_code = 404, detail = "Not Found")
+        return photo_response(request, grid_out, headers, max_age)
     except (pymongo.errors.AutoReconnect,
             pymongo.errors.ServerSelectionTimeoutError,
             pymongo.errors.NetworkTimeout) as e:
@@ -107,13 +253,41 @@ def get_photo(display_name: str, photo_id: int):
     except (Photo.MultipleObjectsReturned) as e:
         raise HTTPException(status_code = 500, detail = "Internal Error")
 
-    
+@app.head("/photo/{display_name}/{photo_id}", status_code = 200)
+def head_photo(request: Request, display_name: str, photo_id: int):
+    """The headers of GET /photo/{display_name}/{photo_id}, size and type
+    included, read without the content of the photo."""
+    try:
+        grid_out = mongo_open_photo_file(display_name, photo_id)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    if grid_out is None:
+        raise HTTPException(status_code = 404, detail = "Not Found")
+    return photo_head_response(request, grid_out, max_age = settings.photo_max_age)
+
+@app.delete("/photo/{display_name}/{photo_id}", status_code = 204)
+def delete_photo(display_name: str, photo_id: int, background_tasks: BackgroundTasks):
+    try:
+        if not mongo_delete_photo_by_name_and_id(display_name, photo_id):
+            raise HTTPException(status_code = 404, detail = "Not Found")
+        background_tasks.add_task(notify_albums_of_deletion, display_name, [photo_id])
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    except (Photo.MultipleObjectsReturned) as e:
+        raise HTTPException(status_code = 500, detail = "Internal Error")
+
 @app.put("/photo/{display_name}/{photo_id}/attributes", status_code = 200)
-def set_photo_attributes(display_name: str, photo_id: int, attributes: PhotoAttributesNoTags):  
+def set_photo_attributes(display_name: str, photo_id: int, attributes: PhotoAttributesNoTags,
+                         background_tasks: BackgroundTasks):  
     try:
         qs = mongo_set_photo_attributes(display_name, photo_id, vars(attributes), photo_all_attributes)
         if not qs:
             raise HTTPException(status_code = 404, detail = "Not Found")
+        background_tasks.add_task(notify_albums, display_name, [photo_id])
     except (pymongo.errors.AutoReconnect,
             pymongo.errors.ServerSelectionTimeoutError,
             pymongo.errors.NetworkTimeout) as e:
@@ -123,6 +297,20 @@ def set_photo_attributes(display_name: str, photo_id: int, attributes: PhotoAttr
     except (Photo.MultipleObjectsReturned) as e:
         raise HTTPException(status_code = 500, detail = "Internal Error")
 
+@app.patch("/photo/{display_name}/{photo_id}/attributes", status_code = 200)
+def update_photo_attributes(display_name: str, photo_id: int, attributes: PhotoAttributesPatch,
+                            background_tasks: BackgroundTasks):
+    try:
+        matched = mongo_update_photo_attributes(display_name, photo_id,
+                                                attributes.model_dump(exclude_unset=True))
+        if not matched:
+            raise HTTPException(status_code = 404, detail = "Not Found")
+        background_tasks.add_task(notify_albums, display_name, [photo_id])
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+
 @app.get("/photo/{display_name}/{photo_id}/attributes",
          response_model = PhotoAttributes, status_code = 200)
 def get_photo_attributes(display_name: str, photo_id: int):  
@@ -138,48 +326,96 @@ def get_photo_attributes(display_name: str, photo_id: int):
     except (Photo.MultipleObjectsReturned) as e:
         raise HTTPException(status_code = 500, detail = "Internal Error")
 
+@app.get("/tagging/queue", response_model = TaggingQueue, status_code = 200)
+def get_tagging_queue():
+    try:
+        return mongo_tagging_queue_depth()
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+
+@app.get("/cache/photographers", response_model = LookupCacheStats, status_code = 200)
+def get_photographer_cache_stats():
+    return photographers.cache_stats()
+
+@app.delete("/cache/photographers/{display_name}", status_code = 204)
+def invalidate_photographer(display_name: str):
+    # Called by the photographer service when a photographer is updated or
+    # deleted
+    photographers.invalidate(display_name)
+
 @app.get("/gallery/{display_name}", response_model = Photos, status_code = 200)
-def get_photos(request: Request, display_name: str,  offset: int = 0, limit: int = 10):
+def get_photos(request: Request, display_name: str,  offset: int = Query(0, ge=0),
+               limit: int = Query(10, ge=1, le=settings.page_max_limit),
+               after: Optional[str] = None):
     logger.info("Getting photos ...")            
-    list_of_photos = list()
     try:
-        photographer = requests.get(photographer_service + 'photographer/' + display_name,
-                                    timeout=REQUEST_TIMEOUT)
-        if photographer.status_code == requests.codes.ok:
+        after_id = decode_gallery_cursor(after) if after is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code = 400, detail = "Invalid cursor")
+    try:
+        photographer = photographers.lookup(display_name)
+        if photographer == requests.codes.ok:
             try:
-                (has_more, photos) = mongo_get_photos_by_name(display_name, offset, limit)
-                if not photos:
+                (has_more, photo_ids) = mongo_get_photos_by_name(display_name, offset, limit,
+                                                                 after_id)
+                if not photo_ids:
                     raise HTTPException(status_code = 204, detail = "No Photos")
-                else:
-                    for ph in photos:
-                        ph._data.pop('id')
-                        ph._data.pop('image_file')
-                        ph._data.pop('display_name')
-                        ph._data.pop('title')
-                        ph._data.pop('comment')
-                        ph._data.pop('author')
-                        ph._data.pop('location')
-                        ph._data.pop('tags')
-                        host_part = re.match("http://([^/]*)/", str(request.url)).group()
-                        # ph._data['link'] = host_part +  "photo/" + display_name + "/" + str(ph.photo_id)
-                        ph._data['link'] = "/photo/" + display_name + "/" + str(ph.photo_id)
-                        list_of_photos.append(ph._data)
             except (pymongo.errors.AutoReconnect,
                     pymongo.errors.ServerSelectionTimeoutError,
                     pymongo.errors.NetworkTimeout) as e:
                 raise HTTPException(status_code = 503, detail = "Mongo unavailable")
-        elif photographer.status_code == requests.codes.unavailable:
-            raise HTTPException(status_code = 503, detail = "Photographer Service Unavailable")
-        elif photographer.status_code == requests.codes.not_found:
+        elif photographer == requests.codes.not_found:
             raise HTTPException(status_code = 404, detail = "Not Found")
         else:
-            # Calling raise_for_status() will raise an exception in case of error code
-            photographer.raise_for_status() 
+            raise HTTPException(status_code = 503, detail = "Photographer Service Unavailable")
 
     except requests.exceptions.RequestException as e:
         raise HTTPException(status_code = 503, detail = "Photographer Service Unavailable")
         print(f"Photographer service unrechable at {photographer_service}")
-    return {'items': list_of_photos, 'has_more': has_more}
+    list_of_photos = [{'photo_id': photo_id,
+                       'link': "/photo/" + display_name + "/" + str(photo_id)}
+                      for photo_id in photo_ids]
+    return {'items': list_of_photos, 'has_more': has_more,
+            'next_cursor': encode_cursor(photo_ids[-1]) if has_more else None}
+
+@app.get("/photos/search", response_model = SearchResults, status_code = 200)
+def search_photos(tag: List[str] = Query(...), match: str = Query("all", pattern="^(all|any)$"),
+                  display_name: Optional[str] = None,
+                  limit: int = Query(10, ge=1, le=settings.page_max_limit),
+                  after: Optional[str] = None):
+    """The photos with all the `tag`s (or any of them), of every photographer
+    or of `display_name` only, by photographer and photo id."""
+    try:
+        after_key = decode_search_cursor(after) if after is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code = 400, detail = "Invalid cursor")
+    try:
+        (has_more, found) = mongo_search_photos(tag, match == "all", display_name, limit,
+                                                after_key)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    list_of_photos = [{'display_name': name, 'photo_id': photo_id,
+                       'link': "/photo/" + name + "/" + str(photo_id)}
+                      for (name, photo_id) in found]
+    return {'items': list_of_photos, 'has_more': has_more,
+            'next_cursor': encode_cursor(list(found[-1])) if has_more else None}
+
+@app.get("/photos/tags", response_model = TagFacets, status_code = 200)
+def get_tag_facets(tag: List[str] = Query([]), match: str = Query("all", pattern="^(all|any)$"),
+                   display_name: Optional[str] = None,
+                   limit: int = Query(20, ge=1, le=settings.page_max_limit)):
+    """The `limit` most frequent tags of the photos a search for `tag` finds
+    (of all the photos without `tag`), with how many photos have each."""
+    try:
+        return mongo_tag_facets(tag, match == "all", display_name, limit)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
 
 if __name__ == "__main__":
     uvicorn.run(app, host = "0.0.0.0", port=80, log_level="info")
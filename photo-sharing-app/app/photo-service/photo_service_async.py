@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+# Async mode of the photo service: the routes of photo_service, served by
+# coroutines on motor and httpx instead of threads blocked on mongoengine and
+# requests. Uploaded photos are tagged by tagging_worker, which has to be
+# started separately in this mode. Run with
+#   uvicorn photo_service_async:app
+#
+# No request waits for the tags service: uploads only queue their photo, and
+# the workers call it with the blocking TagsClient from their threads. There
+# is no grpc.aio client, as nothing would await it.
+
+import uvicorn
+
+from contextlib import asynccontextmanager
+from fastapi import BackgroundTasks, FastAPI, File, Query, UploadFile, HTTPException
+from starlette.responses import Response
+from starlette.requests import Request
+from mongoengine import connect
+from typing import List, Optional
+from fastapi.logger import logger
+import logging
+import gridfs
+import httpx
+import pymongo
+
+from photo import Photo
+from photo_const import (REQUEST_TIMEOUT, PhotoAttributesNoTags, PhotoAttributes,
+                         PhotoAttributesPatch, Photos, TaggingQueue, LookupCacheStats,
+                         BatchUpload, BulkAttributes,
+                         BulkAttributesResult, PhotoIds, PhotoAttributesBatch, SearchResults,
+                         TagFacets, settings, photographer_service, photo_all_attributes)
+import photo_mongo_wrapper_async as mongo
+from photo_mongo_wrapper import image_content_type
+from renditions import generate_renditions, select_rendition
+from photo_http import photo_response_async, photo_head_response
+from albums_notifier import notify_albums, notify_albums_of_deletion
+from pagination import encode_cursor, decode_gallery_cursor, decode_search_cursor
+from photographer_client import AsyncPhotographerClient
+
+photographers = None
+
+@asynccontextmanager
+async def startup_event(application: FastAPI):
+    global photographers
+    await mongo.mongo_connect(settings.mongo_url(), settings.database_name)
+    # Renditions are computed by background tasks in the threadpool, with
+    # mongoengine
+    connect(settings.database_name, host=settings.mongo_url())
+    mongo.photo_id_leases.block_size = settings.photo_id_block_size
+    photographers = AsyncPhotographerClient(
+        photographer_service, REQUEST_TIMEOUT,
+        ttl=settings.photographer_cache_ttl,
+        negative_ttl=settings.photographer_cache_negative_ttl,
+        max_entries=settings.photographer_cache_size,
+        max_connections=settings.photographer_max_connections)
+    yield
+    await photographers.aclose()
+
+app = FastAPI(title = "Photo Service", lifespan=startup_event)
+
+# FastAPI logging
+gunicorn_logger = logging.getLogger('gunicorn.error')
+logger.handlers = gunicorn_logger.handlers
+
+async def check_photographer(display_name):
+    try:
+        photographer = await photographers.lookup(display_name)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code = 503, detail = "Photographer Service Unavailable")
+    if photographer == httpx.codes.SERVICE_UNAVAILABLE:
+        raise HTTPException(status_code = 503, detail = "Photographer Service Unavailable")
+    elif photographer == httpx.codes.NOT_FOUND:
+        raise HTTPException(status_code = 404, detail = "Photographer Not Found")
+    elif photographer != httpx.codes.OK:
+        raise HTTPException(status_code = 503, detail = "Photographer Service Unavailable")
+
+@app.post("/gallery/{display_name}", status_code=201)
+async def upload_photo(response: Response, background_tasks: BackgroundTasks, display_name:str,
+                       file: UploadFile=File(...)):
+    logger.info("Uploading a new image ...")
+    try:
+        image = await file.read()
+        # The id is allocated once the photographer is known to exist: the
+        # allocation creates the photographer's id counter
+        await check_photographer(display_name)
+        id = await mongo.mongo_allocate_photo_id(display_name)
+
+        # We save the photo; the tagging workers will add its tags
+        photo = await mongo.mongo_save_photo(image, display_name, id, tags_status='pending')
+        if photo:
+            # Unless a photo of the same content has been through it already.
+            # Should this fail, the tagging workers queue the photo later.
+            if photo['tags_status'] == 'pending':
+                await mongo.mongo_enqueue_tagging(display_name, id)
+            if not photo['renditions']:
+                background_tasks.add_task(generate_renditions, display_name, id)
+            response.headers["Location"] = "/photo/" + display_name + "/" + str(id)
+            logger.info("A new image has been uploaded ...")
+        else:
+            raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+
+@app.post("/gallery/{display_name}/batch", response_model = BatchUpload, status_code = 200)
+async def upload_photos(background_tasks: BackgroundTasks, display_name: str,
+                        files: List[UploadFile] = File(...)):
+    """Upload many photos at once: see photo_service.upload_photos."""
+    logger.info(f"Uploading {len(files)} images ...")
+    if len(files) > settings.batch_upload_max_files:
+        raise HTTPException(status_code = 413,
+                            detail = f"At most {settings.batch_upload_max_files} files")
+    await check_photographer(display_name)
+
+    results = [{'filename': file.filename, 'status': 400, 'detail': "Not an image"}
+               for file in files]
+    images = []
+    accepted = []
+    for (index, file) in enumerate(files):
+        image = await file.read()
+        try:
+            image_content_type(image)
+        except (IOError):
+            continue
+        images.append(image)
+        accepted.append(index)
+    if images:
+        try:
+            first_id = await mongo.photo_id_leases.allocate(display_name, len(images))
+            photos = await mongo.mongo_save_photos(images, display_name, first_id)
+        except (pymongo.errors.AutoReconnect,
+                pymongo.errors.ServerSelectionTimeoutError,
+                pymongo.errors.NetworkTimeout) as e:
+            raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+        for (index, photo) in zip(accepted, photos):
+            results[index] = {'filename': files[index].filename, 'status': 201,
+                              'location': "/photo/" + display_name + "/" + str(photo['photo_id'])}
+            if not photo['renditions']:
+                background_tasks.add_task(generate_renditions, display_name, photo['photo_id'])
+    logger.info(f"{len(images)} new images have been uploaded ...")
+    return {'items': results}
+
+def parse_ids(ids):
+    try:
+        return [int(photo_id) for photo_id in ids.split(",") if photo_id.strip()]
+    except ValueError as e:
+        raise HTTPException(status_code = 400, detail = "Invalid ids")
+
+async def photos_attributes(display_name, photo_ids):
+    if len(photo_ids) > settings.bulk_read_max_items:
+        raise HTTPException(status_code = 413,
+                            detail = f"At most {settings.bulk_read_max_items} photos")
+    try:
+        found = await mongo.mongo_get_photos_attributes(display_name, photo_ids)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    return {'items': [{'photo_id': photo_id, 'attributes': attributes}
+                      for (photo_id, attributes) in found]}
+
+@app.get("/photo/{display_name}/attributes", response_model = PhotoAttributesBatch,
+         status_code = 200)
+async def get_photos_attributes(display_name: str, ids: str):
+    """The attributes of the photos `ids`, comma separated, with one query."""
+    return await photos_attributes(display_name, parse_ids(ids))
+
+@app.post("/photo/{display_name}/attributes", response_model = PhotoAttributesBatch,
+          status_code = 200)
+async def post_photos_attributes(display_name: str, photo_ids: PhotoIds):
+    """GET /photo/{display_name}/attributes, for lists of ids too long for
+    a URL."""
+    return await photos_attributes(display_name, photo_ids.ids)
+
+@app.post("/photo/{display_name}/exists", response_model = PhotoIds, status_code = 200)
+async def photos_exist(display_name: str, photo_ids: PhotoIds):
+    """The ones of `photo_ids` that exist, read from the index alone."""
+    if len(photo_ids.ids) > settings.bulk_read_max_items:
+        raise HTTPException(status_code = 413,
+                            detail = f"At most {settings.bulk_read_max_items} photos")
+    try:
+        return {'ids': await mongo.mongo_existing_photo_ids(display_name, photo_ids.ids)}
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+
+@app.patch("/photo/{display_name}/attributes", response_model = BulkAttributesResult,
+           status_code = 200)
+async def update_photos_attributes(display_name: str, attributes: BulkAttributes,
+                                   background_tasks: BackgroundTasks):
+    """Change the attributes of many photos at once, with one bulk write;
+    as with PATCH /photo/{display_name}/{photo_id}/attributes, only the
+    attributes given are changed."""
+    if len(attributes.items) > settings.bulk_attributes_max_items:
+        raise HTTPException(status_code = 413,
+                            detail = f"At most {settings.bulk_attributes_max_items} photos")
+    updates = [(item.photo_id, item.model_dump(exclude_unset=True, exclude={'photo_id'}))
+               for item in attributes.items]
+    try:
+        result = await mongo.mongo_bulk_update_photo_attributes(display_name, updates)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    if result['modified']:
+        background_tasks.add_task(notify_albums, display_name,
+                                  [photo_id for (photo_id, changes) in updates if changes])
+    return result
+
+@app.get("/photo/{display_name}/{photo_id}", status_code = 200)
+async def get_photo(request: Request, display_name: str, photo_id: int,
+                    rendition: Optional[str] = None):
+    logger.info("Get one photo ...")
+    if rendition is not None and rendition not in settings.renditions:
+        raise HTTPException(status_code = 400, detail = "Unknown rendition")
+    try:
+        ph = await mongo.mongo_get_photo_by_name_and_id(display_name, photo_id)
+        file_id = ph['image_file']
+        headers = {}
+        max_age = settings.photo_max_age
+        if rendition is not None:
+            headers["Vary"] = "Accept"
+            selected = select_rendition(ph.get('renditions', []), rendition,
+                                        request.headers.get("accept"))
+            if selected is not None:
+                file_id = selected['image_file']
+            else:
+                # Until its renditions are generated, the original is
+                # served, and must not be cached in their place
+                max_age = 0
+        grid_out = await mongo.mongo_open_image(file_id)
+        return photo_response_async(request, grid_out, headers, max_age)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    except (Photo.DoesNotExist, gridfs.errors.NoFile) as e:
+        raise HTTPException(status_code = 404, detail = "Not Found")
+    except (Photo.MultipleObjectsReturned) as e:
+        raise HTTPException(status_code = 500, detail = "Internal Error")
+
+@app.head("/photo/{display_name}/{photo_id}", status_code = 200)
+async def head_photo(request: Request, display_name: str, photo_id: int):
+    """The headers of GET /photo/{display_name}/{photo_id}, size and type
+    included, read without the content of the photo."""
+    try:
+        grid_out = await mongo.mongo_open_photo_file(display_name, photo_id)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    except gridfs.errors.NoFile as e:
+        raise HTTPException(status_code = 404, detail = "Not Found")
+    if grid_out is None:
+        raise HTTPException(status_code = 404, detail = "Not Found")
+    return photo_head_response(request, grid_out, max_age = settings.photo_max_age)
+
+@app.delete("/photo/{display_name}/{photo_id}", status_code = 204)
+async def delete_photo(display_name: str, photo_id: int, background_tasks: BackgroundTasks):
+    try:
+        if not await mongo.mongo_delete_photo_by_name_and_id(display_name, photo_id):
+            raise HTTPException(status_code = 404, detail = "Not Found")
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    background_tasks.add_task(notify_albums_of_deletion, display_name, [photo_id])
+
+@app.put("/photo/{display_name}/{photo_id}/attributes", status_code = 200)
+async def set_photo_attributes(display_name: str, photo_id: int, attributes: PhotoAttributesNoTags,
+                               background_tasks: BackgroundTasks):
+    try:
+        matched = await mongo.mongo_set_photo_attributes(display_name, photo_id, vars(attributes),
+                                                         photo_all_attributes)
+        if not matched:
+            raise HTTPException(status_code = 404, detail = "Not Found")
+        background_tasks.add_task(notify_albums, display_name, [photo_id])
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+
+@app.patch("/photo/{display_name}/{photo_id}/attributes", status_code = 200)
+async def update_photo_attributes(display_name: str, photo_id: int,
+                                  attributes: PhotoAttributesPatch,
+                                  background_tasks: BackgroundTasks):
+    try:
+        matched = await mongo.mongo_update_photo_attributes(
+            display_name, photo_id, attributes.model_dump(exclude_unset=True))
+        if not matched:
+            raise HTTPException(status_code = 404, detail = "Not Found")
+        background_tasks.add_task(notify_albums, display_name, [photo_id])
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+
+@app.get("/photo/{display_name}/{photo_id}/attributes",
+         response_model = PhotoAttributes, status_code = 200)
+async def get_photo_attributes(display_name: str, photo_id: int):
+    try:
+        return await mongo.mongo_get_photo_by_name_and_id(display_name, photo_id)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    except (Photo.DoesNotExist) as e:
+        raise HTTPException(status_code = 404, detail = "Not Found")
+    except (Photo.MultipleObjectsReturned) as e:
+        raise HTTPException(status_code = 500, detail = "Internal Error")
+
+@app.get("/tagging/queue", response_model = TaggingQueue, status_code = 200)
+async def get_tagging_queue():
+    try:
+        return await mongo.mongo_tagging_queue_depth()
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+
+@app.get("/cache/photographers", response_model = LookupCacheStats, status_code = 200)
+async def get_photographer_cache_stats():
+    return photographers.cache_stats()
+
+@app.delete("/cache/photographers/{display_name}", status_code = 204)
+async def invalidate_photographer(display_name: str):
+    photographers.invalidate(display_name)
+
+@app.get("/gallery/{display_name}", response_model = Photos, status_code = 200)
+async def get_photos(display_name: str, offset: int = Query(0, ge=0),
+                     limit: int = Query(10, ge=1, le=settings.page_max_limit),
+                     after: Optional[str] = None):
+    logger.info("Getting photos ...")
+    try:
+        after_id = decode_gallery_cursor(after) if after is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code = 400, detail = "Invalid cursor")
+    await check_photographer(display_name)
+    try:
+        (has_more, photo_ids) = await mongo.mongo_get_photos_by_name(display_name, offset, limit,
+                                                                     after_id)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    if not photo_ids:
+        raise HTTPException(status_code = 204, detail = "No Photos")
+    list_of_photos = [{'photo_id': photo_id,
+                       'link': "/photo/" + display_name + "/" + str(photo_id)}
+                      for photo_id in photo_ids]
+    return {'items': list_of_photos, 'has_more': has_more,
+            'next_cursor': encode_cursor(photo_ids[-1]) if has_more else None}
+
+@app.get("/photos/search", response_model = SearchResults, status_code = 200)
+async def search_photos(tag: List[str] = Query(...),
+                        match: str = Query("all", pattern="^(all|any)$"),
+                        display_name: Optional[str] = None,
+                        limit: int = Query(10, ge=1, le=settings.page_max_limit),
+                        after: Optional[str] = None):
+    """The photos with all the `tag`s (or any of them), of every photographer
+    or of `display_name` only, by photographer and photo id."""
+    try:
+        after_key = decode_search_cursor(after) if after is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code = 400, detail = "Invalid cursor")
+    try:
+        (has_more, found) = await mongo.mongo_search_photos(tag, match == "all", display_name,
+                                                            limit, after_key)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+    list_of_photos = [{'display_name': name, 'photo_id': photo_id,
+                       'link': "/photo/" + name + "/" + str(photo_id)}
+                      for (name, photo_id) in found]
+    return {'items': list_of_photos, 'has_more': has_more,
+            'next_cursor': encode_cursor(list(found[-1])) if has_more else None}
+
+@app.get("/photos/tags", response_model = TagFacets, status_code = 200)
+async def get_tag_facets(tag: List[str] = Query([]),
+                         match: str = Query("all", pattern="^(all|any)$"),
+                         display_name: Optional[str] = None,
+                         limit: int = Query(20, ge=1, le=settings.page_max_limit)):
+    """The `limit` most frequent tags of the photos a search for `tag` finds
+    (of all the photos without `tag`), with how many photos have each."""
+    try:
+        return await mongo.mongo_tag_facets(tag, match == "all", display_name, limit)
+    except (pymongo.errors.AutoReconnect,
+            pymongo.errors.ServerSelectionTimeoutError,
+            pymongo.errors.NetworkTimeout) as e:
+        raise HTTPException(status_code = 503, detail = "Mongo unavailable")
+
+if __name__ == "__main__":
+    uvicorn.run(app, host = "0.0.0.0", port=80, log_level="info")
+else:
+    logger.setLevel(gunicorn_logger.level)
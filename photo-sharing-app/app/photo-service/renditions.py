@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+# Resized copies of the photos, served by
+#   GET /photo/{display_name}/{photo_id}?rendition=<name>
+# They are generated in the background after each upload. Photos stored
+# before that (or before a change of RENDITIONS) are processed with
+#   python renditions.py [--display-name NAME] [--all]
+
+import argparse
+import hashlib
+import io
+import logging
+
+from PIL import Image, ImageOps
+from mongoengine import Q, connect
+
+from blob import Blob
+from photo import Photo, Rendition
+from photo_const import settings
+import robustify
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+def accepted_ranges(accept):
+    """The q-value of each media range of an Accept header."""
+    ranges = {}
+    for part in accept.split(","):
+        (media_range, *params) = [item.strip() for item in part.split(";")]
+        q = 1.0
+        for param in params:
+            (name, _, value) = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    # Not a q-value we can trust: as good as refused
+                    q = 0.0
+        if media_range:
+            ranges[media_range.lower()] = q
+    return ranges
+
+def quality(ranges, content_type):
+    """The q-value of `content_type` from its most specific media range."""
+    for media_range in (content_type, content_type.split("/")[0] + "/*", "*/*"):
+        if media_range in ranges:
+            return ranges[media_range]
+    return 0.0
+
+def preferred_formats(accept):
+    """Rendition formats a client accepts, best first; q=0 refuses one.
+    WebP goes only to clients naming it: many of those accepting image/* or
+    */* cannot decode it."""
+    if not accept:
+        return ['JPEG']
+    ranges = accepted_ranges(accept)
+    candidates = [('WEBP', ranges.get('image/webp', 0.0)),
+                  ('JPEG', quality(ranges, 'image/jpeg'))]
+    # sorted() is stable: WebP, the smaller, wins ties
+    formats = [fmt for (fmt, q) in sorted(candidates, key=lambda c: -c[1]) if q > 0]
+    # Refusing both leaves nothing better than JPEG to send
+    return formats or ['JPEG']
+
+def select_rendition(renditions, name, accept):
+    """Pick among `renditions` the `name` one in the best format for
+    `accept`; None if it has not been generated (yet)."""
+    by_format = {r['format']: r for r in renditions if r['name'] == name}
+    for fmt in preferred_formats(accept):
+        if fmt in by_format:
+            return by_format[fmt]
+    return None
+
+def resize(img, width, height, crop):
+    """Same semantics as ImageField's size: fit `img` in width x height,
+    cropping it to exactly that size if `crop` is set."""
+    img = img.copy()
+    if img.width > width or img.height > height:
+        if crop:
+            img = ImageOps.fit(img, (width, height), Image.LANCZOS)
+        else:
+            img.thumbnail((width, height), Image.LANCZOS)
+    return img
+
+def make_renditions(image):
+    """Yield a Rendition per configured size and format of `image` (bytes)."""
+    img = Image.open(io.BytesIO(image))
+    # A JPEG can be decoded at 1/2, 1/4 or 1/8 scale, which is much cheaper;
+    # draft() keeps it at least as large as the biggest rendition
+    img.draft('RGB', (max(w for (w, h, crop) in settings.renditions.values()),
+                      max(h for (w, h, crop) in settings.renditions.values())))
+    img = ImageOps.exif_transpose(img).convert('RGB')
+    for (name, (width, height, crop)) in settings.renditions.items():
+        resized = resize(img, width, height, crop)
+        for fmt in settings.rendition_formats:
+            buf = io.BytesIO()
+            resized.save(buf, fmt, quality=settings.rendition_quality)
+            buf.seek(0)
+            rendition = Rendition(name=name, format=fmt,
+                                  width=resized.width, height=resized.height)
+            rendition.image_file.put(buf, content_type=CONTENT_TYPES[fmt],
+                                     md5=hashlib.md5(buf.getbuffer()).hexdigest())
+            yield rendition
+
+@robustify.retry_mongo
+def find_photo(display_name, photo_id):
+    """The photo and its blob (None if it has none); (None, None) if there
+    is no such photo."""
+    photo = Photo.objects(display_name=display_name, photo_id=photo_id).first()
+    if photo is None:
+        return (None, None)
+    blob = Blob.objects(sha256=photo.sha256).first() if photo.sha256 else None
+    return (photo, blob)
+
+@robustify.retry_mongo
+def read_image(photo):
+    # A retry starts over from the beginning of the file
+    photo.image_file.seek(0)
+    return photo.image_file.read()
+
+@robustify.retry_mongo
+def copy_renditions(photo, renditions):
+    Photo.objects(id=photo.id).update(set__renditions=renditions)
+
+@robustify.retry_mongo
+def store_renditions(photo, blob, renditions, regenerate):
+    """Set the renditions of the photo, or of its blob; return the ones they
+    replace."""
+    if blob is None:
+        Photo.objects(id=photo.id).update(set__renditions=renditions)
+        return photo.renditions
+    Blob.objects(sha256=blob.sha256).update(set__renditions=renditions)
+    # The copies of the old renditions go with them
+    photos = Photo.objects(sha256=blob.sha256) if regenerate else Photo.objects(id=photo.id)
+    photos.update(set__renditions=renditions)
+    return blob.renditions
+
+@robustify.retry_mongo
+def delete_renditions(renditions):
+    for rendition in renditions:
+        rendition.image_file.delete()
+
+@robustify.retry_mongo
+def write_renditions(image):
+    """The renditions of `image`, written to GridFS. The files already
+    written are deleted if that fails, so a retry starts afresh."""
+    renditions = []
+    try:
+        for rendition in make_renditions(image):
+            renditions.append(rendition)
+    except BaseException:
+        delete_renditions(renditions)
+        raise
+    return renditions
+
+def generate_renditions(display_name, photo_id, regenerate=False):
+    """Generate the renditions of a photo. They belong to its blob, if it
+    has one: they are generated once per content, and a photo whose content
+    has them already just gets a copy of the list, unless `regenerate`.
+
+    Each step is retried on its own, so the files of the renditions are
+    not written again when storing them is retried."""
+    (photo, blob) = find_photo(display_name, photo_id)
+    if photo is None:
+        return False
+    if blob is not None and blob.renditions and not regenerate:
+        copy_renditions(photo, blob.renditions)
+        return True
+    try:
+        renditions = write_renditions(read_image(photo))
+    except (IOError) as e:
+        logger.warning(f"No renditions for photo {photo_id} of {display_name}: {e}")
+        return False
+    # Should this fail after its retries, the update may still have been
+    # applied: the new files are left in place rather than risk deleting
+    # renditions in use
+    old = store_renditions(photo, blob, renditions, regenerate)
+    delete_renditions(old)
+    return True
+
+def backfill(display_name=None, regenerate=False):
+    """Generate the renditions of the photos that have none (or of all of
+    them if `regenerate`); return how many photos were processed."""
+    qs = Photo.objects()
+    if display_name:
+        qs = qs.filter(display_name=display_name)
+    if not regenerate:
+        qs = qs.filter(Q(renditions__exists=False) | Q(renditions__size=0))
+    count = 0
+    # Regenerating the renditions of a blob updates all its photos
+    regenerated = set()
+    for (name, photo_id, sha256) in qs.scalar('display_name', 'photo_id', 'sha256'):
+        if sha256 in regenerated:
+            count += 1
+        elif generate_renditions(name, photo_id, regenerate):
+            count += 1
+            if regenerate and sha256:
+                regenerated.add(sha256)
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate missing photo renditions")
+    parser.add_argument('--display-name', help="only the photos of this photographer")
+    parser.add_argument('--all', action='store_true',
+                        help="regenerate existing renditions too")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    connect(settings.database_name, host=settings.mongo_url())
+    print(f"{backfill(args.display_name, args.all)} photos processed")
@@ -23,3 +23,24 @@ def retry(num_tries, exceptions):
 retry_mongo = retry(3, (pymongo.errors.AutoReconnect,
                         pymongo.errors.ServerSelectionTimeoutError,
                         pymongo.errors.NetworkTimeout))
+
+def retry_async(num_tries, exceptions):
+    def decorator(func):
+        async def f_retry(*args, **kwargs):
+            for i in range(num_tries):
+                ex = None
+                try:
+                    return await func(*args, **kwargs)
+                except exceptions as e:
+                    ex = e
+                    continue
+            if ex:
+                raise ex
+        return f_retry
+    return decorator
+
+
+# Same policy for the coroutines of photo_mongo_wrapper_async
+retry_mongo_async = retry_async(3, (pymongo.errors.AutoReconnect,
+                                    pymongo.errors.ServerSelectionTimeoutError,
+                                    pymongo.errors.NetworkTimeout))
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+
+# Images for the tests and the benchmarks.
+
+from io import BytesIO
+
+from PIL import Image
+
+
+def make_jpeg(size):
+    # A tiny valid JPEG padded to `size`: decoders stop at the EOI marker
+    buf = BytesIO()
+    Image.new("RGB", (64, 48), "gray").save(buf, "JPEG")
+    head = buf.getvalue()
+    return head + bytes(size - len(head))
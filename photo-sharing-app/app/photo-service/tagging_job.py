@@ -0,0 +1,20 @@
+from mongoengine import *
+from datetime import datetime
+
+class TaggingJob(Document):
+    """A photo waiting for its tags. Jobs are deleted once the tags are set."""
+    display_name = StringField(max_length=120, required=True)
+    photo_id = IntField(required=True)
+    # pending: ready once not_before has passed
+    # running: leased by a worker until not_before
+    # failed: gave up after too many attempts
+    state = StringField(choices=('pending', 'running', 'failed'), default='pending')
+    not_before = DateTimeField(default=datetime.utcnow)
+    owner = StringField()
+    attempts = IntField(default=0)
+    last_error = StringField()
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    # A photo has one job at most: queueing it is an upsert on this index
+    meta = {'indexes': [('state', 'not_before'), 'owner',
+                        {'fields': ('display_name', 'photo_id'), 'unique': True}]}
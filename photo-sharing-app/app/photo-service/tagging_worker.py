@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# Drains the TaggingJob queue: uploads only enqueue their photo, the tags
+# request to the tags service happens here, off the request path.
+#
+# photo_service runs TAGGING_WORKERS of these in its own process; more can be
+# started on their own with
+#   python tagging_worker.py
+
+import io
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pymongo
+from mongoengine import connect
+from PIL import Image, ImageOps
+
+from blob import Blob
+from photo import Photo
+from photo_const import settings
+from photo_mongo_wrapper import (mongo_claim_tagging_jobs, mongo_complete_tagging,
+                                 mongo_retry_tagging, mongo_requeue_untagged)
+from tags import TagsClient
+
+logger = logging.getLogger(__name__)
+
+def downscale(image, max_edge, quality=85):
+    """The JPEG the tags service is sent for `image` (bytes): at most
+    `max_edge` pixels wide and high, which is plenty to classify it. JPEGs
+    are decoded straight at a fraction of their size by draft(). An image
+    already small enough, or that PIL cannot read, is sent as is."""
+    if not max_edge:
+        return image
+    try:
+        with Image.open(io.BytesIO(image)) as img:
+            if max(img.size) <= max_edge:
+                return image
+            img.draft('RGB', (max_edge, max_edge))
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            img.thumbnail((max_edge, max_edge), Image.BILINEAR)
+            buf = io.BytesIO()
+            img.save(buf, 'JPEG', quality=quality)
+    except (IOError, Image.DecompressionBombError) as e:
+        logger.warning(f"Tagging image not downscaled: {e}")
+        return image
+    return buf.getvalue()
+
+class TaggingWorker:
+    """Claims batches of tagging jobs and tags their photos, at most
+    `concurrency` requests to the tags service at a time."""
+
+    def __init__(self, tags_client, concurrency=4, batch_size=16, max_attempts=5,
+                 lease=60, deadline=10, poll_interval=1, batch_rpc=False, max_edge=512,
+                 sweep_interval=300):
+        self.tags_client = tags_client
+        self.max_edge = max_edge
+        self.batch_size = batch_size
+        self.batch_rpc = batch_rpc
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.deadline = deadline
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.next_sweep = 0
+        self.owner = uuid.uuid4().hex
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def prepare(self, job):
+        """(tags, None) if the tags of the photo of `job` are known already,
+        else (None, the image to send to the tags service)."""
+        photo = Photo.objects(display_name=job.display_name, photo_id=job.photo_id).first()
+        # Deleted while waiting: there is nothing left to tag
+        if photo is None:
+            return ([], None)
+        if photo.sha256:
+            # Tagged meanwhile through another photo of the same content
+            blob = Blob.objects(sha256=photo.sha256).only('tags', 'tags_status').first()
+            if blob is not None and blob.tags_status == 'done':
+                return (list(blob.tags), None)
+        # The original stays untouched in GridFS
+        return (None, downscale(photo.image_file.read(), self.max_edge))
+
+    def tag(self, job):
+        (tags, image) = self.prepare(job)
+        if image is None:
+            return tags
+        return self.tags_client.get_tags(image, timeout=self.deadline)
+
+    def tag_each(self, jobs):
+        futures = [(job, self.executor.submit(self.tag, job)) for job in jobs]
+        outcomes = []
+        for (job, future) in futures:
+            try:
+                outcomes.append((job, future.result()))
+            except Exception as e:
+                outcomes.append((job, e))
+        return outcomes
+
+    def prepare_each(self, jobs):
+        """The jobs with what prepare() gives for them, or the exception it
+        raised: one photo that cannot be read fails its job only."""
+        prepared = []
+        for job in jobs:
+            try:
+                prepared.append((job, self.prepare(job)))
+            except Exception as e:
+                prepared.append((job, e))
+        return prepared
+
+    def tag_batch(self, jobs):
+        prepared = self.prepare_each(jobs)
+        outcomes = [(job, outcome) for (job, outcome) in prepared
+                    if isinstance(outcome, Exception)]
+        prepared = [(job, outcome) for (job, outcome) in prepared
+                    if not isinstance(outcome, Exception)]
+        outcomes += [(job, tags) for (job, (tags, image)) in prepared if image is None]
+        images = [(job, image) for (job, (tags, image)) in prepared if image is not None]
+        if images:
+            try:
+                tags = self.tags_client.get_tags_batch([image for (job, image) in images],
+                                                       timeout=self.deadline)
+                # One list of tags per image, or which goes with which is unknown
+                if len(tags) != len(images):
+                    raise ValueError(f"{len(tags)} lists of tags for {len(images)} images")
+                outcomes += zip([job for (job, image) in images], tags)
+            except Exception as e:
+                outcomes += [(job, e) for (job, image) in images]
+        return outcomes
+
+    def run_once(self):
+        """Process one batch of jobs; return how many were claimed."""
+        jobs = mongo_claim_tagging_jobs(self.owner, self.batch_size, self.lease)
+        outcomes = self.tag_batch(jobs) if self.batch_rpc else self.tag_each(jobs)
+        results = {}
+        for (job, outcome) in outcomes:
+            if isinstance(outcome, Exception):
+                # A tags service error or a timeout: the job is retried later
+                logger.warning(f"Tagging photo {job.photo_id} of {job.display_name} failed: {outcome}")
+                mongo_retry_tagging(job, str(outcome), self.max_attempts)
+            else:
+                results[job] = outcome
+        mongo_complete_tagging(results)
+        return len(jobs)
+
+    def sweep(self):
+        """Every `sweep_interval` seconds, queue the photos waiting for tags
+        that have no job."""
+        now = time.monotonic()
+        if now < self.next_sweep:
+            return
+        self.next_sweep = now + self.sweep_interval
+        requeued = mongo_requeue_untagged()
+        if requeued:
+            logger.warning(f"{requeued} photos waiting for tags had no tagging job")
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.sweep()
+                claimed = self.run_once()
+            except (pymongo.errors.AutoReconnect,
+                    pymongo.errors.ServerSelectionTimeoutError,
+                    pymongo.errors.NetworkTimeout) as e:
+                logger.warning(f"Tagging queue unavailable: {e}")
+                claimed = 0
+            except Exception:
+                # The thread must not die: tagging would stop for good. The
+                # jobs claimed are claimed again once their lease expires.
+                logger.exception("Tagging batch failed")
+                claimed = 0
+            if not claimed:
+                self.stopped.wait(self.poll_interval)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="tagging-" + self.owner, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.executor.shutdown()
+
+def make_tags_client():
+    return TagsClient(channels=settings.tags_channels,
+                      deadline=settings.tags_deadline,
+                      compression=settings.tags_compression,
+                      keepalive=settings.tags_keepalive,
+                      max_attempts=settings.tags_max_attempts)
+
+def start_tagging_workers(tags_client, count):
+    workers = [TaggingWorker(tags_client,
+                             concurrency=settings.tagging_concurrency,
+                             batch_size=settings.tagging_batch_size,
+                             max_attempts=settings.tagging_max_attempts,
+                             lease=settings.tagging_lease,
+                             deadline=settings.tags_deadline,
+                             batch_rpc=settings.tagging_batch_rpc,
+                             max_edge=settings.tagging_max_edge,
+                             sweep_interval=settings.tagging_sweep_interval)
+               for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    connect(settings.database_name, host=settings.mongo_url())
+    tags_client = make_tags_client()
+    tags_client.connect(settings.tags_host + ":" + settings.tags_port)
+    for worker in start_tagging_workers(tags_client, max(settings.tagging_workers, 1)):
+        worker.thread.join()
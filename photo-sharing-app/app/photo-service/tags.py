@@ -1,13 +1,104 @@
 import grpc
+import itertools
+import json
+import threading
 from typing import List
 import tags_pb2_grpc, tags_pb2
 
+# Images are sent whole in one message
+MAX_MESSAGE_LENGTH = 64 * 1024 * 1024
+
+def channel_options(keepalive=300, max_attempts=3):
+    """Options of the channels to the tags service.
+
+    Keepalive pings detect a dead connection while calls are in flight; they
+    are not sent more often than every 5 minutes by default, which gRPC
+    servers reject as abusive. Calls failing with UNAVAILABLE never reached
+    the tags service: gRPC retries them, up to `max_attempts`.
+    """
+    options = [("grpc.keepalive_time_ms", keepalive * 1000),
+               ("grpc.keepalive_timeout_ms", 20000),
+               ("grpc.max_send_message_length", MAX_MESSAGE_LENGTH),
+               ("grpc.max_receive_message_length", MAX_MESSAGE_LENGTH),
+               # Each channel of a pool gets its own connection
+               ("grpc.use_local_subchannel_pool", 1)]
+    if max_attempts > 1:
+        retry_policy = {"maxAttempts": max_attempts,
+                        "initialBackoff": "0.1s",
+                        "maxBackoff": "2s",
+                        "backoffMultiplier": 2,
+                        "retryableStatusCodes": ["UNAVAILABLE"]}
+        options += [("grpc.enable_retries", 1),
+                    ("grpc.service_config", json.dumps(
+                        {"methodConfig": [{"name": [{"service": "Tags"}],
+                                           "retryPolicy": retry_policy}]}))]
+    return options
+
 class TagsClient:
-    def __init__(self):
+    """Client of the tags service.
+
+    Calls are spread over a pool of `channels` channels, each with its own
+    connection, and fail with DEADLINE_EXCEEDED after `deadline` seconds
+    unless given another timeout. `compression` gzips the messages.
+    """
+
+    def __init__(self, channels=1, deadline=10, compression=False, keepalive=300,
+                 max_attempts=3):
+        self.pool_size = channels
+        self.deadline = deadline
+        self.compression = grpc.Compression.Gzip if compression else grpc.Compression.NoCompression
+        self.options = channel_options(keepalive, max_attempts)
+        self.channels = []
+        self.stubs = []
+        # The first channel and its stub
         self.channel = None
         self.stub = None
+        self.batch_supported = True
+        self._next_stub = None
+        self._lock = threading.Lock()
 
     def connect(self, service_host):
-        self.channel = grpc.insecure_channel(service_host)
-        self.stub = tags_pb2_grpc.TagsStub(self.channel)
+        self.channels = [grpc.insecure_channel(service_host, options=self.options,
+                                               compression=self.compression)
+                         for _ in range(self.pool_size)]
+        self.stubs = [tags_pb2_grpc.TagsStub(channel) for channel in self.channels]
+        self.channel = self.channels[0]
+        self.stub = self.stubs[0]
+        self._next_stub = itertools.cycle(self.stubs)
+
+    def next_stub(self):
+        with self._lock:
+            return next(self._next_stub)
+
+    def get_tags(self, image, timeout=None) -> List[str]:
+        reply = self.next_stub().getTags(tags_pb2.ImageRequest(file=image),
+                                         timeout=timeout or self.deadline)
+        return list(reply.tags)
+
+    def get_tags_batch(self, images, timeout=None) -> List[List[str]]:
+        """The tags of each of `images`, in one call. A tags service that does
+        not implement getTagsBatch is sent one getTags per image instead."""
+        if self.batch_supported:
+            request = tags_pb2.ImageBatchRequest(
+                images=[tags_pb2.ImageRequest(file=image) for image in images])
+            try:
+                reply = self.next_stub().getTagsBatch(request, timeout=timeout or self.deadline)
+                return [list(tags_reply.tags) for tags_reply in reply.replies]
+            except grpc.RpcError as e:
+                if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                    raise
+                self.batch_supported = False
+        return [self.get_tags(image, timeout) for image in images]
+
+    def stream_tags(self, images, timeout=None):
+        """Yield (index, tags) for each of `images`, an iterable consumed as
+        the stream goes, over a single streamTags call, as the replies come.
+        The deadline bounds the whole stream."""
+        requests = (tags_pb2.ImageRequest(file=image, id=str(index))
+                    for (index, image) in enumerate(images))
+        for reply in self.next_stub().streamTags(requests, timeout=timeout or self.deadline):
+            yield (int(reply.id), list(reply.tags))
 
+    def close(self):
+        for channel in self.channels:
+            channel.close()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+# Throughput of TagsClient against a tags service, by default an in-process
+# tags_standin_server:
+#   python tags_benchmark.py --calls 500 --concurrency 16 --batch-size 16
+#   python tags_benchmark.py --target tags-service:50051 --modes unary
+# Each mode makes `calls` calls, `concurrency` at a time: getTags with one
+# image, getTagsBatch with `batch_size` images, or a streamTags stream of
+# `batch_size` images. The traffic goes through a TCP relay counting the
+# bytes on the wire, gRPC framing and compression included.
+
+import argparse
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+
+from tags import TagsClient
+from tags_standin_server import StandinTagger, serve
+
+MODES = ('unary', 'batch', 'stream')
+
+class WireCounter:
+    """TCP relay to `target` (host, port) counting the bytes going through."""
+
+    def __init__(self, target):
+        self.target = target
+        self.listener = socket.create_server(("localhost", 0))
+        self.port = self.listener.getsockname()[1]
+        self.lock = threading.Lock()
+        self.reset()
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.sent = 0
+            self.received = 0
+
+    def accept(self):
+        while True:
+            try:
+                (client, _) = self.listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(self.target)
+            for (source, sink, direction) in [(client, upstream, 'sent'),
+                                              (upstream, client, 'received')]:
+                threading.Thread(target=self.pump, args=(source, sink, direction),
+                                 daemon=True).start()
+
+    def pump(self, source, sink, direction):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                sink.sendall(data)
+                with self.lock:
+                    setattr(self, direction, getattr(self, direction) + len(data))
+        except OSError:
+            pass
+        finally:
+            for sock in (source, sink):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self):
+        self.listener.close()
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def call(client, mode, images):
+    if mode == 'unary':
+        client.get_tags(images[0])
+    elif mode == 'batch':
+        client.get_tags_batch(images)
+    else:
+        for _ in client.stream_tags(iter(images)):
+            pass
+
+def run(client, wire, mode, calls=200, concurrency=8, batch_size=16, image_size=64 * 1024):
+    """Make `calls` calls in `mode` with `client`; return the measures."""
+    images = [os.urandom(image_size) for _ in range(1 if mode == 'unary' else batch_size)]
+    latencies = []
+    errors = 0
+
+    def timed_call(_):
+        start = time.perf_counter()
+        try:
+            call(client, mode, images)
+        except grpc.RpcError:
+            return None
+        return time.perf_counter() - start
+
+    wire.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency in executor.map(timed_call, range(calls)):
+            if latency is None:
+                errors += 1
+            else:
+                latencies.append(latency)
+    elapsed = time.perf_counter() - start
+    return {'mode': mode,
+            'calls': calls,
+            'images': calls * len(images),
+            'errors': errors,
+            'seconds': elapsed,
+            'calls_per_second': calls / elapsed,
+            'images_per_second': calls * len(images) / elapsed,
+            'p50_ms': 1000 * percentile(latencies, 0.5) if latencies else None,
+            'p99_ms': 1000 * percentile(latencies, 0.99) if latencies else None,
+            'bytes_sent': wire.sent,
+            'bytes_received': wire.received}
+
+def report(result):
+    latency = (f"p50 {result['p50_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms"
+               if result['p50_ms'] is not None else "no successful call")
+    return (f"{result['mode']:>6}: {result['calls_per_second']:8.1f} calls/s "
+            f"{result['images_per_second']:8.1f} images/s  {latency}  "
+            f"{result['errors']} errors  "
+            f"{result['bytes_sent'] / 1e6:.1f} MB sent, "
+            f"{result['bytes_received'] / 1e3:.1f} kB received")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark TagsClient")
+    parser.add_argument('--target', help="host:port of a tags service "
+                        "(default: an in-process stand-in)")
+    parser.add_argument('--modes', default=",".join(MODES))
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--image-size', type=int, default=64 * 1024)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--compression', action='store_true')
+    parser.add_argument('--deadline', type=float, default=30)
+    standin = parser.add_argument_group("stand-in tags service")
+    standin.add_argument('--latency', type=float, default=0.02)
+    standin.add_argument('--per-image', type=float, default=0.002)
+    standin.add_argument('--jitter', type=float, default=0.005)
+    standin.add_argument('--error-rate', type=float, default=0.0)
+    standin.add_argument('--max-concurrency', type=int, default=0)
+    args = parser.parse_args()
+
+    server = None
+    if args.target:
+        (host, _, port) = args.target.rpartition(":")
+        target = (host, int(port))
+    else:
+        tagger = StandinTagger(args.latency, args.per_image, args.jitter, args.error_rate,
+                               args.max_concurrency)
+        (server, port) = serve(tagger, "localhost:0")
+        target = ("localhost", port)
+    wire = WireCounter(target)
+    client = TagsClient(channels=args.channels, deadline=args.deadline,
+                        compression=args.compression)
+    client.connect(f"localhost:{wire.port}")
+    try:
+        for mode in args.modes.split(","):
+            print(report(run(client, wire, mode, args.calls, args.concurrency,
+                             args.batch_size, args.image_size)))
+    finally:
+        client.close()
+        wire.close()
+        if server is not None:
+            server.stop(None)
@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\ntags.proto\"\x1c\n\x0cImageRequest\x12\x0c\n\x04\x66ile\x18\x01 \x01(\x0c\"\x19\n\tTagsReply\x12\x0c\n\x04tags\x18\x01 \x03(\t2.\n\x04Tags\x12&\n\x07getTags\x12\r.ImageRequest\x1a\n.TagsReply\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\ntags.proto\"(\n\x0cImageRequest\x12\x0c\n\x04\x66ile\x18\x01 \x01(\x0c\x12\n\n\x02id\x18\x02 \x01(\t\"%\n\tTagsReply\x12\x0c\n\x04tags\x18\x01 \x03(\t\x12\n\n\x02id\x18\x02 \x01(\t\"2\n\x11ImageBatchRequest\x12\x1d\n\x06images\x18\x01 \x03(\x0b\x32\r.ImageRequest\"-\n\x0eTagsBatchReply\x12\x1b\n\x07replies\x18\x01 \x03(\x0b\x32\n.TagsReply2\x94\x01\n\x04Tags\x12&\n\x07getTags\x12\r.ImageRequest\x1a\n.TagsReply\"\x00\x12\x35\n\x0cgetTagsBatch\x12\x12.ImageBatchRequest\x1a\x0f.TagsBatchReply\"\x00\x12-\n\nstreamTags\x12\r.ImageRequest\x1a\n.TagsReply\"\x00(\x01\x30\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -32,9 +32,13 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'tags_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
   _globals['_IMAGEREQUEST']._serialized_start=14
-  _globals['_IMAGEREQUEST']._serialized_end=42
-  _globals['_TAGSREPLY']._serialized_start=44
-  _globals['_TAGSREPLY']._serialized_end=69
-  _globals['_TAGS']._serialized_start=71
-  _globals['_TAGS']._serialized_end=117
+  _globals['_IMAGEREQUEST']._serialized_end=54
+  _globals['_TAGSREPLY']._serialized_start=56
+  _globals['_TAGSREPLY']._serialized_end=93
+  _globals['_IMAGEBATCHREQUEST']._serialized_start=95
+  _globals['_IMAGEBATCHREQUEST']._serialized_end=145
+  _globals['_TAGSBATCHREPLY']._serialized_start=147
+  _globals['_TAGSBATCHREPLY']._serialized_end=192
+  _globals['_TAGS']._serialized_start=195
+  _globals['_TAGS']._serialized_end=343
 # @@protoc_insertion_point(module_scope)
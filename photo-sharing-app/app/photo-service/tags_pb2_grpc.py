@@ -39,6 +39,16 @@ class TagsStub(object):
                 request_serializer=tags__pb2.ImageRequest.SerializeToString,
                 response_deserializer=tags__pb2.TagsReply.FromString,
                 _registered_method=True)
+        self.getTagsBatch = channel.unary_unary(
+                '/Tags/getTagsBatch',
+                request_serializer=tags__pb2.ImageBatchRequest.SerializeToString,
+                response_deserializer=tags__pb2.TagsBatchReply.FromString,
+                _registered_method=True)
+        self.streamTags = channel.stream_stream(
+                '/Tags/streamTags',
+                request_serializer=tags__pb2.ImageRequest.SerializeToString,
+                response_deserializer=tags__pb2.TagsReply.FromString,
+                _registered_method=True)
 
 
 class TagsServicer(object):
@@ -50,6 +60,21 @@ class TagsServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def getTagsBatch(self, request, context):
+        """The tags of several images in one call, replies in the order of the
+        images
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def streamTags(self, request_iterator, context):
+        """One reply per image sent on the stream, with the id of its request
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_TagsServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -58,6 +83,16 @@ def add_TagsServicer_to_server(servicer, server):
                     request_deserializer=tags__pb2.ImageRequest.FromString,
                     response_serializer=tags__pb2.TagsReply.SerializeToString,
             ),
+            'getTagsBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.getTagsBatch,
+                    request_deserializer=tags__pb2.ImageBatchRequest.FromString,
+                    response_serializer=tags__pb2.TagsBatchReply.SerializeToString,
+            ),
+            'streamTags': grpc.stream_stream_rpc_method_handler(
+                    servicer.streamTags,
+                    request_deserializer=tags__pb2.ImageRequest.FromString,
+                    response_serializer=tags__pb2.TagsReply.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'Tags', rpc_method_handlers)
@@ -95,3 +130,57 @@ class Tags(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def getTagsBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/Tags/getTagsBatch',
+            tags__pb2.ImageBatchRequest.SerializeToString,
+            tags__pb2.TagsBatchReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def streamTags(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/Tags/streamTags',
+            tags__pb2.ImageRequest.SerializeToString,
+            tags__pb2.TagsReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# A stand-in for the tags service, implementing proto/tags.proto, to run the
+# photo service and its benchmarks against a real gRPC peer:
+#   python tags_standin_server.py --port 50051 --latency 0.05 --jitter 0.02 \
+#       --error-rate 0.01 --max-concurrency 8
+# Every call takes `latency` seconds, plus `per_image` seconds per image it
+# tags, give or take `jitter`; at most `max_concurrency` calls are served at
+# once, the others wait their turn. `error_rate` of the calls fail with
+# UNAVAILABLE. With --decode, images are decoded as a real tagger would.
+
+import argparse
+import io
+import logging
+import random
+import threading
+import time
+from concurrent import futures
+
+import grpc
+from PIL import Image
+
+import tags_pb2
+import tags_pb2_grpc
+from tags import MAX_MESSAGE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+class StandinTagger(tags_pb2_grpc.TagsServicer):
+
+    def __init__(self, latency=0.05, per_image=0.0, jitter=0.0, error_rate=0.0,
+                 max_concurrency=0, tags=("landscape", "nature"), seed=None, decode=False):
+        self.latency = latency
+        self.per_image = per_image
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.decode = decode
+        self.tags = list(tags)
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.images = 0
+        self.errors = 0
+
+    def serve(self, images, context):
+        """Wait as long as tagging `images` (bytes) takes, or fail."""
+        if self.decode:
+            for image in images:
+                try:
+                    with Image.open(io.BytesIO(image)) as img:
+                        img.load()
+                except IOError:
+                    context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Not an image")
+        images = len(images)
+        with self.lock:
+            self.calls += 1
+            self.images += images
+            delay = self.latency + self.per_image * images
+            delay = max(0.0, delay + self.random.uniform(-self.jitter, self.jitter))
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            time.sleep(delay)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+        if failed:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Injected error")
+
+    def getTags(self, request, context):
+        self.serve([request.file], context)
+        return tags_pb2.TagsReply(tags=self.tags)
+
+    def getTagsBatch(self, request, context):
+        self.serve([image.file for image in request.images], context)
+        return tags_pb2.TagsBatchReply(replies=[tags_pb2.TagsReply(tags=self.tags)
+                                                for _ in request.images])
+
+    def streamTags(self, request_iterator, context):
+        for request in request_iterator:
+            self.serve([request.file], context)
+            yield tags_pb2.TagsReply(tags=self.tags, id=request.id)
+
+def serve(tagger, address="[::]:50051", workers=64):
+    """Start a gRPC server for `tagger`; return it and the port it listens on."""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers),
+                         options=[("grpc.max_send_message_length", MAX_MESSAGE_LENGTH),
+                                  ("grpc.max_receive_message_length", MAX_MESSAGE_LENGTH)])
+    tags_pb2_grpc.add_TagsServicer_to_server(tagger, server)
+    port = server.add_insecure_port(address)
+    server.start()
+    return (server, port)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in tags gRPC service")
+    parser.add_argument('--port', type=int, default=50051)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per call")
+    parser.add_argument('--per-image', type=float, default=0.0, help="seconds per image")
+    parser.add_argument('--jitter', type=float, default=0.0, help="+/- seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of calls failing with UNAVAILABLE")
+    parser.add_argument('--max-concurrency', type=int, default=0,
+                        help="calls served at once (0 = no limit)")
+    parser.add_argument('--decode', action='store_true', help="decode the images")
+    parser.add_argument('--workers', type=int, default=64, help="server threads")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    tagger = StandinTagger(args.latency, args.per_image, args.jitter, args.error_rate,
+                           args.max_concurrency, decode=args.decode)
+    (server, port) = serve(tagger, f"[::]:{args.port}", args.workers)
+    logger.info(f"Stand-in tags service listening on port {port}")
+    server.wait_for_termination()
@@ -0,0 +1,56 @@
+import pytest
+import asyncio
+
+import httpx
+from httpx import ASGITransport, AsyncClient
+
+from photo_const import REQUEST_TIMEOUT, photographer_service
+import photo_service_async
+import photo_mongo_wrapper_async
+from photographer_client import AsyncPhotographerClient
+
+# That many gallery reads, of as many photographers, are sent at once
+CONCURRENT_REQUESTS = 200
+
+class InFlight:
+    """Stand-in photographer service holding each check until all of them
+    are in flight, or until it is clear they will not be."""
+
+    def __init__(self, expected, timeout=5):
+        self.expected = expected
+        self.timeout = timeout
+        self.now = 0
+        self.most = 0
+        self.all_in = asyncio.Event()
+
+    async def handle(self, request):
+        self.now += 1
+        self.most = max(self.most, self.now)
+        if self.now >= self.expected:
+            self.all_in.set()
+        try:
+            await asyncio.wait_for(self.all_in.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.now -= 1
+        return httpx.Response(200, json={})
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+async def test_async_mode_concurrency_gain():
+    await photo_mongo_wrapper_async.mongo_connect("mongodb://mongo-service-test", "photos")
+    in_flight = InFlight(CONCURRENT_REQUESTS)
+    photo_service_async.photographers = AsyncPhotographerClient(
+        photographer_service, REQUEST_TIMEOUT, ttl=0,
+        transport=httpx.MockTransport(in_flight.handle))
+
+    async with AsyncClient(transport=ASGITransport(photo_service_async.app),
+                           base_url="http://testserver") as ac:
+        responses = await asyncio.gather(*[ac.get(f"/gallery/photographer{number}")
+                                           for number in range(CONCURRENT_REQUESTS)])
+    # No photos: the photographers were all checked
+    assert all(response.status_code == 204 for response in responses)
+    # The async routes all wait for the photographer service together
+    assert in_flight.most == CONCURRENT_REQUESTS
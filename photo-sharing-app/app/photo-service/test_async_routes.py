@@ -0,0 +1,51 @@
+import pytest
+import hashlib
+import unittest.mock
+
+import httpx
+from httpx import ASGITransport, AsyncClient
+
+from photo_const import REQUEST_TIMEOUT, photographer_service
+import photo_service_async
+import photo_mongo_wrapper_async
+from photographer_client import AsyncPhotographerClient
+from sample_images import make_jpeg
+
+def batch(images):
+    return [('files', (f"{index}.jpg", image, "image/jpeg"))
+            for (index, image) in enumerate(images)]
+
+@pytest.mark.asyncio
+@unittest.mock.patch('photo_service_async.notify_albums_of_deletion')
+@unittest.mock.patch('photo_service_async.generate_renditions')
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+async def test_batch_upload_delete_and_queue(generate_renditions, notify):
+    await photo_mongo_wrapper_async.mongo_connect("mongodb://mongo-service-test", "photos")
+    photo_service_async.photographers = AsyncPhotographerClient(
+        photographer_service, REQUEST_TIMEOUT, ttl=0,
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, json={})))
+    images = [make_jpeg(2000), make_jpeg(3000)]
+
+    async with AsyncClient(transport=ASGITransport(photo_service_async.app),
+                           base_url="http://testserver") as ac:
+        response = await ac.post('/gallery/joe/batch',
+                                 files=batch([images[0], b"not an image", images[1]]))
+        assert response.status_code == 200
+        assert [item["status"] for item in response.json()["items"]] == [201, 400, 201]
+        assert response.json()["items"][2]["location"] == "/photo/joe/1"
+        assert generate_renditions.call_count == 2
+
+        response = await ac.get('/tagging/queue')
+        assert response.status_code == 200
+        assert response.json()["pending"] == 2
+
+        response = await ac.post('/gallery/joe', files={'file': images[0]})
+        assert response.headers["Location"] == "/photo/joe/2"
+        # The content stays, referenced by the other photo
+        assert (await ac.delete('/photo/joe/0')).status_code == 204
+        assert (await ac.delete('/photo/joe/0')).status_code == 404
+        blob = await photo_mongo_wrapper_async.blobs().find_one(
+            {'_id': hashlib.sha256(images[0]).hexdigest()})
+        assert blob['refcount'] == 1
+    notify.assert_called_once_with("joe", [0])
@@ -0,0 +1,95 @@
+import pytest
+import unittest.mock
+from types import SimpleNamespace
+
+from starlette.testclient import TestClient
+
+from blob import Blob
+from photo import Photo
+from tagging_job import TaggingJob
+import photo_mongo_wrapper
+from photo_mongo_wrapper import mongo_save_photos, enqueue_tagging_jobs
+from photo_service import app
+from test_dedup import flaky
+from sample_images import make_jpeg
+
+client = TestClient(app)
+
+BATCH_IMAGES = 10
+
+def photographer_exists(*args, **kwargs):
+    return SimpleNamespace(status_code=200)
+
+def batch(images):
+    return [('files', (f"{index}.jpg", image, "image/jpeg"))
+            for (index, image) in enumerate(images)]
+
+@unittest.mock.patch('photo_service.generate_renditions')
+@unittest.mock.patch('photo_service.photographers.session.get', photographer_exists)
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_batch_upload(generate_renditions):
+    images = batch([make_jpeg(2000), b"not an image", make_jpeg(3000)])
+    response = client.post('/gallery/joe/batch', files=images)
+    assert response.status_code == 200
+    assert response.json()["items"] == [
+        {"filename": "0.jpg", "status": 201, "location": "/photo/joe/0", "detail": None},
+        {"filename": "1.jpg", "status": 400, "location": None, "detail": "Not an image"},
+        {"filename": "2.jpg", "status": 201, "location": "/photo/joe/1", "detail": None}]
+
+    ph = Photo.objects(display_name="joe", photo_id=1).get()
+    assert ph.image_file.length == 3000
+    assert ph.tags_status == "pending"
+    assert sorted(TaggingJob.objects(display_name="joe").scalar('photo_id')) == [0, 1]
+    assert generate_renditions.call_count == 2
+
+    # Ids go on after the range reserved by the batch
+    response = client.post('/gallery/joe', files={'file': make_jpeg(1000)})
+    assert response.headers["Location"] == "/photo/joe/2"
+
+@unittest.mock.patch('photo_service.photographers.session.get')
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_batch_upload_unknown_photographer(requests_get):
+    requests_get.return_value.status_code = 404
+    response = client.post('/gallery/nobody/batch', files=batch([make_jpeg(2000)]))
+    assert response.status_code == 404
+    assert Photo.objects(display_name="nobody").count() == 0
+
+@unittest.mock.patch('photo_service.generate_renditions')
+@unittest.mock.patch('photo_service.photographers.session.get', photographer_exists)
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_batch_upload_writes_once(generate_renditions):
+    # Distinct contents, none of them tagged yet
+    images = [make_jpeg(2000 + size) for size in range(BATCH_IMAGES)]
+    with unittest.mock.patch('photo_mongo_wrapper.upsert_photos',
+                             wraps=photo_mongo_wrapper.upsert_photos) as upsert, \
+         unittest.mock.patch('photo_mongo_wrapper.TaggingJob._get_collection',
+                             wraps=TaggingJob._get_collection) as jobs, \
+         unittest.mock.patch.object(Photo, 'save') as save:
+        response = client.post('/gallery/jane/batch', files=batch(images))
+    assert all(item["status"] == 201 for item in response.json()["items"])
+    # One write for all the photos, one for all their tagging jobs
+    assert upsert.call_count == 1
+    assert len(upsert.call_args.args[0]) == BATCH_IMAGES
+    assert jobs.call_count == 1
+    save.assert_not_called()
+    assert Photo.objects(display_name="jane").count() == BATCH_IMAGES
+    assert TaggingJob.objects(display_name="jane").count() == BATCH_IMAGES
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_batch_retries_write_once():
+    images = [make_jpeg(2000 + size) for size in range(3)]
+    # The photos are written, the reply is lost: the retry inserts none again
+    upsert = flaky(photo_mongo_wrapper.upsert_photos, lose_reply=True)
+    with unittest.mock.patch('photo_mongo_wrapper.upsert_photos', upsert):
+        photos = mongo_save_photos(images, "joe", 0)
+    assert len(upsert.calls) == 2
+    assert Photo.objects(display_name="joe").count() == 3
+    assert [blob.refcount for blob in Blob.objects] == [1, 1, 1]
+
+    # Nor are tagging jobs queued twice
+    enqueue_tagging_jobs("joe", [photo.photo_id for photo in photos])
+    assert sorted(TaggingJob.objects(display_name="joe").scalar('photo_id')) == [0, 1, 2]
@@ -0,0 +1,140 @@
+import pytest
+import unittest.mock
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pymongo
+
+from starlette.testclient import TestClient
+
+from blob import Blob
+from photo import Photo
+from tagging_job import TaggingJob
+import photo_mongo_wrapper
+from photo_mongo_wrapper import mongo_save_photo, mongo_save_photos, mongo_enqueue_tagging
+from photo_service import app
+from renditions import generate_renditions
+from tagging_worker import TaggingWorker
+from test_renditions import camera_jpeg
+from sample_images import make_jpeg
+
+client = TestClient(app)
+
+def image_files():
+    # Originals and renditions alike are in the 'images' bucket
+    return Photo._get_db()['images.files'].count_documents({})
+
+@unittest.mock.patch('photo_service.generate_renditions')
+@unittest.mock.patch('photo_service.photographers.session.get')
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_same_content_is_stored_once(requests_get, generate):
+    requests_get.return_value.status_code = 200
+    image = make_jpeg(4096)
+    files = image_files()
+    for name in ("joe", "jane"):
+        response = client.post('/gallery/' + name, files={'file': image})
+        assert response.status_code == 201
+
+    blob = Blob.objects.get()
+    assert blob.refcount == 2
+    assert image_files() == files + 1
+    (joe, jane) = (Photo.objects(display_name=name).get() for name in ("joe", "jane"))
+    assert joe.sha256 == jane.sha256 == blob.sha256
+    assert joe.image_file.grid_id == jane.image_file.grid_id
+    assert client.get('/photo/jane/0').content == image
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_tags_are_memoised():
+    image = make_jpeg(4096)
+    assert mongo_save_photo(image, "joe", 0, tags_status='pending')
+    mongo_enqueue_tagging("joe", 0)
+    # Uploaded before the first one is tagged: it is tagged from the blob
+    assert mongo_save_photo(image, "jane", 0, tags_status='pending')
+    mongo_enqueue_tagging("jane", 0)
+    tags_client = Mock()
+    tags_client.get_tags.return_value = ['landscape']
+    worker = TaggingWorker(tags_client, batch_size=1)
+
+    assert worker.run_once() == 1
+    assert worker.run_once() == 1
+    assert tags_client.get_tags.call_count == 1
+    assert list(Blob.objects.get().tags) == ['landscape']
+    assert all(list(ph.tags) == ['landscape'] for ph in Photo.objects())
+
+    # Uploaded afterwards: tagged straight away, with no job
+    photo = mongo_save_photo(image, "jim", 0, tags_status='pending')
+    assert photo.tags_status == 'done'
+    assert list(photo.tags) == ['landscape']
+    assert TaggingJob.objects.count() == 0
+
+@unittest.mock.patch('photo_service.generate_renditions')
+@unittest.mock.patch('photo_service.photographers.session.get')
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_last_delete_removes_the_content(requests_get, generate):
+    requests_get.return_value.status_code = 200
+    image = camera_jpeg()
+    files = image_files()
+    assert mongo_save_photo(image, "joe", 0)
+    assert mongo_save_photo(image, "jane", 0)
+    assert generate_renditions("joe", 0)
+    assert generate_renditions("jane", 0)
+    rendition_files = len(Blob.objects.get().renditions)
+    # The renditions are generated once, for both photos
+    assert image_files() == files + 1 + rendition_files
+
+    assert client.delete('/photo/joe/0').status_code == 204
+    assert client.delete('/photo/joe/0').status_code == 404
+    assert Blob.objects.get().refcount == 1
+    assert client.get('/photo/jane/0').content == image
+
+    assert client.delete('/photo/jane/0').status_code == 204
+    assert Blob.objects.count() == 0
+    assert image_files() == files
+
+def flaky(write, lose_reply=False):
+    """`write`, failing with AutoReconnect the first time it is called;
+    with `lose_reply`, after having written."""
+    calls = []
+    def call(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            if lose_reply:
+                write(*args, **kwargs)
+            raise pymongo.errors.AutoReconnect("connection lost")
+        return write(*args, **kwargs)
+    call.calls = calls
+    return call
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+@pytest.mark.parametrize("lose_reply", [False, True])
+def test_retried_insert_takes_one_reference(lose_reply):
+    image = make_jpeg(4096)
+    upsert = flaky(photo_mongo_wrapper.upsert_photos, lose_reply)
+    with unittest.mock.patch('photo_mongo_wrapper.upsert_photos', upsert):
+        assert mongo_save_photo(image, "joe", 0)
+    assert len(upsert.calls) == 2
+    assert Photo.objects.count() == 1
+    assert Blob.objects.get().refcount == 1
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_failed_insert_drops_its_reference():
+    image = make_jpeg(4096)
+    files = image_files()
+    assert mongo_save_photo(image, "jane", 0)
+    with unittest.mock.patch('photo_mongo_wrapper.upsert_photos',
+                             side_effect=pymongo.errors.AutoReconnect("connection lost")):
+        with pytest.raises(pymongo.errors.AutoReconnect):
+            mongo_save_photo(image, "joe", 0)
+        with pytest.raises(pymongo.errors.AutoReconnect):
+            mongo_save_photo(make_jpeg(8192), "joe", 1)
+        with pytest.raises(pymongo.errors.AutoReconnect):
+            mongo_save_photos([image, make_jpeg(8192)], "joe", 2)
+    assert Blob.objects.get().refcount == 1
+    # The new content was stored, then deleted with its last reference
+    assert image_files() == files + 1
+    assert Photo.objects(display_name="joe").count() == 0
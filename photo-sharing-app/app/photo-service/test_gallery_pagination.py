@@ -0,0 +1,62 @@
+import pytest
+import unittest.mock
+
+from starlette.testclient import TestClient
+
+from photo_service import app
+from photo_mongo_wrapper import mongo_save_photo, mongo_get_photos_by_name
+from pagination import encode_cursor
+from photo_const import settings
+from sample_images import make_jpeg
+
+client = TestClient(app)
+
+def photographer_exists(*args, **kwargs):
+    return unittest.mock.Mock(status_code=200)
+
+@pytest.fixture
+def gallery(initDB, clearPhotos):
+    image = make_jpeg(1000)
+    # Out of order: pages follow photo_id, not insertion order
+    for photo_id in [7, 3, 11, 0, 5, 9, 1]:
+        assert mongo_save_photo(image, "joe", photo_id)
+    assert mongo_save_photo(image, "jane", 4)
+
+@pytest.mark.usefixtures("gallery")
+def test_get_photos_by_name():
+    assert mongo_get_photos_by_name("joe", 0, 3) == (True, [0, 1, 3])
+    assert mongo_get_photos_by_name("joe", 0, 3, after=3) == (True, [5, 7, 9])
+    assert mongo_get_photos_by_name("joe", 0, 3, after=9) == (False, [11])
+    assert mongo_get_photos_by_name("joe", 4, 3) == (False, [7, 9, 11])
+
+@pytest.mark.usefixtures("gallery")
+def test_gallery_cursor():
+    with unittest.mock.patch("photo_service.photographers.session.get", photographer_exists):
+        photo_ids = []
+        params = {"limit": 3}
+        while True:
+            response = client.get("/gallery/joe", params=params)
+            assert response.status_code == 200
+            page = response.json()
+            photo_ids += [item["photo_id"] for item in page["items"]]
+            assert page["items"][0]["link"] == "/photo/joe/" + str(page["items"][0]["photo_id"])
+            if not page["has_more"]:
+                assert page["next_cursor"] is None
+                break
+            params["after"] = page["next_cursor"]
+        assert photo_ids == [0, 1, 3, 5, 7, 9, 11]
+
+        # offset still works
+        response = client.get("/gallery/joe", params={"offset": 6, "limit": 3})
+        assert response.json() == {"items": [{"photo_id": 11, "link": "/photo/joe/11"}],
+                                   "has_more": False, "next_cursor": None}
+
+        # Not cursors, or cursors of something else than a gallery
+        for after in ["not a cursor", encode_cursor("abc"), encode_cursor([1]),
+                      encode_cursor(1.5), encode_cursor(True)]:
+            response = client.get("/gallery/joe", params={"after": after})
+            assert response.status_code == 400
+
+        for params in [{"limit": 0}, {"limit": -1}, {"limit": settings.page_max_limit + 1},
+                       {"offset": -1}]:
+            assert client.get("/gallery/joe", params=params).status_code == 422
@@ -0,0 +1,98 @@
+import pytest
+import unittest.mock
+
+from starlette.testclient import TestClient
+
+from photo import Photo
+from photo_mongo_wrapper import mongo_save_photo
+from photo_service import app
+from sample_images import make_jpeg
+
+client = TestClient(app)
+
+ATTRIBUTES = {'title': "Dunes", 'comment': "At dawn", 'location': "Douz", 'author': "Joe"}
+
+@pytest.fixture
+def shoot(initDB, clearPhotos):
+    for photo_id in range(3):
+        assert mongo_save_photo(make_jpeg(1000), "joe", photo_id)
+
+def attributes(photo_id):
+    response = client.get(f'/photo/joe/{photo_id}/attributes')
+    assert response.status_code == 200
+    return {key: response.json()[key] for key in ATTRIBUTES}
+
+@pytest.mark.usefixtures("shoot")
+def test_put_and_patch():
+    assert client.put('/photo/joe/0/attributes', json=ATTRIBUTES).status_code == 200
+    assert attributes(0) == ATTRIBUTES
+
+    assert client.patch('/photo/joe/0/attributes', json={'title': "Dune"}).status_code == 200
+    assert attributes(0) == dict(ATTRIBUTES, title="Dune")
+    # Nothing to change
+    assert client.patch('/photo/joe/0/attributes', json={}).status_code == 200
+    assert attributes(0) == dict(ATTRIBUTES, title="Dune")
+    # Null is not a value: the attribute is left out to be kept
+    assert client.patch('/photo/joe/0/attributes', json={'title': None}).status_code == 422
+    assert attributes(0) == dict(ATTRIBUTES, title="Dune")
+
+    assert client.put('/photo/joe/9/attributes', json=ATTRIBUTES).status_code == 404
+    assert client.patch('/photo/joe/9/attributes', json={'title': "Dune"}).status_code == 404
+    assert client.patch('/photo/joe/9/attributes', json={}).status_code == 404
+
+@pytest.mark.usefixtures("shoot")
+def test_bulk_patch():
+    items = [{'photo_id': photo_id, 'comment': "Sahara shoot"} for photo_id in (0, 1, 9)]
+    items.append({'photo_id': 2, 'title': "Oasis", 'location': "Tozeur"})
+    response = client.patch('/photo/joe/attributes', json={'items': items})
+    assert response.status_code == 200
+    assert response.json() == {'matched': 3, 'modified': 3}
+
+    assert attributes(0)['comment'] == attributes(1)['comment'] == "Sahara shoot"
+    assert attributes(0)['title'] == "--unset--"
+    assert attributes(2) == {'title': "Oasis", 'comment': "--unset--",
+                             'location': "Tozeur", 'author': "--unset--"}
+
+    response = client.patch('/photo/joe/attributes',
+                            json={'items': [{'photo_id': 1, 'location': None}]})
+    assert response.status_code == 422
+    assert attributes(1)['location'] == "--unset--"
+
+    # Photos of other photographers are out of reach
+    assert client.patch('/photo/jane/attributes', json={'items': items}).json()['matched'] == 0
+
+def test_bulk_patch_limit(monkeypatch):
+    monkeypatch.setattr("photo_service.settings.bulk_attributes_max_items", 2)
+    items = [{'photo_id': photo_id, 'title': "Dunes"} for photo_id in range(3)]
+    assert client.patch('/photo/joe/attributes', json={'items': items}).status_code == 413
+
+@pytest.mark.usefixtures("shoot")
+def test_batch_get():
+    assert client.put('/photo/joe/1/attributes', json=ATTRIBUTES).status_code == 200
+
+    response = client.get('/photo/joe/attributes', params={'ids': "2,9,1"})
+    assert response.status_code == 200
+    items = response.json()['items']
+    assert [item['photo_id'] for item in items] == [2, 9, 1]
+    assert items[0]['attributes']['title'] == "--unset--"
+    assert items[1]['attributes'] is None
+    assert items[2]['attributes'] == dict(ATTRIBUTES, tags=[], tags_status="done")
+
+    response = client.post('/photo/joe/attributes', json={'ids': [1, 1, 0]})
+    assert [item['attributes']['title'] for item in response.json()['items']] == \
+        ["Dunes", "Dunes", "--unset--"]
+
+    assert client.get('/photo/joe/attributes', params={'ids': "1,x"}).status_code == 400
+    assert client.get('/photo/jane/attributes', params={'ids': "1"}).json()['items'] == \
+        [{'photo_id': 1, 'attributes': None}]
+
+@pytest.mark.usefixtures("shoot")
+def test_albums_are_notified(monkeypatch):
+    monkeypatch.setattr("photo_service.settings.album_notification_urls", ["http://albums/"])
+    with unittest.mock.patch('albums_notifier.requests.post') as post:
+        assert client.patch('/photo/joe/0/attributes', json={'title': "Dune"}).status_code == 200
+        assert client.delete('/photo/joe/1').status_code == 204
+        assert client.delete('/photo/joe/1').status_code == 404
+    assert [(call.args[0], call.kwargs['json']) for call in post.call_args_list] == [
+        ("http://albums/photographers/joe/photos/changed", {'photo_ids': ["0"]}),
+        ("http://albums/photographers/joe/photos/deleted", {'photo_ids': ["1"]})]
@@ -0,0 +1,118 @@
+import pytest
+import hashlib
+import os
+from io import BytesIO
+
+from PIL import Image
+
+from starlette.testclient import TestClient
+
+from photo_service import app
+from photo_mongo_wrapper import mongo_save_photo
+from test_renditions import camera_jpeg
+
+client = TestClient(app)
+
+def noisy_jpeg(width=800, height=600):
+    # Noise does not compress: the photo spans several GridFS chunks
+    buf = BytesIO()
+    Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(buf, "JPEG")
+    return buf.getvalue()
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_get_photo_etag_and_not_modified():
+    image = camera_jpeg()
+    assert mongo_save_photo(image, "joe", 0)
+
+    response = client.get("/photo/joe/0")
+    assert response.status_code == 200
+    assert response.content == image
+    assert response.headers["etag"] == '"' + hashlib.md5(image).hexdigest() + '"'
+    assert response.headers["content-length"] == str(len(image))
+    assert "max-age" in response.headers["cache-control"]
+
+    response = client.get("/photo/joe/0", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    last_modified = client.get("/photo/joe/0").headers["last-modified"]
+    response = client.get("/photo/joe/0", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+    response = client.get("/photo/joe/0", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_get_photo_range():
+    image = noisy_jpeg()
+    assert mongo_save_photo(image, "joe", 0)
+
+    # Across the first GridFS chunk boundary (255 kB)
+    response = client.get("/photo/joe/0", headers={"Range": "bytes=261000-261199"})
+    assert response.status_code == 206
+    assert response.content == image[261000:261200]
+    assert response.headers["content-range"] == f"bytes 261000-261199/{len(image)}"
+
+    response = client.get("/photo/joe/0", headers={"Range": "bytes=-100"})
+    assert response.status_code == 206
+    assert response.content == image[-100:]
+
+    response = client.get("/photo/joe/0", headers={"Range": f"bytes={len(image)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(image)}"
+
+    # Invalid ranges are ignored
+    for invalid in ("bytes=5-2", "bytes=-", "bytes=a-9", "bytes=--5"):
+        response = client.get("/photo/joe/0", headers={"Range": invalid})
+        assert response.status_code == 200
+        assert response.content == image
+
+    # A stale If-Range gets the whole photo
+    response = client.get("/photo/joe/0", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == image
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_get_rendition_fallback_is_not_cached():
+    assert mongo_save_photo(camera_jpeg(), "joe", 0)
+
+    response = client.get("/photo/joe/0?rendition=small")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "no-cache"
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_head_photo(monkeypatch):
+    image = noisy_jpeg()
+    assert mongo_save_photo(image, "joe", 0)
+    get = client.get("/photo/joe/0")
+
+    monkeypatch.setattr("gridfs.GridOut.readchunk",
+                        lambda self: pytest.fail("HEAD read the content of the photo"))
+    response = client.head("/photo/joe/0")
+    assert response.status_code == 200
+    assert response.content == b""
+    for header in ("content-length", "content-type", "etag", "last-modified"):
+        assert response.headers[header] == get.headers[header]
+
+    response = client.head("/photo/joe/0", headers={"If-None-Match": get.headers["etag"]})
+    assert response.status_code == 304
+    assert client.head("/photo/joe/1").status_code == 404
+    assert client.head("/photo/jane/0").status_code == 404
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_photos_exist(monkeypatch):
+    for photo_id in (0, 2, 3):
+        assert mongo_save_photo(camera_jpeg(), "joe", photo_id)
+
+    response = client.post("/photo/joe/exists", json={"ids": [3, 1, 0, 3, 7]})
+    assert response.status_code == 200
+    assert response.json() == {"ids": [3, 0]}
+    assert client.post("/photo/jane/exists", json={"ids": [0]}).json() == {"ids": []}
+
+    monkeypatch.setattr("photo_service.settings.bulk_read_max_items", 2)
+    assert client.post("/photo/joe/exists", json={"ids": [0, 2, 3]}).status_code == 413
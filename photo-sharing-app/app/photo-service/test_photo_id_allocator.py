@@ -0,0 +1,108 @@
+import pytest
+import multiprocessing
+import threading
+import unittest.mock
+from concurrent.futures import ThreadPoolExecutor
+
+from mongoengine import connect, disconnect
+
+from photoId import PhotoId
+from photo_mongo_wrapper import (mongo_allocate_photo_id, mongo_reserve_photo_ids,
+                                 PhotoIdLeases)
+from photo_id_benchmark import legacy_allocate_photo_id
+
+THREADS = 16
+PROCESSES = 4
+IDS_PER_WORKER = 200
+
+def allocate_in_process(block_size, count):
+    # Runs in a spawned process: it needs its own connection
+    disconnect()
+    connect("photos", alias="default", host="mongo-service-test")
+    leases = PhotoIdLeases(block_size)
+    return [leases.allocate("joe") for _ in range(count)]
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_first_ids_start_at_zero():
+    assert mongo_allocate_photo_id("joe") == 0
+    assert mongo_allocate_photo_id("joe") == 1
+    assert mongo_allocate_photo_id("jane") == 0
+    assert mongo_reserve_photo_ids("joe", 10) == 2
+    assert mongo_allocate_photo_id("joe") == 12
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+@pytest.mark.parametrize("block_size", [1, 50])
+def test_no_duplicates_across_threads(block_size):
+    leases = PhotoIdLeases(block_size)
+    with ThreadPoolExecutor(THREADS) as pool:
+        ids = list(pool.map(lambda _: leases.allocate("joe"),
+                            range(THREADS * IDS_PER_WORKER)))
+    assert len(set(ids)) == len(ids)
+
+@pytest.mark.parametrize("block_size", [1, 50])
+def test_photographers_allocate_concurrently(block_size):
+    both_reserving = threading.Barrier(2, timeout=5)
+    def reserve(display_name, count=1):
+        # Returns once the other photographer reserves too: one after the
+        # other, the first one gives up waiting
+        both_reserving.wait()
+        return 0
+    leases = PhotoIdLeases(block_size)
+    with unittest.mock.patch('photo_mongo_wrapper.mongo_reserve_photo_ids', reserve):
+        with ThreadPoolExecutor(2) as pool:
+            assert list(pool.map(leases.allocate, ["joe", "jane"])) == [0, 0]
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+@pytest.mark.parametrize("block_size", [1, 50])
+def test_no_duplicates_across_processes(block_size):
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(PROCESSES) as pool:
+        results = pool.starmap(allocate_in_process,
+                               [(block_size, IDS_PER_WORKER)] * PROCESSES)
+    ids = [photo_id for result in results for photo_id in result]
+    assert len(ids) == PROCESSES * IDS_PER_WORKER
+    assert len(set(ids)) == len(ids)
+
+# The collection methods that each make one round trip to the server
+ROUND_TRIPS = ('find', 'find_one', 'find_one_and_update', 'insert_one', 'update_one',
+               'replace_one')
+
+class CountingCollection:
+    """The PhotoId collection, counting the round trips made through it, or
+    through its copies with other options (writes go through those)."""
+
+    def __init__(self, collection, counter=None):
+        self.collection = collection
+        self.counter = counter if counter is not None else self
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if name == 'with_options':
+            return lambda *args, **kwargs: CountingCollection(attribute(*args, **kwargs),
+                                                              self.counter)
+        if name not in ROUND_TRIPS:
+            return attribute
+        def call(*args, **kwargs):
+            self.counter.round_trips += 1
+            return attribute(*args, **kwargs)
+        return call
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_allocation_round_trips(monkeypatch):
+    def round_trips(allocate, display_name, count=200):
+        collection = CountingCollection(PhotoId._get_collection())
+        with monkeypatch.context() as patch:
+            patch.setattr(PhotoId, "_get_collection", classmethod(lambda cls: collection))
+            for _ in range(count):
+                allocate(display_name)
+        return collection.round_trips
+
+    # Read then write, one upsert, one upsert per hundred ids when leasing
+    assert round_trips(legacy_allocate_photo_id, "legacy") == 400
+    assert round_trips(lambda name: mongo_reserve_photo_ids(name), "atomic") == 200
+    assert round_trips(PhotoIdLeases(100).allocate, "leased") == 2
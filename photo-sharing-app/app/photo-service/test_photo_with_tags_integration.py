@@ -8,11 +8,16 @@ import base64,zlib, shutil
 from io import BytesIO
 
 import unittest.mock
+import requests
+
+from photo import Photo
+from photoId import PhotoId
+from tagging_job import TaggingJob
 
 client = TestClient(app)
 
 @unittest.mock.patch('photo_service.tags_client')
-@unittest.mock.patch('photo_service.requests.get')
+@unittest.mock.patch('photo_service.photographers.session.get')
 @pytest.mark.usefixtures("clearPhotos")
 @pytest.mark.usefixtures("initDB")
 def test_post_once(requests_get, tags_client):
@@ -31,6 +36,46 @@ def test_post_once(requests_get, tags_client):
     assert response.headers['Location']
     assert response.status_code == 201
 
+@unittest.mock.patch('photo_service.tags_client')
+@unittest.mock.patch('photo_service.photographers.session.get')
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_post_does_not_wait_for_tags(requests_get, tags_client):
+    requests_get.return_value.status_code = 200
+
+    files = {'file': BytesIO(base64.decodebytes(encoded_image))}
+    response = client.post('/gallery/joe', files=files)
+
+    assert response.status_code == 201
+    tags_client.get_tags.assert_not_called()
+    ph = Photo.objects(display_name='joe', photo_id=0).get()
+    assert ph.tags_status == 'pending'
+    assert ph.title == '--unset--'
+    assert TaggingJob.objects(display_name='joe', photo_id=0).count() == 1
+
+    response = client.get('/tagging/queue')
+    assert response.json()['pending'] == 1
+
+@unittest.mock.patch('photo_service.photographers.session.get')
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_post_unknown_photographer_allocates_no_id(requests_get):
+    requests_get.return_value.status_code = 404
+    files = {'file': BytesIO(base64.decodebytes(encoded_image))}
+    response = client.post('/gallery/nobody-else', files=files)
+    assert response.status_code == 404
+    assert PhotoId.objects(display_name="nobody-else").count() == 0
+
+@unittest.mock.patch('photo_service.photographers.session.get',
+                     side_effect=requests.exceptions.ConnectionError)
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_post_photographer_service_unreachable(requests_get):
+    files = {'file': BytesIO(base64.decodebytes(encoded_image))}
+    response = client.post('/gallery/unreachable', files=files)
+    assert response.status_code == 503
+    assert PhotoId.objects(display_name="unreachable").count() == 0
+
 encoded_image= b"""\
 /9j/wAARCABaAIYDASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QA
 tRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkK
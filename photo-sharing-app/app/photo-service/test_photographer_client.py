@@ -0,0 +1,118 @@
+import pytest
+import asyncio
+import threading
+import time
+import unittest.mock
+from types import SimpleNamespace
+
+import httpx
+import requests
+
+from photographer_client import AsyncPhotographerClient, LookupCache, PhotographerClient
+
+def answering(*statuses, delay=0):
+    """A session.get mock answering `statuses` in turn."""
+    answers = iter(statuses)
+    def get(*args, **kwargs):
+        time.sleep(delay)
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            raise answer
+        return SimpleNamespace(status_code=answer)
+    return unittest.mock.Mock(side_effect=get)
+
+def make_client(**options):
+    return PhotographerClient("http://photographer-service/", 1, **options)
+
+def test_lookups_are_cached():
+    client = make_client()
+    with unittest.mock.patch.object(client.session, 'get', answering(200, 404)) as get:
+        assert [client.lookup("joe") for _ in range(3)] == [200, 200, 200]
+        assert [client.lookup("nobody") for _ in range(3)] == [404, 404, 404]
+        assert get.call_count == 2
+        assert get.call_args.args[0] == "http://photographer-service/photographer/nobody"
+    stats = client.cache_stats()
+    assert (stats["lookups"], stats["hits"], stats["misses"], stats["entries"]) == (6, 4, 2, 2)
+    assert stats["hit_ratio"] == pytest.approx(4 / 6)
+
+def test_failures_are_not_cached():
+    client = make_client()
+    with unittest.mock.patch.object(client.session, 'get',
+                                    answering(requests.ConnectionError(), 503, 200)) as get:
+        with pytest.raises(requests.ConnectionError):
+            client.lookup("joe")
+        assert client.lookup("joe") == 503
+        assert client.lookup("joe") == 200
+        assert client.lookup("joe") == 200
+        assert get.call_count == 3
+    assert client.cache_stats()["errors"] == 1
+
+def test_lookups_expire():
+    client = make_client(ttl=0.2, negative_ttl=0.05)
+    with unittest.mock.patch.object(client.session, 'get', answering(404, 200, 200)) as get:
+        assert client.lookup("joe") == 404
+        time.sleep(0.1)
+        # The photographer has been created meanwhile
+        assert client.lookup("joe") == 200
+        assert client.lookup("joe") == 200
+        assert get.call_count == 2
+        time.sleep(0.25)
+        assert client.lookup("joe") == 200
+        assert get.call_count == 3
+
+def test_invalidate():
+    client = make_client()
+    with unittest.mock.patch.object(client.session, 'get', answering(200, 404)) as get:
+        assert client.lookup("joe") == 200
+        client.invalidate("joe")
+        assert client.lookup("joe") == 404
+
+def test_invalidate_during_lookup():
+    # An answer read before an invalidation must not be cached after it
+    cache = LookupCache()
+    generation = cache.generation
+    cache.invalidate("joe")
+    cache.put("joe", 200, generation)
+    assert cache.get("joe") is None
+
+def test_lru_eviction():
+    cache = LookupCache(max_entries=2)
+    cache.put("a", 200, cache.generation)
+    cache.put("b", 200, cache.generation)
+    assert cache.get("a") == 200
+    cache.put("c", 404, cache.generation)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (200, None, 404)
+
+def test_concurrent_lookups_are_coalesced():
+    client = make_client()
+    with unittest.mock.patch.object(client.session, 'get', answering(200, delay=0.2)) as get:
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.lookup("joe")))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [200] * 20
+        assert get.call_count == 1
+    stats = client.cache_stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] + stats["coalesced"] == 19
+
+@pytest.mark.asyncio
+async def test_async_lookups():
+    calls = []
+    async def photographer_service(request):
+        calls.append(request.url.path)
+        await asyncio.sleep(0.1)
+        return httpx.Response(404 if request.url.path.endswith("nobody") else 200)
+
+    client = AsyncPhotographerClient("http://photographer-service/", 1,
+                                     transport=httpx.MockTransport(photographer_service))
+    results = await asyncio.gather(*[client.lookup("joe") for _ in range(20)],
+                                   client.lookup("nobody"))
+    assert results == [200] * 20 + [404]
+    assert await client.lookup("joe") == 200
+    assert sorted(calls) == ["/photographer/joe", "/photographer/nobody"]
+    assert client.cache_stats()["coalesced"] == 19
+    await client.aclose()
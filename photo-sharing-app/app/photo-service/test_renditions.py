@@ -0,0 +1,126 @@
+import pytest
+import unittest.mock
+from io import BytesIO
+
+import pymongo
+
+from PIL import Image
+from mongoengine.fields import GridFSProxy
+from starlette.testclient import TestClient
+
+from blob import Blob
+from photo import Photo
+from photo_service import app
+from photo_mongo_wrapper import mongo_save_photo
+from renditions import generate_renditions, backfill, preferred_formats
+
+client = TestClient(app)
+
+def camera_jpeg(width=1600, height=1200):
+    buf = BytesIO()
+    Image.new("RGB", (width, height), "orange").save(buf, "JPEG")
+    return buf.getvalue()
+
+def served_image(response):
+    return Image.open(BytesIO(response.content))
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_generate_renditions():
+    assert mongo_save_photo(camera_jpeg(), "joe", 0)
+    assert generate_renditions("joe", 0)
+
+    ph = Photo.objects(display_name="joe", photo_id=0).get()
+    sizes = {(r.name, r.format): (r.width, r.height) for r in ph.renditions}
+    assert sizes[("thumb", "JPEG")] == (160, 120)
+    assert sizes[("small", "WEBP")] == (480, 360)
+    assert sizes[("medium", "JPEG")] == (800, 600)
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_get_rendition_by_accept_header():
+    assert mongo_save_photo(camera_jpeg(), "joe", 0)
+    assert generate_renditions("joe", 0)
+
+    response = client.get("/photo/joe/0?rendition=thumb", headers={"Accept": "image/webp,*/*"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert response.headers["vary"] == "Accept"
+    assert served_image(response).size == (160, 120)
+
+    response = client.get("/photo/joe/0?rendition=thumb", headers={"Accept": "image/jpeg"})
+    assert response.headers["content-type"] == "image/jpeg"
+    assert served_image(response).format == "JPEG"
+
+    response = client.get("/photo/joe/0")
+    assert served_image(response).size == (1600, 1200)
+
+@pytest.mark.parametrize("accept, formats", [
+    (None, ['JPEG']),
+    ("*/*", ['JPEG']),
+    ("image/avif,image/webp,*/*;q=0.8", ['WEBP', 'JPEG']),
+    ("image/webp;q=0, */*", ['JPEG']),
+    ("image/webp; q=0.0,image/*", ['JPEG']),
+    ("image/webp;q=0.5, image/jpeg", ['JPEG', 'WEBP']),
+    ("image/webp, image/jpeg;q=0", ['WEBP']),
+    ("IMAGE/WEBP", ['WEBP']),
+])
+def test_preferred_formats(accept, formats):
+    assert preferred_formats(accept) == formats
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_get_rendition_falls_back_to_original():
+    assert mongo_save_photo(camera_jpeg(), "joe", 0)
+
+    response = client.get("/photo/joe/0?rendition=small")
+    assert response.status_code == 200
+    assert served_image(response).size == (1600, 1200)
+
+    response = client.get("/photo/joe/0?rendition=huge")
+    assert response.status_code == 400
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_backfill():
+    for photo_id in range(3):
+        assert mongo_save_photo(camera_jpeg(), "joe", photo_id)
+    assert generate_renditions("joe", 0)
+
+    assert backfill() == 2
+    assert backfill() == 0
+    assert all(ph.renditions for ph in Photo.objects(display_name="joe"))
+
+def stored_files():
+    return Photo._get_db()['images.files'].count_documents({})
+
+def fail_call(func, number):
+    calls = []
+    def call(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == number:
+            raise pymongo.errors.AutoReconnect("connection lost")
+        return func(*args, **kwargs)
+    return call
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_generate_renditions_retry_writes_files_once():
+    assert mongo_save_photo(camera_jpeg(), "joe", 0)
+    files = stored_files()
+    # The first query finds the blob, the second one stores its renditions
+    with unittest.mock.patch('renditions.Blob.objects',
+                             side_effect=fail_call(Blob.objects, 2)):
+        assert generate_renditions("joe", 0, regenerate=True)
+    renditions = Photo.objects(display_name="joe", photo_id=0).get().renditions
+    assert len(renditions) == 6
+    assert stored_files() == files + 6
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_generate_renditions_deletes_files_of_failed_attempt():
+    assert mongo_save_photo(camera_jpeg(), "joe", 0)
+    files = stored_files()
+    with unittest.mock.patch.object(GridFSProxy, 'put', fail_call(GridFSProxy.put, 3)):
+        assert generate_renditions("joe", 0)
+    assert stored_files() == files + 6
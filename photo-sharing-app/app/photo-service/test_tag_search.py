@@ -0,0 +1,73 @@
+import pytest
+
+from starlette.testclient import TestClient
+
+from photo_mongo_wrapper import mongo_save_photo
+from photo_const import settings
+from photo_service import app
+from sample_images import make_jpeg
+
+client = TestClient(app)
+
+PHOTOS = {("jane", 0): ['beach', 'sunset'],
+          ("jane", 1): ['beach'],
+          ("joe", 0): ['sunset', 'city'],
+          ("joe", 1): ['beach', 'sunset', 'city'],
+          ("joe", 2): []}
+
+@pytest.fixture
+def tagged(initDB, clearPhotos):
+    for ((name, photo_id), tags) in PHOTOS.items():
+        assert mongo_save_photo(make_jpeg(1000), name, photo_id, tags=tags)
+
+def found(response):
+    assert response.status_code == 200
+    return [(item['display_name'], item['photo_id']) for item in response.json()['items']]
+
+@pytest.mark.usefixtures("tagged")
+def test_search_all_and_any():
+    assert found(client.get('/photos/search', params={'tag': ['beach', 'sunset']})) == \
+        [("jane", 0), ("joe", 1)]
+    assert found(client.get('/photos/search', params={'tag': ['beach', 'city'], 'match': 'any'})) == \
+        [("jane", 0), ("jane", 1), ("joe", 0), ("joe", 1)]
+    assert found(client.get('/photos/search', params={'tag': 'sunset', 'display_name': 'joe'})) == \
+        [("joe", 0), ("joe", 1)]
+    assert found(client.get('/photos/search', params={'tag': 'mountain'})) == []
+    assert client.get('/photos/search', params={'tag': 'beach', 'match': 'some'}).status_code == 422
+    assert client.get('/photos/search').status_code == 422
+
+@pytest.mark.usefixtures("tagged")
+def test_search_pages():
+    pages = []
+    params = {'tag': ['beach', 'sunset', 'city'], 'match': 'any', 'limit': 2}
+    while True:
+        response = client.get('/photos/search', params=params)
+        pages.append(found(response))
+        if not response.json()['has_more']:
+            break
+        params['after'] = response.json()['next_cursor']
+    assert pages == [[("jane", 0), ("jane", 1)], [("joe", 0), ("joe", 1)]]
+
+    params['after'] = "garbage"
+    assert client.get('/photos/search', params=params).status_code == 400
+
+@pytest.mark.usefixtures("tagged")
+def test_limits_out_of_range():
+    for path in ['/photos/search', '/photos/tags']:
+        for limit in [0, -1, settings.page_max_limit + 1]:
+            response = client.get(path, params={'tag': 'beach', 'limit': limit})
+            assert response.status_code == 422
+
+@pytest.mark.usefixtures("tagged")
+def test_tag_facets():
+    response = client.get('/photos/tags')
+    assert response.status_code == 200
+    assert response.json() == {'total': 5,
+                               'tags': [{'tag': 'beach', 'count': 3},
+                                        {'tag': 'sunset', 'count': 3},
+                                        {'tag': 'city', 'count': 2}]}
+    # Drilling down: the other tags of the photos with 'city'
+    response = client.get('/photos/tags', params={'tag': 'city', 'limit': 2})
+    assert response.json() == {'total': 2,
+                               'tags': [{'tag': 'city', 'count': 2},
+                                        {'tag': 'sunset', 'count': 2}]}
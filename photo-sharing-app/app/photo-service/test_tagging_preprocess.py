@@ -0,0 +1,58 @@
+import pytest
+import os
+from io import BytesIO
+
+from PIL import Image
+
+from photo_mongo_wrapper import mongo_save_photo, mongo_enqueue_tagging
+from photo import Photo
+from tags import TagsClient
+from tags_standin_server import StandinTagger, serve
+from tags_benchmark import WireCounter
+from tagging_worker import TaggingWorker, downscale
+from test_renditions import camera_jpeg
+
+def noisy_camera_jpeg(width=4000, height=3000):
+    # Noise compresses like a detailed photo: several MB
+    buf = BytesIO()
+    Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(buf, "JPEG")
+    return buf.getvalue()
+
+def test_downscale():
+    image = camera_jpeg(4000, 3000)
+    small = Image.open(BytesIO(downscale(image, 512)))
+    assert small.format == "JPEG"
+    assert small.size == (512, 384)
+
+    # Small enough already, not an image, or disabled: sent as is
+    thumb = camera_jpeg(320, 240)
+    assert downscale(thumb, 512) is thumb
+    assert downscale(b"not an image", 512) == b"not an image"
+    assert downscale(image, 0) is image
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_downscale_before_tagging_saves_bytes():
+    images = [noisy_camera_jpeg() for _ in range(4)]
+    (server, port) = serve(StandinTagger(latency=0, decode=True), "localhost:0")
+    wire = WireCounter(("localhost", port))
+    client = TagsClient(deadline=30)
+    client.connect(f"localhost:{wire.port}")
+    sent = {}
+    try:
+        for max_edge in (0, 512):
+            for (photo_id, image) in enumerate(images):
+                assert mongo_save_photo(image, "joe", photo_id, tags_status='pending')
+                mongo_enqueue_tagging("joe", photo_id)
+            worker = TaggingWorker(client, batch_size=len(images), max_edge=max_edge)
+            wire.reset()
+            assert worker.run_once() == len(images)
+            sent[max_edge] = wire.sent
+            assert all(ph.tags_status == 'done' for ph in Photo.objects(display_name="joe"))
+            Photo.objects.delete()
+    finally:
+        client.close()
+        wire.close()
+        server.stop(None)
+
+    assert sent[512] < sent[0] / 20
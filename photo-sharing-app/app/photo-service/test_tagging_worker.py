@@ -0,0 +1,169 @@
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import grpc
+from mongoengine import NotUniqueError
+
+from photo import Photo
+from tagging_job import TaggingJob
+from photo_mongo_wrapper import (mongo_save_photo, mongo_enqueue_tagging,
+                                 mongo_tagging_queue_depth, mongo_requeue_untagged)
+from tagging_worker import TaggingWorker
+from sample_images import make_jpeg
+
+def upload(photo_id):
+    # Each photo of its own content, not to share the tags of another
+    assert mongo_save_photo(make_jpeg(4096 + photo_id), "joe", photo_id, tags_status='pending')
+    mongo_enqueue_tagging("joe", photo_id)
+
+def tagger(*replies):
+    tags_client = Mock()
+    tags_client.get_tags.side_effect = [reply if isinstance(reply, Exception) else list(reply.tags)
+                                        for reply in replies]
+    return tags_client
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_worker_sets_tags_and_drains_queue():
+    for photo_id in range(3):
+        upload(photo_id)
+    worker = TaggingWorker(tagger(*[SimpleNamespace(tags=['landscape'])] * 3), batch_size=2)
+
+    assert worker.run_once() == 2
+    assert worker.run_once() == 1
+    assert worker.run_once() == 0
+
+    for ph in Photo.objects(display_name="joe"):
+        assert list(ph.tags) == ['landscape']
+        assert ph.tags_status == 'done'
+    assert TaggingJob.objects.count() == 0
+    assert mongo_tagging_queue_depth()['pending'] == 0
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_photo_is_queued_once():
+    upload(0)
+    # As a retry after a lost reply would
+    mongo_enqueue_tagging("joe", 0)
+    assert TaggingJob.objects(display_name="joe", photo_id=0).count() == 1
+    with pytest.raises(NotUniqueError):
+        TaggingJob(display_name="joe", photo_id=0).save(force_insert=True)
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_worker_retries_with_backoff():
+    upload(0)
+    worker = TaggingWorker(tagger(grpc.RpcError("tags service down")))
+
+    assert worker.run_once() == 1
+    job = TaggingJob.objects.get()
+    assert job.state == 'pending'
+    assert job.attempts == 1
+    assert job.not_before > datetime.utcnow()
+    # Backing off: the job is not ready yet
+    assert worker.run_once() == 0
+    assert Photo.objects.get().tags_status == 'pending'
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_worker_gives_up_after_max_attempts():
+    upload(0)
+    worker = TaggingWorker(tagger(grpc.RpcError("tags service down")), max_attempts=1)
+
+    assert worker.run_once() == 1
+    assert TaggingJob.objects.get().state == 'failed'
+    assert Photo.objects.get().tags_status == 'failed'
+    assert mongo_tagging_queue_depth()['failed'] == 1
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_expired_leases_are_claimed_again():
+    upload(0)
+    TaggingJob.objects.update(set__state='running', set__owner='dead-worker',
+                              set__not_before=datetime.utcnow())
+    worker = TaggingWorker(tagger(SimpleNamespace(tags=['portrait'])))
+
+    assert worker.run_once() == 1
+    assert list(Photo.objects.get().tags) == ['portrait']
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_batch_rpc():
+    for photo_id in range(3):
+        upload(photo_id)
+    tags_client = Mock()
+    tags_client.get_tags_batch.return_value = [['landscape'], ['portrait'], ['street']]
+    worker = TaggingWorker(tags_client, batch_size=3, batch_rpc=True)
+
+    assert worker.run_once() == 3
+    assert tags_client.get_tags_batch.call_count == 1
+    assert {ph.photo_id: list(ph.tags) for ph in Photo.objects(display_name="joe")} == \
+        {0: ['landscape'], 1: ['portrait'], 2: ['street']}
+
+    # A failed batch call is retried for all its jobs
+    upload(3)
+    upload(4)
+    tags_client.get_tags_batch.side_effect = grpc.RpcError("tags service down")
+    assert worker.run_once() == 2
+    assert [job.attempts for job in TaggingJob.objects()] == [1, 1]
+
+    # As is one that answers for fewer images than it was sent
+    upload(5)
+    upload(6)
+    tags_client.get_tags_batch.side_effect = None
+    tags_client.get_tags_batch.return_value = [['landscape']]
+    assert worker.run_once() == 2
+    assert [job.attempts for job in TaggingJob.objects(photo_id__in=[5, 6])] == [1, 1]
+    assert [ph.tags_status for ph in Photo.objects(photo_id__in=[5, 6])] == ['pending'] * 2
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_unreadable_photo_fails_its_job_only():
+    for photo_id in range(2):
+        upload(photo_id)
+    tags_client = Mock()
+    tags_client.get_tags_batch.return_value = [['street']]
+    worker = TaggingWorker(tags_client, batch_size=2, batch_rpc=True)
+    prepare = worker.prepare
+    def broken(job):
+        if job.photo_id == 0:
+            raise IOError("no such file in GridFS")
+        return prepare(job)
+    worker.prepare = broken
+
+    assert worker.run_once() == 2
+    assert [job.photo_id for job in TaggingJob.objects()] == [0]
+    assert TaggingJob.objects.get().attempts == 1
+    assert list(Photo.objects(photo_id=1).get().tags) == ['street']
+
+def test_worker_survives_errors():
+    worker = TaggingWorker(Mock(), poll_interval=0.01)
+    calls = []
+    def run_once():
+        calls.append(None)
+        if len(calls) == 3:
+            worker.stopped.set()
+        raise RuntimeError("unexpected")
+    worker.run_once = run_once
+    worker.run()
+    assert len(calls) == 3
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_sweep_queues_photos_left_without_job():
+    upload(0)
+    # An upload that failed to queue its photo
+    assert mongo_save_photo(make_jpeg(5000), "joe", 1, tags_status='pending')
+    assert mongo_save_photo(make_jpeg(5001), "joe", 2)
+    worker = TaggingWorker(Mock(), sweep_interval=300)
+
+    worker.sweep()
+    assert sorted(TaggingJob.objects.scalar('photo_id')) == [0, 1]
+    # Not before sweep_interval
+    assert mongo_save_photo(make_jpeg(5002), "joe", 3, tags_status='pending')
+    worker.sweep()
+    assert TaggingJob.objects.count() == 2
+    assert mongo_requeue_untagged(batch_size=1) == 1
+    assert mongo_requeue_untagged() == 0
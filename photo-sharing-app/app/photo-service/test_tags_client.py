@@ -0,0 +1,84 @@
+import pytest
+import threading
+import time
+from concurrent import futures
+
+import grpc
+
+import tags_pb2
+import tags_pb2_grpc
+from tags import TagsClient
+
+class Tagger(tags_pb2_grpc.TagsServicer):
+    """Tags each image with its length; images of b"hang" never return."""
+
+    def tags(self, image):
+        if image == b"hang":
+            time.sleep(5)
+        return tags_pb2.TagsReply(tags=[str(len(image))])
+
+    def getTags(self, request, context):
+        return self.tags(request.file)
+
+    def getTagsBatch(self, request, context):
+        return tags_pb2.TagsBatchReply(replies=[self.tags(image.file) for image in request.images])
+
+    def streamTags(self, request_iterator, context):
+        for request in request_iterator:
+            reply = self.tags(request.file)
+            reply.id = request.id
+            yield reply
+
+class UnaryTagger(tags_pb2_grpc.TagsServicer):
+    """A tags service from before getTagsBatch."""
+
+    def getTags(self, request, context):
+        return tags_pb2.TagsReply(tags=[str(len(request.file))])
+
+def serve(servicer):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=8))
+    tags_pb2_grpc.add_TagsServicer_to_server(servicer, server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    return (server, f"localhost:{port}")
+
+@pytest.fixture
+def tagger():
+    (server, address) = serve(Tagger())
+    client = TagsClient(channels=3, deadline=1, compression=True)
+    client.connect(address)
+    yield client
+    client.close()
+    server.stop(None)
+
+def test_get_tags(tagger):
+    assert tagger.get_tags(b"12345") == ["5"]
+    assert len(tagger.channels) == 3
+    # The channels of the pool are used in turn
+    assert len({id(tagger.next_stub()) for _ in range(3)}) == 3
+
+def test_get_tags_batch(tagger):
+    assert tagger.get_tags_batch([b"1", b"22", b"333"]) == [["1"], ["2"], ["3"]]
+
+def test_stream_tags(tagger):
+    assert sorted(tagger.stream_tags(iter([b"1", b"22", b"333"]))) == \
+        [(0, ["1"]), (1, ["2"]), (2, ["3"])]
+
+def test_deadline(tagger):
+    start = time.perf_counter()
+    with pytest.raises(grpc.RpcError) as e:
+        tagger.get_tags(b"hang")
+    assert e.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+    assert time.perf_counter() - start < 2
+
+def test_batch_falls_back_to_unary():
+    (server, address) = serve(UnaryTagger())
+    client = TagsClient()
+    client.connect(address)
+    try:
+        assert client.get_tags_batch([b"1", b"22"]) == [["1"], ["2"]]
+        assert not client.batch_supported
+        assert client.get_tags_batch([b"333"]) == [["3"]]
+    finally:
+        client.close()
+        server.stop(None)
@@ -0,0 +1,64 @@
+import pytest
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+
+from tags import TagsClient
+from tags_standin_server import StandinTagger, serve
+from tags_benchmark import WireCounter, run
+
+@pytest.fixture
+def standin(request):
+    tagger = StandinTagger(**request.param)
+    (server, port) = serve(tagger, "localhost:0")
+    client = TagsClient(deadline=5)
+    client.connect(f"localhost:{port}")
+    yield (tagger, client, port)
+    client.close()
+    server.stop(None)
+
+@pytest.mark.parametrize("standin", [dict(latency=0.1, per_image=0.05)], indirect=True)
+def test_latency(standin):
+    (tagger, client, port) = standin
+    start = time.perf_counter()
+    assert client.get_tags(b"image") == ["landscape", "nature"]
+    assert client.get_tags_batch([b"1", b"2", b"3"]) == [["landscape", "nature"]] * 3
+    # 0.1 + 0.05, then 0.1 + 3 * 0.05
+    assert time.perf_counter() - start >= 0.4
+    assert (tagger.calls, tagger.images) == (2, 4)
+
+@pytest.mark.parametrize("standin", [dict(latency=0, error_rate=1)], indirect=True)
+def test_errors_are_retried(standin):
+    (tagger, client, port) = standin
+    with pytest.raises(grpc.RpcError) as e:
+        client.get_tags(b"image")
+    assert e.value.code() == grpc.StatusCode.UNAVAILABLE
+    # The retry policy of TagsClient
+    assert tagger.calls == 3
+
+@pytest.mark.parametrize("standin", [dict(latency=0.1, max_concurrency=1)], indirect=True)
+def test_concurrency_limit(standin):
+    (tagger, client, port) = standin
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(client.get_tags, [b"image"] * 4))
+    assert time.perf_counter() - start >= 0.4
+
+@pytest.mark.parametrize("standin", [dict(latency=0.01)], indirect=True)
+def test_benchmark(standin):
+    (tagger, _, port) = standin
+    wire = WireCounter(("localhost", port))
+    client = TagsClient()
+    client.connect(f"localhost:{wire.port}")
+    try:
+        for mode in ('unary', 'batch', 'stream'):
+            result = run(client, wire, mode, calls=4, concurrency=2, batch_size=3,
+                         image_size=10000)
+            images = 4 if mode == 'unary' else 12
+            assert (result['images'], result['errors']) == (images, 0)
+            assert result['bytes_sent'] > images * 10000
+            assert result['p99_ms'] >= result['p50_ms'] >= 10
+    finally:
+        client.close()
+        wire.close()
@@ -0,0 +1,34 @@
+import pytest
+import tracemalloc
+
+from photo import Photo
+from photo_mongo_wrapper import mongo_save_photo
+from sample_images import make_jpeg
+
+MB = 1024 * 1024
+# GridFS chunks are 255kB: storing an upload must not need more than a
+# few of them in memory, whatever the size of the image
+PEAK_BOUND = 4 * MB
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+@pytest.mark.parametrize("size_mb", [1, 10, 50])
+def test_upload_peak_memory(size_mb):
+    image = make_jpeg(size_mb * MB)
+
+    tracemalloc.start()
+    try:
+        assert mongo_save_photo(image, "joe", size_mb)
+        (current, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < PEAK_BOUND
+
+    ph = Photo.objects(display_name="joe", photo_id=size_mb).get()
+    assert ph.image_file.length == len(image)
+    assert ph.image_file.content_type == "image/jpeg"
+
+@pytest.mark.usefixtures("clearPhotos")
+@pytest.mark.usefixtures("initDB")
+def test_upload_rejects_non_images():
+    assert not mongo_save_photo(b"not an image", "joe", 0)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+# The total count of photographers sent with each page of them. Counting the
+# collection on every request costs as much as a full index scan: the count
+# is read now and then, and kept up to date in between with the photographers
+# this instance creates and deletes.
+
+import time
+
+
+class CachedCount:
+    """A count read with `count`, a coroutine function, at most once every
+    `ttl` seconds; in between, add() follows the changes we make."""
+
+    def __init__(self, count, ttl, clock=time.monotonic):
+        self._count = count
+        self.ttl = ttl
+        self._clock = clock
+        self._value = None
+        self._read_at = 0.0
+
+    async def get(self):
+        now = self._clock()
+        if self._value is None or now - self._read_at >= self.ttl:
+            self._value = await self._count()
+            self._read_at = now
+        return self._value
+
+    def add(self, delta):
+        if self._value is not None:
+            self._value = max(self._value + delta, 0)
+
+    def invalidate(self):
+        self._value = None
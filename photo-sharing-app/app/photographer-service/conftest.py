@@ -5,6 +5,7 @@ import motor
 from fastapi.testclient import TestClient
 from beanie import Document, init_beanie
 from models import Photographer
+import photographer_service
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
@@ -13,6 +14,11 @@ from pydantic_settings import BaseSettings
 async def clearPhotographers():
     await Photographer.find().delete()
 
+@pytest.fixture(autouse=True)
+def clearPhotographerCount():
+    """Forgets the count of photographers of the previous tests."""
+    photographer_service.photographer_count.invalidate()
+
 @pytest_asyncio.fixture
 async def initDB():
     class Settings(BaseSettings):
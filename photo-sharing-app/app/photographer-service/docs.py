@@ -22,13 +22,26 @@ get_photographers_doc="""
 This operation allows to get a list of photographers.
 Since a large number of items could be returned by such a call, a pagination system is used. This
 is quite common in REST APIs. The `offset` and `limit` are passed as *query* parameters (see example
-below) to limit the number of items returned by a single request.
+below) to limit the number of items returned by a single request; `limit` is at most `page_max_limit`.
 
 A JSON object is returned in the body of the HTTP response:
 * The `items` key is an array of JSON objects with attributes `display_name` and `link` (to the photographer resource).
 * The `has_more` key indicates if there are still other items that can be retrieved (by another query).
+* The `next_cursor` key, when there are, is to be passed as the `after` *query* parameter to get the next
+page. Pages fetched this way take the same time however far in the list they are, unlike those fetched
+with a large `offset`.
 
 Moreover, the total count of photographers is returned in the `X-total-count` header of the HTTP response.
+It is counted again every `count_ttl` seconds, so it may lag behind the changes made through other instances.
+"""
+
+lookup_photographers_doc="""
+This operation allows to retrieve several photographers at once, with a single query.
+Their display names are given, comma separated, in the `names` *query* parameter.
+
+A JSON object is returned in the body of the HTTP response:
+* The `items` key is an array of the photographers found, in the order of the names asked for.
+* The `missing` key is an array of the names of the photographers that do not exist.
 """
 
 head_photographers_doc="""
@@ -2,8 +2,9 @@
 
 from fastapi import Path
 from pydantic import BaseModel, Field
-from typing import List
-from beanie import Document
+from typing import List, Optional
+from beanie import Document, PydanticObjectId
+from pymongo import IndexModel
 
 
 class Dname:
@@ -53,8 +54,25 @@ class PhotographerDigest(BaseModel):
 class Photographers(BaseModel):
     items: List[PhotographerDigest]
     has_more: bool
+    # To pass as `after` for the next page, if there is one
+    next_cursor: Optional[str] = None
+
+
+# Projection of the photographers listed: their id and display name only
+class PhotographerName(BaseModel):
+    id: PydanticObjectId = Field(alias="_id")
+    display_name: str
+
+
+class PhotographerLookup(BaseModel):
+    # In the order of the names asked for
+    items: List[PhotographerDesc]
+    missing: List[str]
 
 
 # Model for Mongo
 class Photographer(Document, PhotographerDesc):
-    pass
+    class Settings:
+        # Display names identify photographers: the index rejects duplicates,
+        # even those created concurrently
+        indexes = [IndexModel("display_name", unique=True)]
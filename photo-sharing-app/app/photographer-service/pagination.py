@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+# Opaque cursors for keyset pagination: a page ends with the cursor of its
+# last item, and the next page starts right after it with an indexed range
+# query instead of skipping over all the items before it.
+#
+# encode_cursor and decode_cursor are the ones of the photo-service: keep
+# them identical.
+
+import base64
+import json
+
+from beanie import PydanticObjectId
+from bson.errors import InvalidId
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return the key encoded in `cursor`; ValueError if it is not one of
+    ours."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+
+def decode_id_cursor(cursor):
+    """Return the document id encoded in `cursor`; ValueError if it is not
+    one."""
+    try:
+        return PydanticObjectId(decode_cursor(cursor))
+    except (TypeError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
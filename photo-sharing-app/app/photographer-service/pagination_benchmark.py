@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Latency of a page of GET /photographers at increasing depths in a large
+# collection, fetched with skip(offset) as the service used to, or after the
+# cursor of the previous page, and the cost of each way to count it:
+#   python pagination_benchmark.py --host mongodb://localhost:27017 --count 1000000
+# The queries are those the service sends. The collection is filled once,
+# in a database of its own, and kept for the next runs.
+
+import argparse
+import statistics
+import time
+
+import pymongo
+
+LIMIT = 10
+DIGEST = {'_id': 1, 'display_name': 1}
+
+
+def fill(collection, count, batch=10000):
+    """Insert photographers until there are `count` of them."""
+    have = collection.estimated_document_count()
+    for start in range(have, count, batch):
+        collection.insert_many([{'display_name': f"p{number}", 'first_name': "robert",
+                                 'last_name': "doisneau", 'interests': ["street", "portrait"]}
+                                for number in range(start, min(start + batch, count))],
+                               ordered=False)
+
+
+def by_offset(collection, offset):
+    return list(collection.find({}, DIGEST).sort('_id').skip(offset).limit(LIMIT + 1))
+
+
+def by_cursor(collection, after):
+    return list(collection.find({'_id': {'$gt': after}}, DIGEST).sort('_id').limit(LIMIT + 1))
+
+
+def timed(function, *args, repeat=5):
+    """The median milliseconds `function(*args)` takes."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def cursors(collection, depths):
+    """The _id after which each page of `depths` starts, read once, ahead
+    of the measures."""
+    found = {}
+    for depth in depths:
+        if depth:
+            found[depth] = collection.find({}, {'_id': 1}).sort('_id').skip(depth - 1).limit(1)[0]['_id']
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark photographer listings")
+    parser.add_argument('--host', default="mongodb://localhost:27017")
+    parser.add_argument('--database', default="photographers_benchmark")
+    parser.add_argument('--count', type=int, default=1000 * 1000)
+    parser.add_argument('--depths', default="0,1000,10000,100000,500000,990000")
+    args = parser.parse_args()
+    collection = pymongo.MongoClient(args.host)[args.database]['Photographer']
+    fill(collection, args.count)
+    depths = [depth for depth in map(int, args.depths.split(",")) if depth < args.count]
+    after = cursors(collection, depths)
+    print(f"{args.count} photographers, pages of {LIMIT}, median ms")
+    print(f"{'depth':>8} {'offset':>9} {'cursor':>9}")
+    for depth in depths:
+        offset_ms = timed(by_offset, collection, depth)
+        cursor_ms = timed(by_cursor, collection, after[depth]) if depth else offset_ms
+        print(f"{depth:>8} {offset_ms:9.2f} {cursor_ms:9.2f}")
+    print(f"count_documents {timed(collection.count_documents, {}):9.2f} ms  "
+          f"estimated_document_count {timed(collection.estimated_document_count):9.2f} ms")
@@ -2,23 +2,31 @@
 
 import uvicorn
 
-from fastapi import Body, FastAPI, HTTPException, Path
+from fastapi import BackgroundTasks, Body, FastAPI, HTTPException, Path, Query
 from starlette.responses import Response
 from fastapi.logger import logger
 
 from contextlib import asynccontextmanager
 from pydantic_settings import BaseSettings
+from typing import List, Optional
+import logging
 import pymongo
+import requests
 from models import (
     Dname,
     Photographer,
     PhotographerDesc,
     Photographers,
     PhotographerDigest,
+    PhotographerLookup,
+    PhotographerName,
 )
+from pagination import encode_cursor, decode_id_cursor
+from cached_count import CachedCount
 import docs
 
 from beanie import init_beanie
+from beanie.operators import In
 import motor
 
 
@@ -29,10 +37,34 @@ class Settings(BaseSettings):
     mongo_password: str = ""
     database_name: str = "photographers"
     auth_database_name: str = "photographers"
+    # Base URLs of the services caching photographer lookups (photo-service,
+    # albums-service), told to forget a photographer when it is created,
+    # updated or deleted
+    cache_invalidation_urls: List[str] = []
+    # Seconds the count of photographers (X-Total-Count) is served before
+    # being counted again
+    count_ttl: float = 30
+    # Photographers looked up with one request at most
+    lookup_max_names: int = 1000
+    # Photographers listed by one page at most
+    page_max_limit: int = 100
 
 
 settings = Settings()
 
+photographer_count = CachedCount(lambda: Photographer.count(), settings.count_ttl)
+
+invalidation_logger = logging.getLogger(__name__)
+
+
+def invalidate_caches(display_name: str) -> None:
+    for url in settings.cache_invalidation_urls:
+        try:
+            requests.delete(f"{url.rstrip('/')}/cache/photographers/{display_name}", timeout=2)
+        except requests.exceptions.RequestException as e:
+            # The entry expires on its own anyway
+            invalidation_logger.warning(f"Could not invalidate {display_name} at {url}: {e}")
+
 
 # FastAPI logging
 # gunicorn_logger = logging.getLogger('gunicorn.error')
@@ -71,6 +103,7 @@ app = FastAPI(
 )
 async def create_photographer(
     response: Response,
+    background_tasks: BackgroundTasks,
     photographer_desc: PhotographerDesc = Body(
         example={
             "display_name": "rdoisneau",
@@ -80,19 +113,18 @@ async def create_photographer(
         }
     ),
 ):
+    new_photographer = Photographer(**dict(photographer_desc))
     try:
-        check = await Photographer.find_one(
-            Photographer.display_name == photographer_desc.display_name
-        )
-        if check is None:
-            new_photographer = Photographer(**dict(photographer_desc))
-            await new_photographer.insert()
-            response.headers["Location"] = f"/photographer/{photographer_desc.display_name}"
-            return new_photographer  # Retourner le photographe créé
-        else:
-            raise HTTPException(status_code=409, detail="Conflict")
+        # The unique index on display_name tells duplicates apart
+        await new_photographer.insert()
+    except pymongo.errors.DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Conflict")
     except pymongo.errors.ServerSelectionTimeoutError:
         raise HTTPException(status_code=503, detail="Mongo unavailable")
+    photographer_count.add(1)
+    background_tasks.add_task(invalidate_caches, photographer_desc.display_name)
+    response.headers["Location"] = f"/photographer/{photographer_desc.display_name}"
+    return new_photographer  # Retourner le photographe créé
 
 
 ################################################################################
@@ -105,7 +137,7 @@ async def create_photographer(
 )
 async def head_photographers(response: Response) -> None:
     try:
-        response.headers["X-Total-Count"] = str(await Photographer.count())
+        response.headers["X-Total-Count"] = str(await photographer_count.get())
     except pymongo.errors.ServerSelectionTimeoutError:
         raise HTTPException(status_code=503, detail="Mongo unavailable")
 
@@ -119,23 +151,66 @@ async def head_photographers(response: Response) -> None:
     tags=["photographers"],
 )
 async def get_photographers(
-    response: Response, offset: int = 0, limit: int = 10
+    response: Response,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=settings.page_max_limit),
+    after: Optional[str] = None,
 ) -> Photographers:
-    photographer_digests = list()
-    last_id = 0
     try:
-        response.headers["X-Total-Count"] = str(await Photographer.count())
-        async for result in Photographer.find().sort("_id").skip(offset).limit(limit):
-            digest = PhotographerDigest(
-                display_name=result.display_name,
-                link="/photographer/" + result.display_name,
-            )
-            last_id = result.id
-            photographer_digests.append(digest)
+        after_id = decode_id_cursor(after) if after is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        response.headers["X-Total-Count"] = str(await photographer_count.get())
+        if after_id is None:
+            query = Photographer.find().sort("_id").skip(offset)
+        else:
+            # Right after the previous page, from the _id index
+            query = Photographer.find(Photographer.id > after_id).sort("_id")
+        # One more than asked for tells whether there is a next page
+        found = await query.limit(limit + 1).project(PhotographerName).to_list()
+    except pymongo.errors.ServerSelectionTimeoutError:
+        raise HTTPException(status_code=503, detail="Mongo unavailable")
+    has_more = len(found) > limit
+    photographer_digests = [
+        PhotographerDigest(
+            display_name=result.display_name,
+            link="/photographer/" + result.display_name,
+        )
+        for result in found[:limit]
+    ]
+    next_cursor = (encode_cursor(str(found[limit - 1].id))
+                   if has_more and photographer_digests else None)
+    return {"items": photographer_digests, "has_more": has_more, "next_cursor": next_cursor}
+
+
+################################################################################
+@app.get(
+    "/photographers/lookup",
+    response_model=PhotographerLookup,
+    status_code=200,
+    summary="Get several Photographers",
+    description=docs.lookup_photographers_doc,
+    tags=["photographers"],
+)
+async def lookup_photographers(names: str):
+    wanted = [name.strip() for name in names.split(",") if name.strip()]
+    if len(wanted) > settings.lookup_max_names:
+        raise HTTPException(
+            status_code=413, detail=f"At most {settings.lookup_max_names} photographers"
+        )
+    try:
+        found = await Photographer.find(
+            In(Photographer.display_name, list(set(wanted)))
+        ).project(PhotographerDesc).to_list()
     except pymongo.errors.ServerSelectionTimeoutError:
         raise HTTPException(status_code=503, detail="Mongo unavailable")
-    has_more = await Photographer.find(Photographer.id > last_id).to_list()
-    return {"items": photographer_digests, "has_more": True if len(has_more) else False}
+    by_name = {photographer.display_name: photographer for photographer in found}
+    wanted = list(dict.fromkeys(wanted))
+    return {
+        "items": [by_name[name] for name in wanted if name in by_name],
+        "missing": [name for name in wanted if name not in by_name],
+    }
 
 
 ################################################################################
@@ -175,6 +250,7 @@ async def get_photographer(
     tags=["photographer"],
 )
 async def update_photographer(
+    background_tasks: BackgroundTasks,
     display_name: str = Path(
         title="The display name of the photographer",
         max_length=16,
@@ -200,6 +276,7 @@ async def update_photographer(
             )
         else:
             await found.set(dict(photographer))
+            background_tasks.add_task(invalidate_caches, display_name)
     except pymongo.errors.ServerSelectionTimeoutError:
         raise HTTPException(status_code=503, detail="Mongo unavailable")
 
@@ -213,6 +290,7 @@ async def update_photographer(
     tags=["photographer"],
 )
 async def delete_photographer(
+    background_tasks: BackgroundTasks,
     display_name: str = Path(
         title="The display name of the photographer",
         max_length=16,
@@ -226,6 +304,8 @@ async def delete_photographer(
         if photographer is None:
             raise HTTPException(status_code=404, detail="Photographer does not exist")
         await photographer.delete()  # Delete the photographer from the database
+        photographer_count.add(-1)
+        background_tasks.add_task(invalidate_caches, display_name)
     except pymongo.errors.ServerSelectionTimeoutError:
         raise HTTPException(status_code=503, detail="Mongo unavailable")
 
@@ -1,8 +1,11 @@
+import asyncio
 import json
 import pytest
+from unittest.mock import patch
 from httpx import AsyncClient
 from httpx import ASGITransport
-from photographer_service import app
+from photographer_service import app, settings
+from cached_count import CachedCount
 
 headers_content = {"Content-Type": "application/json"}
 
@@ -106,3 +109,117 @@ async def test_delete_photographer():
 
         response = await ac.get(f"/photographer/{data1['display_name']}")
         assert response.status_code == 404
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("clearPhotographers")
+@pytest.mark.usefixtures("initDB")
+async def test_delete_photographer_invalidates_caches():
+    """Test que les services qui mettent en cache les photographes sont prévenus."""
+    with patch.object(settings, "cache_invalidation_urls", ["http://photo-service:8001/"]), \
+         patch("photographer_service.requests.delete") as delete:
+        async with AsyncClient(transport=ASGITransport(app), base_url="http://testserver") as ac:
+            response = await ac.post(
+                "/photographers", headers=headers_content, content=json.dumps(data1)
+            )
+            assert response.status_code == 201
+            response = await ac.delete(f"/photographer/{data1['display_name']}")
+            assert response.status_code == 204
+    assert delete.call_count == 2
+    assert delete.call_args.args[0] == "http://photo-service:8001/cache/photographers/rdoisneau"
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("clearPhotographers")
+@pytest.mark.usefixtures("initDB")
+async def test_photographers_pages():
+    """Test de pagination par curseur et du nombre total de photographes."""
+    names = [f"photographer{number}" for number in range(5)]
+    async with AsyncClient(transport=ASGITransport(app), base_url="http://testserver") as ac:
+        for name in names:
+            response = await ac.post(
+                "/photographers", headers=headers_content,
+                content=json.dumps(dict(data1, display_name=name))
+            )
+            assert response.status_code == 201
+
+        listed = []
+        response = await ac.get("/photographers?limit=2")
+        while True:
+            assert response.status_code == 200
+            assert response.headers["X-Total-Count"] == "5"
+            listed += [item["display_name"] for item in response.json()["items"]]
+            if not response.json()["has_more"]:
+                assert response.json()["next_cursor"] is None
+                break
+            response = await ac.get(f"/photographers?limit=2&after={response.json()['next_cursor']}")
+        assert listed == names
+
+        response = await ac.delete(f"/photographer/{names[0]}")
+        assert response.status_code == 204
+        response = await ac.head("/photographers")
+        assert response.headers["X-Total-Count"] == "4"
+
+        response = await ac.get("/photographers?after=nope")
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_photographers_page_bounds():
+    """Test que limit et offset hors bornes sont refusés avant toute requête."""
+    async with AsyncClient(transport=ASGITransport(app), base_url="http://testserver") as ac:
+        for params in ["limit=0", "limit=-1", f"limit={settings.page_max_limit + 1}", "offset=-1"]:
+            response = await ac.get(f"/photographers?{params}")
+            assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_cached_count():
+    """Test que le nombre de photographes n'est recompté qu'après count_ttl secondes."""
+    now = [0.0]
+    counts = []
+
+    async def count():
+        counts.append(now[0])
+        return 10
+
+    cached = CachedCount(count, 30, clock=lambda: now[0])
+    assert await cached.get() == 10
+    cached.add(1)
+    now[0] = 29
+    assert await cached.get() == 11
+    assert counts == [0.0]
+    now[0] = 30
+    assert await cached.get() == 10
+    assert counts == [0.0, 30]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("clearPhotographers")
+@pytest.mark.usefixtures("initDB")
+async def test_post_concurrently():
+    """Test que deux créations simultanées du même photographe n'en créent qu'un."""
+    async with AsyncClient(transport=ASGITransport(app), base_url="http://testserver") as ac:
+        responses = await asyncio.gather(*[
+            ac.post("/photographers", headers=headers_content, content=json.dumps(data1))
+            for _ in range(5)
+        ])
+        assert sorted(response.status_code for response in responses) == [201, 409, 409, 409, 409]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("clearPhotographers")
+@pytest.mark.usefixtures("initDB")
+async def test_lookup_photographers():
+    """Test de la recherche de plusieurs photographes en une requête."""
+    async with AsyncClient(transport=ASGITransport(app), base_url="http://testserver") as ac:
+        for data in (data1, data2):
+            await ac.post("/photographers", headers=headers_content, content=json.dumps(data))
+
+        response = await ac.get("/photographers/lookup?names=adams,nobody,rdoisneau,adams")
+        assert response.status_code == 200
+        assert [item["display_name"] for item in response.json()["items"]] == ["adams", "rdoisneau"]
+        assert response.json()["items"][0] == data2
+        assert response.json()["missing"] == ["nobody"]
+
+        with patch.object(settings, "lookup_max_names", 1):
+            response = await ac.get("/photographers/lookup?names=adams,rdoisneau")
+        assert response.status_code == 413